@@ -0,0 +1,194 @@
+import os
+
+import pandas as pd
+
+import DataCollection.DB as DB
+import DataCollection.DBScrapeUtils as dbutil
+import DataCollection.Spool as Spool
+import DataCollection.Storage as Storage
+from DataCollection.BulkLoad import convert_columns
+
+# games written per transaction: larger batches commit less often, smaller
+# ones hold locks for less time and lose less to a dropped connection
+BATCH_SIZE = int(os.environ.get("CBB_BATCH_SIZE", 100))
+
+
+def reason(error):
+    """Message of an error as unicode; str() fails on a unicode message under Python 2"""
+    try:
+        return unicode(error)
+    except UnicodeError:
+        return repr(error)
+
+
+class BatchWriter(object):
+    """
+    Write scraped games to the database many per transaction. Each game is
+    written inside its own savepoint, so a game that fails is rolled back
+    alone, recorded in scrape_errors with the reason, and the batch carries
+    on. The transaction is committed every batch_size games and on close.
+
+    If the database becomes unavailable, the converted rows of the games not
+    yet committed are spooled for DBScrapeUtils.replay_spool.
+
+    Games are written to storage, by default the one CBB_STORAGE selects
+    (see Storage.get_storage), with its WRITERS.
+
+        with BatchWriter() as writer:
+            writer.write('box', box_table.values)
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, storage=None):
+        self.batch_size = batch_size
+        self.storage = storage if storage is not None else Storage.get_storage()
+        self.conn = None
+        # (table, rows) of the games written in the open transaction
+        self.pending = []
+        self.games = 0
+        self.written = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # games already written are committed even if the caller failed
+        self.close()
+
+    def cursor(self):
+        if self.conn is None:
+            self.conn = self.storage.connect()
+        return self.conn.cursor()
+
+    def savepoint(self, func):
+        """Call func(cursor) inside a savepoint. Return the error it was rolled back for, or None"""
+        cur = self.cursor()
+        cur.execute("SAVEPOINT game")
+        try:
+            func(cur)
+        except dbutil.UNAVAILABLE:
+            raise
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT game")
+            return e
+        cur.execute("RELEASE SAVEPOINT game")
+        return None
+
+    def run(self, game_id, table, func, rows=None):
+        """
+        INPUT: BatchWriter, INT, STRING, FUNCTION, DATAFRAME
+        OUTPUT: BOOL
+
+        Call func(cursor) for one game inside a savepoint. Return False if it
+        failed, after recording the failure in scrape_errors. rows are the
+        game's rows, spooled under table if the database becomes unavailable
+        before they are committed.
+        """
+        if rows is not None:
+            self.pending.append((table, rows))
+        try:
+            error = self.savepoint(func)
+            if error is None:
+                self.written += 1
+            else:
+                if rows is not None:
+                    self.pending.pop()
+                self.record(game_id, table, error)
+            self.games += 1
+            if self.games >= self.batch_size:
+                self.commit()
+            return error is None
+        except dbutil.UNAVAILABLE:
+            self.lost()
+            raise
+
+    def write_game(self, game_id, table, rows):
+        """
+        INPUT: BatchWriter, INT, STRING, DATAFRAME
+        OUTPUT: BOOL
+
+        Write one game's converted rows for table with the storage's WRITERS.
+        Return True if they were written. If the database is unavailable the
+        game is spooled with the rest of the open transaction.
+        """
+        try:
+            return self.run(game_id, table, lambda cur: self.storage.WRITERS[table](cur, rows), rows)
+        except dbutil.UNAVAILABLE:
+            return False
+
+    def write(self, table, values):
+        """
+        INPUT: BatchWriter, STRING, 2D ARRAY
+        OUTPUT: INT
+
+        Convert scraped values for table (box, raw_pbp or pbp) and write each
+        game in them with write_game. Return the number of games written.
+        """
+        rows = convert_columns(values, DB.COLUMNS[table], DB.COLUMN_TYPES[table])
+        return sum(self.write_game(game_id, table, game_rows)
+                   for game_id, game_rows in rows.groupby('game_id', sort=False))
+
+    def execute(self, q, params=None):
+        """
+        INPUT: BatchWriter, STRING, TUPLE
+        OUTPUT: BOOL
+
+        Run a statement that is not a game's rows, e.g. bookkeeping, inside a
+        savepoint of the open transaction. It is not counted as a game.
+        Return False if it failed or the database is unavailable.
+        """
+        try:
+            return self.savepoint(lambda cur: cur.execute(q, params)) is None
+        except dbutil.UNAVAILABLE:
+            self.lost()
+            return False
+
+    def record(self, game_id, table, error):
+        """
+        Insert a failed game into scrape_errors in its own savepoint, so an
+        insert that fails cannot abort the games after it in the transaction
+        """
+        params = (None if game_id is None else int(game_id), table, type(error).__name__,
+                  reason(error))
+        self.failed += 1
+        failure = self.savepoint(lambda cur: cur.execute(
+            """ INSERT INTO scrape_errors (game_id, tbl, error, reason)
+                VALUES ({vals})
+            """.format(vals=self.storage.placeholders(4)), params))
+        if failure is not None:
+            print("could not record failed game %s: %r" % (game_id, failure))
+
+    def fail(self, game_id, table, error):
+        """Record a game that failed before it could be written, e.g. a page that did not parse"""
+        try:
+            self.record(game_id, table, error)
+        except dbutil.UNAVAILABLE:
+            self.lost()
+
+    def commit(self):
+        if self.conn is not None:
+            self.conn.commit()
+        self.pending = []
+        self.games = 0
+
+    def lost(self):
+        """Spool the games of the open transaction and drop its broken connection"""
+        tables = sorted(set(table for table, rows in self.pending))
+        for table in tables:
+            Spool.write(table, pd.concat([rows for t, rows in self.pending if t == table]))
+        if len(self.pending) > 0:
+            print("database unavailable, spooled %s uncommitted games" % len(self.pending))
+        self.pending = []
+        self.games = 0
+        if self.conn is not None:
+            self.storage.release(self.conn, close=True)
+            self.conn = None
+
+    def close(self):
+        try:
+            self.commit()
+        except dbutil.UNAVAILABLE:
+            self.lost()
+        if self.conn is not None:
+            self.storage.release(self.conn)
+            self.conn = None
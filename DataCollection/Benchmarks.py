@@ -0,0 +1,230 @@
+import json
+import sys
+import time
+
+import DataCollection.DB as DB
+import DataCollection.DBCreate as DBCreate
+from DataCollection.BulkLoad import copy_rows, convert_columns
+import DataCollection.CompactPBP as CompactPBP
+
+# work discovery query as it was before the NOT EXISTS rewrite
+OLD_GAMES_TO_SCRAPE = """
+    SELECT game_id
+    FROM {games}
+    WHERE game_id NOT IN
+        (SELECT DISTINCT(game_id) FROM {table})
+    AND game_id IS NOT NULL
+    AND game_id NOT IN (SELECT game_id FROM url_errors)
+    AND (CASE
+            WHEN EXTRACT(MONTH FROM dt) <= 6 THEN EXTRACT(YEAR FROM dt)
+            ELSE EXTRACT(YEAR FROM dt) + 1
+        END) = {season}
+    ORDER BY DT DESC
+    LIMIT 500
+    """
+
+NEW_GAMES_TO_SCRAPE = """
+    SELECT g.game_id
+    FROM {games} g
+    WHERE g.game_id IS NOT NULL
+    AND g.season = {season}
+    AND NOT EXISTS (SELECT 1 FROM {table} t WHERE t.game_id = g.game_id)
+    AND NOT EXISTS (SELECT 1 FROM url_errors e WHERE e.game_id = g.game_id)
+    ORDER BY g.dt DESC
+    LIMIT 500
+    """
+
+
+def synthetic_pbp(num_games=10, rows_per_game=400):
+    """
+    INPUT: INT, INT
+    OUTPUT: LIST
+
+    Generate pbp-shaped rows (25 columns) for benchmarking inserts
+    """
+    rows = []
+    plays = ['JM', 'JMS', 'TPM', 'TPMS', 'FTM', 'DREB', 'OREB', 'FOUL', 'TURNOVER']
+    pbp_id = 0
+    for game_id in range(num_games):
+        for i in range(rows_per_game):
+            pbp_id += 1
+            teamid = i % 2
+            rows.append([game_id, pbp_id, 'Team %s' % teamid, teamid, i * 0.1,
+                         'JOHN', 'DOE', plays[i % len(plays)], i // 4, i // 5,
+                         teamid, 20, None, i // 40, i // 45, None, None, None,
+                         None, None, None, True, None, None, None])
+    return rows
+
+
+def bench_pbp_insert(conn, num_games=10):
+    """
+    INPUT: CONNECTION, INT
+    OUTPUT: DICT
+
+    Compare rows/sec of executemany against COPY for pbp rows. Rows go to a
+    temporary copy of the pbp table and the transaction is rolled back.
+    """
+    rows = synthetic_pbp(num_games)
+    columns = DB.COLUMNS['pbp']
+    cur = conn.cursor()
+    results = {}
+    try:
+        cur.execute("""CREATE TEMP TABLE bench_pbp AS SELECT * FROM pbp WITH NO DATA""")
+        q = """ INSERT INTO bench_pbp ({columns}) VALUES ({vals})
+            """.format(columns=', '.join(columns), vals=', '.join(['%s'] * len(columns)))
+
+        start = time.time()
+        cur.executemany(q, rows)
+        results['executemany'] = len(rows) / (time.time() - start)
+        cur.execute("TRUNCATE bench_pbp")
+
+        start = time.time()
+        copy_rows(cur, 'bench_pbp', columns, rows)
+        results['copy'] = len(rows) / (time.time() - start)
+    finally:
+        conn.rollback()
+    return results
+
+
+def load_synthetic_seasons(cur, seasons, games_per_season=5500, rows_per_game=20,
+                           scraped_fraction=0.9):
+    """
+    INPUT: CURSOR, LIST, INT, INT, FLOAT
+    OUTPUT: None
+
+    Fill games, box and url_errors tables in the current search_path with
+    synthetic multi-season data. scraped_fraction of the games get box rows.
+    """
+    games, box = DB.TABLES.get('games'), DB.TABLES.get('box')
+    cur.execute(DBCreate.create_season_function())
+    cur.execute("""CREATE TABLE {games} (dt DATE NOT NULL, hteam_id INT, ateam_id INT,
+                                         game_id INT,
+                                         season SMALLINT GENERATED ALWAYS AS (season_of(dt)) STORED)
+                """.format(games=games))
+    cur.execute("""CREATE TABLE {box} (game_id INT NOT NULL, season SMALLINT, team TEXT)"""
+                .format(box=box))
+    cur.execute("""CREATE TABLE url_errors (id SERIAL PRIMARY KEY, game_id INT)""")
+    for season in seasons:
+        offset = season * games_per_season
+        cur.execute(""" INSERT INTO {games} (dt, hteam_id, ateam_id, game_id)
+                        SELECT DATE '{season}-11-01' + (i % 150), i % 350, (i + 7) % 350, {offset} + i
+                        FROM generate_series(1, {n}) i
+                    """.format(games=games, season=season - 1, offset=offset, n=games_per_season))
+        cur.execute(""" INSERT INTO {box} (game_id, season, team)
+                        SELECT {offset} + i, {season}, 'team'
+                        FROM generate_series(1, {n}) i, generate_series(1, {rows}) r
+                    """.format(box=box, offset=offset, rows=rows_per_game, season=season,
+                               n=int(games_per_season * scraped_fraction)))
+        cur.execute(""" INSERT INTO url_errors (game_id)
+                        SELECT {offset} + i FROM generate_series(1, {n}, 50) i
+                    """.format(offset=offset, n=games_per_season))
+    cur.execute("ANALYZE")
+
+
+def explain_time(cur, q):
+    """
+    Run EXPLAIN ANALYZE and return (execution ms, plan as indented JSON).
+    The JSON format names the timing "Execution Time" on every supported
+    server, where the text format's label changed between versions.
+    """
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + q)
+    result = cur.fetchone()[0]
+    if isinstance(result, basestring):
+        result = json.loads(result)
+    return result[0]['Execution Time'], json.dumps(result[0]['Plan'], indent=2)
+
+
+def bench_work_discovery(conn, seasons=range(2010, 2017), season=2016):
+    """
+    INPUT: CONNECTION, LIST, INT
+    OUTPUT: DICT
+
+    EXPLAIN ANALYZE the old NOT IN work discovery query against the indexed
+    NOT EXISTS version on a synthetic multi-season dataset built in a
+    scratch schema. Everything is rolled back.
+    """
+    cur = conn.cursor()
+    results = {}
+    try:
+        cur.execute("CREATE SCHEMA bench")
+        cur.execute("SET LOCAL search_path TO bench")
+        load_synthetic_seasons(cur, seasons)
+        fmt = dict(games=DB.TABLES.get('games'), table=DB.TABLES.get('box'), season=season)
+        results['not_in'] = explain_time(cur, OLD_GAMES_TO_SCRAPE.format(**fmt))
+        for q in DBCreate.create_indexes():
+            # raw_pbp and pbp are not part of the synthetic dataset
+            if 'pbp' not in q:
+                cur.execute(q)
+        cur.execute("ANALYZE")
+        results['not_exists'] = explain_time(cur, NEW_GAMES_TO_SCRAPE.format(**fmt))
+    finally:
+        conn.rollback()
+    return results
+
+
+def bench_pbp_storage(conn, num_games=100, season=2015):
+    """
+    INPUT: CONNECTION, INT, INT
+    OUTPUT: DICT
+
+    Load the same synthetic pbp rows into the wide pbp table and into
+    pbp_compact in a scratch schema, and compare (bytes on disk, full scan ms).
+    Everything is rolled back.
+    """
+    rows = convert_columns(synthetic_pbp(num_games), DB.COLUMNS['pbp'], DB.COLUMN_TYPES['pbp'])
+    rows['season'] = season
+    cur = conn.cursor()
+    results = {}
+    try:
+        cur.execute("CREATE SCHEMA bench")
+        cur.execute("SET LOCAL search_path TO bench")
+        for qfunc in [DBCreate.create_season_function, DBCreate.create_games,
+                      DBCreate.create_raw_pbp, DBCreate.create_pbp,
+                      DBCreate.create_play_codes, DBCreate.create_pbp_names,
+                      DBCreate.create_pbp_players, DBCreate.create_pbp_compact]:
+            cur.execute(qfunc())
+        cur.execute(""" INSERT INTO {games} (dt, game_id)
+                        SELECT DATE '{year}-01-01', g FROM generate_series(0, {n} - 1) g
+                    """.format(games=DB.TABLES.get('games'), year=season, n=num_games))
+        cur.execute(""" INSERT INTO raw_pbp (id, game_id, season, first_name)
+                        SELECT id, game_id, %s, 'JOHN'
+                        FROM unnest(%s::int[], %s::int[]) AS r(id, game_id)
+                    """, (season, list(rows.pbp_id.values), list(rows.game_id.values)))
+
+        copy_rows(cur, 'pbp', DB.COLUMNS['pbp'] + ['season'], rows)
+        copy_rows(cur, 'pbp_compact', CompactPBP.COLUMNS, CompactPBP.encode(cur, rows))
+        cur.execute("ANALYZE")
+        scan = "SELECT count(*), sum(hscore), sum(home_fouls) FROM {table}"
+        for table in ['pbp', 'pbp_compact']:
+            cur.execute("SELECT pg_total_relation_size(%s)", (table,))
+            results[table] = (cur.fetchone()[0], explain_time(cur, scan.format(table=table))[0])
+    finally:
+        conn.rollback()
+    return results
+
+
+if __name__ == "__main__":
+    bench = sys.argv[1] if len(sys.argv) > 1 else 'insert'
+    if bench == 'insert':
+        num_games = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+        with DB.connection() as conn:
+            results = bench_pbp_insert(conn, num_games)
+        for method in ['executemany', 'copy']:
+            print("%-12s %10.0f rows/sec" % (method, results[method]))
+        print("speedup: %0.1fx" % (results['copy'] / results['executemany']))
+    elif bench == 'discovery':
+        with DB.connection() as conn:
+            results = bench_work_discovery(conn)
+        for method in ['not_in', 'not_exists']:
+            ms, plan = results[method]
+            print("%-12s %10.1f ms" % (method, ms))
+            print(plan)
+        print("speedup: %0.1fx" % (results['not_in'][0] / results['not_exists'][0]))
+    elif bench == 'storage':
+        num_games = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        with DB.connection() as conn:
+            results = bench_pbp_storage(conn, num_games)
+        for table in ['pbp', 'pbp_compact']:
+            size, ms = results[table]
+            print("%-12s %10.0f kB %10.1f ms" % (table, size / 1024., ms))
+        print("size ratio: %0.1fx" % (float(results['pbp'][0]) / results['pbp_compact'][0]))
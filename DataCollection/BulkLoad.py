@@ -0,0 +1,231 @@
+import csv
+from cStringIO import StringIO
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype
+
+NULL = '\\N'
+
+
+def _csv_value(val):
+    if val is None:
+        return NULL
+    if isinstance(val, float):
+        # COPY will not cast '3.0' into an INT column like INSERT does
+        if val != val:
+            return NULL
+        if val.is_integer():
+            return int(val)
+    if isinstance(val, unicode):
+        return val.encode('utf-8')
+    return val
+
+
+def _nulls(col):
+    """Mask of the missing values in an object column, including 'nan' strings"""
+    return np.asarray(pd.isnull(col) | (col == 'nan'), dtype=bool)
+
+
+def _stripped(col):
+    """The strings of an object column stripped of whitespace, NaN for the other values"""
+    values = pd.Series(col, dtype=object)
+    try:
+        # object dtype even when there are no strings, so it compares with ''
+        return values.str.strip().astype(object)
+    except AttributeError:
+        # pandas refuses .str on a column with no strings at all, e.g. all bools
+        return pd.Series(np.nan, index=values.index, dtype=object)
+
+
+def _blank(col):
+    """Mask of the empty or whitespace strings in an object column"""
+    return _stripped(col).eq('').values
+
+
+def _numbers(col, nulls, kind):
+    """
+    Float values of a column and its mask of NULLs, with blank strings as
+    NULL. Raise ValueError on a value that is not a number rather than
+    storing it as NULL.
+    """
+    nulls = nulls | _blank(col)
+    col = np.asarray(col, dtype=object)
+    nums = pd.to_numeric(pd.Series(np.where(nulls, np.nan, col)), errors='coerce').values
+    nums = nums.astype(float)
+    bad = np.isnan(nums) & ~nulls
+    if bad.any():
+        raise ValueError("bad %s value %r" % (kind, col[np.flatnonzero(bad)[0]]))
+    return nums, nulls
+
+
+def _to_int(col, nulls):
+    nums, nulls = _numbers(col, nulls, 'int')
+    bad = (nums != np.floor(nums)) & ~nulls
+    if bad.any():
+        raise ValueError("bad int value %r" % col[np.flatnonzero(bad)[0]])
+    out = np.where(nulls, 0, nums).astype(np.int64).astype(object)
+    out[nulls] = None
+    return out
+
+
+def _to_real(col, nulls):
+    nums, nulls = _numbers(col, nulls, 'real')
+    out = nums.astype(object)
+    out[nulls] = None
+    return out
+
+
+# text forms of the values a bool column accepts, as they read once lowercased
+BOOL_TEXT = {'true': True, 't': True, 'yes': True, 'y': True, '1': True,
+             'false': False, 'f': False, 'no': False, 'n': False, '0': False}
+# values that are not strings: bools, and numbers equal to 0 or 1 (which hash alike)
+BOOL_VALUES = {True: True, False: False}
+
+
+def _to_bool(col, nulls):
+    # parsed rather than cast: bool('False') and bool('0') are True
+    text = _stripped(col)
+    strings = text.notnull()
+    nulls = nulls | text.eq('').values
+    parsed = pd.Series(col, dtype=object).map(BOOL_VALUES).astype(object)
+    if strings.any():
+        parsed[strings] = text[strings].str.lower().map(BOOL_TEXT)
+    parsed = parsed.values
+    bad = pd.isnull(parsed) & ~nulls
+    if bad.any():
+        raise ValueError("bad bool value %r" % col[np.flatnonzero(bad)[0]])
+    out = parsed.astype(object)
+    out[nulls] = None
+    return out
+
+
+def _to_text(col, nulls):
+    out = np.asarray(col, dtype=object).copy()
+    out[nulls] = None
+    return out
+
+CONVERTERS = {'int': _to_int, 'real': _to_real, 'bool': _to_bool, 'text': _to_text}
+
+
+def convert_columns(values, columns, types):
+    """
+    INPUT: 2D ARRAY, LIST, DICT
+    OUTPUT: DATAFRAME
+
+    Convert scraped values to DB-ready columns using the target table's
+    column types (see DB.COLUMN_TYPES): ints and reals become Python numbers,
+    bools become bools and every kind of missing value becomes None. A value
+    that does not parse as its column's type raises ValueError.
+    """
+    values = np.asarray(values, dtype=object)
+    data = {}
+    for j, col_name in enumerate(columns):
+        col = values[:, j]
+        try:
+            data[col_name] = CONVERTERS[types.get(col_name, 'text')](col, _nulls(col))
+        except ValueError as e:
+            raise ValueError("%s: %s" % (col_name, e))
+    return pd.DataFrame(data, columns=columns)
+
+
+def sql_convert(values):
+    """
+    INPUT: 2D Numpy Array
+    OUTPUT: 2D Numpy Array
+
+    Convert floats to ints and nans to None for parameterized inserts when
+    the target schema is not known. Each column is handled as a whole: numeric
+    columns whose values are all integral become ints.
+    """
+    values = np.asarray(values, dtype=object)
+    out = np.empty(values.shape, dtype=object)
+    for j in range(values.shape[1]):
+        col = values[:, j]
+        nulls = _nulls(col)
+        kind = infer_dtype(col[~nulls], skipna=False)
+        if kind in {'floating', 'integer', 'mixed-integer-float'}:
+            nums = col.astype(float)
+            nulls |= np.isnan(nums)
+            if np.all(np.mod(nums[~nulls], 1) == 0):
+                out[:, j] = _to_int(col, nulls)
+            else:
+                out[:, j] = _to_real(col, nulls)
+        else:
+            out[:, j] = _to_text(col, nulls)
+    return out
+
+
+def csv_buffer(rows):
+    """
+    INPUT: DATAFRAME or ITERABLE
+    OUTPUT: FILE-LIKE
+
+    Write rows to an in-memory csv buffer that COPY can read, with None
+    written as the NULL marker so it is distinct from the empty string.
+    """
+    buf = StringIO()
+    if isinstance(rows, pd.DataFrame):
+        rows.to_csv(buf, header=False, index=False, na_rep=NULL, encoding='utf-8')
+    else:
+        writer = csv.writer(buf, lineterminator='\n')
+        for row in rows:
+            writer.writerow([_csv_value(val) for val in row])
+    buf.seek(0)
+    return buf
+
+
+def copy_rows(cur, table, columns, rows):
+    """
+    INPUT: CURSOR, STRING, LIST, ITERABLE
+    OUTPUT: None
+
+    Stream rows into table through COPY FROM STDIN. Values must already be
+    in their SQL form (see sql_convert), i.e. ints for INT columns and None
+    for NULL. The caller owns the transaction.
+    """
+    q = """ COPY {table} ({columns})
+            FROM STDIN
+            WITH (FORMAT csv, NULL '{null}')
+        """.format(table=table, columns=', '.join(columns), null=NULL)
+    cur.copy_expert(q, csv_buffer(rows))
+
+
+def stage_rows(cur, table, columns, rows):
+    """
+    INPUT: CURSOR, STRING, LIST, ITERABLE
+    OUTPUT: STRING
+
+    COPY rows into a temporary table shaped like table and return its name.
+    The staging table is dropped when the transaction commits.
+    """
+    stage = '_stage_%s' % table
+    cur.execute("DROP TABLE IF EXISTS {stage}".format(stage=stage))
+    cur.execute(""" CREATE TEMP TABLE {stage}
+                    (LIKE {table} INCLUDING DEFAULTS)
+                    ON COMMIT DROP
+                """.format(stage=stage, table=table))
+    copy_rows(cur, stage, columns, rows)
+    return stage
+
+
+def copy_merge(cur, table, columns, rows, key):
+    """
+    INPUT: CURSOR, STRING, LIST, ITERABLE, LIST
+    OUTPUT: INT
+
+    Idempotent bulk insert: stage the rows with COPY and insert only those
+    whose key columns are not already in table. Return the number of rows
+    inserted.
+    """
+    stage = stage_rows(cur, table, columns, rows)
+    match = ' AND '.join(['t.{col} = s.{col}'.format(col=col) for col in key])
+    q = """ INSERT INTO {table} ({columns})
+            SELECT {s_columns}
+            FROM {stage} s
+            WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {match})
+        """.format(table=table, stage=stage, match=match,
+                   columns=', '.join(columns),
+                   s_columns=', '.join(['s.%s' % col for col in columns]))
+    cur.execute(q)
+    return cur.rowcount
@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+
+import DataCollection.DB as DB
+
+# tables whose loads are recorded in ingest_log, keyed like DB.TABLES
+LOGGED_TABLES = ["games", "box", "raw_pbp", "pbp"]
+
+
+def backfill_queries():
+    """Log every game already in the logged tables, for consumers starting from scratch"""
+    return [""" INSERT INTO ingest_log (tbl, game_id, op)
+                SELECT DISTINCT '{table}', game_id, 'backfill'
+                FROM {name}
+                WHERE game_id IS NOT NULL
+            """.format(table=table, name=DB.TABLES.get(table)) for table in LOGGED_TABLES]
+
+
+def log_changes(cur, table, game_ids, op="load"):
+    """
+    INPUT: CURSOR, STRING, LIST, STRING
+    OUTPUT: None
+
+    Record that game_ids were written to table. Call it in the transaction
+    that wrote them, so the log entry commits or rolls back with the rows.
+    """
+    game_ids = sorted(set(int(game_id) for game_id in game_ids if game_id is not None))
+    if len(game_ids) == 0:
+        return
+    cur.execute(""" INSERT INTO ingest_log (tbl, game_id, op)
+                    SELECT %s, game_id, %s FROM unnest(%s::int[]) game_id
+                """, (table, op, game_ids))
+
+
+def pending(cur, consumer, tables):
+    """
+    INPUT: CURSOR, STRING, LIST
+    OUTPUT: DICT, INT
+
+    Games logged for each of tables since consumer's watermark, and the
+    watermark to store once they are processed.
+
+    Sequence numbers are assigned before commit, so a later seq can become
+    visible before an earlier one. Watermarks are therefore kept in
+    transaction ids: every transaction below the snapshot xmin has finished,
+    so the log entries below it can no longer change.
+    """
+    cur.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+    upto = cur.fetchone()[0]
+    cur.execute("SELECT xmin FROM watermarks WHERE consumer = %s", (consumer,))
+    row = cur.fetchone()
+    since = row[0] if row is not None else 0
+    cur.execute(""" SELECT tbl, array_agg(DISTINCT game_id ORDER BY game_id)
+                    FROM ingest_log
+                    WHERE tbl = ANY(%s) AND xid >= %s AND xid < %s
+                    GROUP BY tbl
+                """, (list(tables), since, upto))
+    changes = dict((table, []) for table in tables)
+    changes.update(dict(cur.fetchall()))
+    return changes, upto
+
+
+def has_watermark(consumer):
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM watermarks WHERE consumer = %s", (consumer,))
+        return cur.fetchone() is not None
+
+
+def advance(cur, consumer, xmin):
+    cur.execute(""" INSERT INTO watermarks (consumer, xmin)
+                    VALUES (%s, %s)
+                    ON CONFLICT (consumer) DO UPDATE
+                    SET xmin=EXCLUDED.xmin, updated_at=now()
+                """, (consumer, xmin))
+
+
+@contextmanager
+def consume(consumer, tables):
+    """
+    INPUT: STRING, LIST
+    OUTPUT: DICT
+
+    Yield {table: game ids} changed since consumer last ran. The watermark
+    only advances if the with block completes, so a failed run sees the same
+    games again next time.
+    """
+    with DB.connection() as conn:
+        changes, upto = pending(conn.cursor(), consumer, tables)
+    yield changes
+    with DB.connection() as conn:
+        advance(conn.cursor(), consumer, upto)
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from DataCollection.BulkLoad import convert_columns
+
+# fixed codes for the plays produced by the scrapers, in code order starting
+# at 1. Plays not in this list are added to play_codes with the next free code
+PLAY_CODES = ['FTM', 'FTMS', 'LUM', 'LUMS', 'JM', 'JMS', 'DM', 'DMS', 'TIM', 'TIMS',
+              'TPM', 'TPMS', 'ASSIST', 'BLOCK', 'STEAL', 'TURNOVER', 'FOUL', 'TIMEOUT',
+              'OREB', 'DREB', 'TREB', 'DEADREB', 'ENTERS', 'LEAVES']
+# bits of the flags column, one per boolean pbp column
+FLAGS = {'blocked': 1, 'stolen': 2, 'assisted': 4, 'charge': 8}
+
+# insert column order of pbp_compact: 4 byte columns first, then the
+# smallints, so rows are not padded
+COLUMNS = ['game_id', 'pbp_id', 'team_id', 'player_id', 'recipient_id', 'season', 'elapsed',
+           'play_code', 'assist_code', 'teamid', 'possession', 'hscore', 'ascore',
+           'home_fouls', 'away_fouls', 'poss_time_full', 'poss_time', 'second_chance',
+           'timeout_pts', 'turnover_pts', 'and_one', 'flags']
+COLUMN_TYPES = dict([(col, 'int') for col in COLUMNS])
+
+
+def dictionary_ids(cur, table, columns, values):
+    """
+    INPUT: CURSOR, STRING, LIST, LIST
+    OUTPUT: DICT
+
+    Map each value tuple to its id in a dictionary table (pbp_names,
+    pbp_players), inserting the ones that are not stored yet.
+    """
+    values = list(set(values))
+    if len(values) == 0:
+        return {}
+    arrays = [list(col) for col in zip(*values)]
+    fmt = {'table': table,
+           'columns': ', '.join(columns),
+           'unnest': ', '.join(['%s::text[]'] * len(columns)),
+           'match': ' AND '.join(['t.{col} = v.{col}'.format(col=col) for col in columns]),
+           't_columns': ', '.join(['t.%s' % col for col in columns])}
+    cur.execute(""" INSERT INTO {table} ({columns})
+                    SELECT * FROM unnest({unnest})
+                    ON CONFLICT DO NOTHING
+                """.format(**fmt), arrays)
+    cur.execute(""" SELECT t.id, {t_columns}
+                    FROM {table} t
+                    JOIN unnest({unnest}) AS v({columns})
+                    ON {match}
+                """.format(**fmt), arrays)
+    return {tuple(row[1:]): row[0] for row in cur.fetchall()}
+
+
+def play_codes(cur, plays):
+    """
+    INPUT: CURSOR, LIST
+    OUTPUT: DICT
+
+    Map each play string to its smallint code, giving new plays the next codes
+    """
+    plays = list(set(play for play in plays if play is not None))
+    cur.execute(""" INSERT INTO play_codes (code, play)
+                    SELECT (SELECT COALESCE(max(code), 0) FROM play_codes) + row_number() OVER (), p
+                    FROM unnest(%s::text[]) p
+                    WHERE NOT EXISTS (SELECT 1 FROM play_codes c WHERE c.play = p)
+                    ON CONFLICT DO NOTHING
+                """, (plays,))
+    cur.execute("SELECT play, code FROM play_codes WHERE play = ANY(%s)", (plays,))
+    return dict(cur.fetchall())
+
+
+def _lookup(keys, ids):
+    return np.array([ids.get(key) for key in keys], dtype=object)
+
+
+def encode(cur, rows):
+    """
+    INPUT: CURSOR, DATAFRAME
+    OUTPUT: DATAFRAME
+
+    Encode converted pbp rows (DB.COLUMNS['pbp'] plus season) into the
+    pbp_compact layout: team, player and play strings become dictionary ids,
+    time in minutes becomes elapsed seconds and the boolean columns are
+    packed into flag bits.
+    """
+    last_names = rows.last_name.map(lambda name: '' if name is None else name).values
+    players = zip(rows.first_name.values, last_names)
+    player_ids = dictionary_ids(cur, 'pbp_players', ['first_name', 'last_name'],
+                                [player for player in players if player[0] is not None])
+    team_ids = dictionary_ids(cur, 'pbp_names', ['name'],
+                              [(team,) for team in rows.team.values if team is not None])
+    codes = play_codes(cur, list(rows.play.values) + list(rows.assist_play.values))
+    # recipients are stored as "first last" of a player in the same rows
+    full_names = dict([('%s %s' % player, player_id) for player, player_id in player_ids.items()])
+
+    flags = np.zeros(rows.shape[0], dtype=int)
+    for col, bit in FLAGS.items():
+        flags += np.asarray(rows[col].values == True, dtype=int) * bit
+
+    data = {'team_id': _lookup([(team,) for team in rows.team.values], team_ids),
+            'player_id': _lookup(players, player_ids),
+            'recipient_id': _lookup(rows.recipient.values, full_names),
+            'elapsed': np.round(pd.to_numeric(rows.time, errors='coerce').values * 60),
+            'play_code': _lookup(rows.play.values, codes),
+            'assist_code': _lookup(rows.assist_play.values, codes),
+            'flags': flags}
+    values = np.column_stack([data[col] if col in data else rows[col].values
+                              for col in COLUMNS])
+    return convert_columns(values, COLUMNS, COLUMN_TYPES)
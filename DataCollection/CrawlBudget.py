@@ -0,0 +1,160 @@
+import fcntl
+import json
+import os
+import re
+import tempfile
+import time
+
+
+class FileTokenBucket(object):
+    """
+    Token bucket for one host whose state lives in a small json file guarded
+    by an exclusive flock, so every process on the machine draws from the
+    same bucket.
+    """
+
+    def __init__(self, host, rate, burst, directory=None):
+        if directory is None:
+            directory = tempfile.gettempdir()
+        safe_host = re.sub('[^A-Za-z0-9.-]', '_', host)
+        self.path = os.path.join(directory, 'cbbdb_budget_%s.json' % safe_host)
+        self.rate = float(rate)
+        self.burst = float(burst)
+
+    def try_acquire(self):
+        """
+        INPUT: FileTokenBucket
+        OUTPUT: FLOAT
+
+        Take one token if available. Return 0 on success, otherwise the number
+        of seconds until a token will be available.
+        """
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                contents = f.read()
+                now = time.time()
+                if contents:
+                    state = json.loads(contents)
+                else:
+                    state = {'tokens': self.burst, 'updated': now}
+                tokens = min(self.burst, state['tokens'] + (now - state['updated']) * self.rate)
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0.
+                else:
+                    wait = (1 - tokens) / self.rate
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({'tokens': tokens, 'updated': now}))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
+
+
+class PGTokenBucket(object):
+    """
+    Token bucket for one host stored as a row of the crawl_budget table.
+    Updates are serialized with a transaction-level advisory lock keyed on
+    the host, so crawlers on any machine sharing the database share the budget.
+    """
+
+    def __init__(self, host, rate, burst, conn):
+        self.host = host
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.conn = conn
+
+    def try_acquire(self):
+        """
+        INPUT: PGTokenBucket
+        OUTPUT: FLOAT
+
+        Take one token if available. Return 0 on success, otherwise the number
+        of seconds until a token will be available.
+        """
+        cur = self.conn.cursor()
+        try:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (self.host,))
+            cur.execute(""" SELECT tokens, updated, date_part('epoch', clock_timestamp())
+                            FROM crawl_budget
+                            WHERE host=%s
+                        """, (self.host,))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("SELECT date_part('epoch', clock_timestamp())")
+                now = cur.fetchone()[0]
+                tokens = self.burst
+            else:
+                tokens, updated, now = row
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.
+            else:
+                wait = (1 - tokens) / self.rate
+            cur.execute(""" INSERT INTO crawl_budget (host, tokens, updated)
+                            VALUES (%s, %s, %s)
+                            ON CONFLICT (host) DO UPDATE
+                            SET tokens=EXCLUDED.tokens, updated=EXCLUDED.updated
+                        """, (self.host, tokens, now))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return wait
+
+
+class CrawlBudget(object):
+    """
+    Host-level request budget shared by every crawler process. Each fetch
+    must draw a token for its host before it is sent, which bounds the total
+    request rate no matter how many spiders or shards are running.
+    """
+
+    def __init__(self, rate=4., burst=None, backend='file', directory=None, conn=None):
+        """
+        INPUT: CrawlBudget, FLOAT, FLOAT, STRING, STRING, CONNECTION
+        OUTPUT: None
+
+        rate is the total requests per second allowed per host
+        burst is the bucket size (defaults to one second worth of requests)
+        backend is 'file' (processes on one machine) or 'postgres'
+        """
+        assert backend in {'file', 'postgres'}, "invalid budget backend: %s" % backend
+        assert backend != 'postgres' or conn is not None, "postgres budget needs a connection"
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1., rate)
+        self.backend = backend
+        self.directory = directory
+        self.conn = conn
+        self.buckets = {}
+
+    @classmethod
+    def from_settings(cls, settings, conn=None):
+        """Build a budget from scrapy settings (CRAWL_BUDGET_*)"""
+        return cls(rate=settings.getfloat('CRAWL_BUDGET_RATE', 4.),
+                   burst=settings.getfloat('CRAWL_BUDGET_BURST', 0.) or None,
+                   backend=settings.get('CRAWL_BUDGET_BACKEND', 'file'),
+                   directory=settings.get('CRAWL_BUDGET_DIR'),
+                   conn=conn)
+
+    def bucket(self, host):
+        if host not in self.buckets:
+            if self.backend == 'file':
+                self.buckets[host] = FileTokenBucket(host, self.rate, self.burst, self.directory)
+            else:
+                self.buckets[host] = PGTokenBucket(host, self.rate, self.burst, self.conn)
+        return self.buckets[host]
+
+    def try_acquire(self, host):
+        return self.bucket(host).try_acquire()
+
+    def acquire(self, host):
+        """Block until a token for the host is available"""
+        wait = self.try_acquire(host)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire(host)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# Downloader middlewares shared by all spiders
+#
+# See documentation in:
+# http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
+
+from urlparse import urlparse
+
+from scrapy.exceptions import NotConfigured
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+
+from DataCollection.CrawlBudget import CrawlBudget
+from DataCollection.RateControl import RateController
+import DataCollection.DB as DB
+
+
+class AdaptiveRateMiddleware(object):
+    """
+    Adjust the download slot delay and concurrency for each host from observed
+    latency and error rate, and expose the current rate as crawl stats.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('RATE_CONTROL_ENABLED', True):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.controller = RateController.from_settings(settings)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_response(self, request, response, spider):
+        latency = request.meta.get('download_latency')
+        self._update(request, latency, response.status)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self._update(request, request.meta.get('download_latency'), None)
+
+    def _update(self, request, latency, status):
+        host = urlparse(request.url).netloc
+        self.controller.record(host, latency, status)
+
+        slot = self.crawler.engine.downloader.slots.get(request.meta.get('download_slot'))
+        if slot is not None:
+            slot.delay = self.controller.delay(host)
+            slot.concurrency = self.controller.concurrency(host)
+
+        self.stats.set_value('rate_control/%s/delay' % host, self.controller.delay(host))
+        self.stats.set_value('rate_control/%s/concurrency' % host, self.controller.concurrency(host))
+        self.stats.set_value('rate_control/%s/rate' % host, self.controller.rate(host))
+        self.stats.set_value('rate_control/%s/error_rate' % host, self.controller.error_rate(host))
+
+
+class CrawlBudgetMiddleware(object):
+    """
+    Hold every request until a token for its host is drawn from the budget
+    shared by all crawler processes.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CRAWL_BUDGET_ENABLED', True):
+            raise NotConfigured
+        self.stats = crawler.stats
+        conn = None
+        if settings.get('CRAWL_BUDGET_BACKEND', 'file') == 'postgres':
+            # the budget commits on every draw, so keep it off the data connection
+            conn = DB.manager.connect()
+        self.budget = CrawlBudget.from_settings(settings, conn=conn)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        host = urlparse(request.url).netloc
+        wait = self.budget.try_acquire(host)
+        if wait > 0:
+            self.stats.inc_value('crawl_budget/%s/waits' % host)
+            return deferLater(reactor, wait, self.process_request, request, spider)
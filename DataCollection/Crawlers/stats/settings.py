@@ -24,13 +24,13 @@ NEWSPIDER_MODULE = 'stats.spiders'
 # Configure a delay for requests for the same website (default: 0)
 # See http://scrapy.readthedocs.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
-#DOWNLOAD_DELAY=3
+DOWNLOAD_DELAY=0.5
 # The download delay setting will honor only one of:
-#CONCURRENT_REQUESTS_PER_DOMAIN=16
+CONCURRENT_REQUESTS_PER_DOMAIN=8
 #CONCURRENT_REQUESTS_PER_IP=16
 
 # Disable cookies (enabled by default)
-#COOKIES_ENABLED=False
+COOKIES_ENABLED=False
 
 # Disable Telnet Console (enabled by default)
 #TELNETCONSOLE_ENABLED=False
@@ -49,9 +49,33 @@ NEWSPIDER_MODULE = 'stats.spiders'
 
 # Enable or disable downloader middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    'stats.middlewares.MyCustomDownloaderMiddleware': 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    'stats.middlewares.CrawlBudgetMiddleware': 980,
+    'stats.middlewares.AdaptiveRateMiddleware': 990,
+}
+
+# Host-level token bucket shared by all crawler processes (see
+# DataCollection.CrawlBudget). RATE is the total requests per second allowed
+# per host across every running spider. The 'file' backend shares the budget
+# between processes on one machine, 'postgres' between machines.
+CRAWL_BUDGET_ENABLED=True
+CRAWL_BUDGET_RATE=4
+CRAWL_BUDGET_BURST=4
+CRAWL_BUDGET_BACKEND='file'
+CRAWL_BUDGET_DIR=None
+
+# Adaptive per-host rate control (see DataCollection.RateControl). Delay and
+# concurrency start at the START values and move between the MIN/MAX ceilings
+# depending on the latency and error rate of the last WINDOW responses.
+RATE_CONTROL_ENABLED=True
+RATE_CONTROL_WINDOW=50
+RATE_CONTROL_START_DELAY=0.5
+RATE_CONTROL_MIN_DELAY=0.05
+RATE_CONTROL_MAX_DELAY=30
+RATE_CONTROL_MIN_CONCURRENCY=1
+RATE_CONTROL_MAX_CONCURRENCY=8
+RATE_CONTROL_TARGET_LATENCY=1.0
+RATE_CONTROL_MAX_ERROR_RATE=0.05
 
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
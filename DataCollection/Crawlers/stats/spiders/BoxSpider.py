@@ -6,6 +6,10 @@ import traceback
 
 from DataCollection.ScrapeUtils import BoxScraper
 import DataCollection.DBScrapeUtils as dbutil
+from DataCollection.BatchWriter import BatchWriter
+from DataCollection.DataSummary import DataSummarizer
+from DataCollection.NCAAStatsUtil import NCAAStatsUtil as ncaa_util
+from DataCollection.Storage import get_storage
 from scrapy.crawler import Crawler
 from scrapy.settings import Settings
 from scrapy import signals
@@ -41,6 +45,7 @@ class BoxSpider(scrapy.Spider):
         self.data = []
         self.failed_urls = []
         self.items = []
+        self.writer = BatchWriter()
         dispatcher.connect(self.spider_closed, signals.spider_closed)
 
     def parse(self, response):
@@ -51,21 +56,27 @@ class BoxSpider(scrapy.Spider):
             soup = BeautifulSoup(response.body, 'html.parser')
             header_table, box_stats = BoxScraper.extract_box_stats(soup, response.url)
             if BoxScraper.is_valid_stats(box_stats):
-                dbutil.insert_box_stats(box_stats)
-        except:
+                self.writer.write('box', box_stats.values)
+        except Exception as e:
             traceback.print_exc()
+            self.writer.fail(ncaa_util.parse_stats_link(response.url), 'box', e)
 
     def spider_closed(spider):
         """Activates on spider closed signal"""
         spider.crawler.stats.set_value('failed_urls', ','.join(spider.failed_urls))
+        spider.writer.close()
+        # load batches spooled while the database was unavailable
+        dbutil.replay_spool()
+        # coverage is refreshed from the ChangeLog on the server
+        if get_storage().logs_changes:
+            DataSummarizer.refresh_coverage()
 
 
 
 if __name__ == "__main__":
     spider = BoxSpider()
     settings = Settings()
-    settings.set('DOWNLOAD_DELAY', 0.5)
-    settings.set('COOKIES_ENABLED', False)
+    settings.setmodule('stats.settings')
 
     crawler = Crawler(spider, settings)
     crawler.crawl()
@@ -49,8 +49,7 @@ def spider_closing(spider):
 if __name__ == "__main__":
     spider = DivisionOneTeamsSpider()
     settings = Settings()
-    settings.set('DOWNLOAD_DELAY', 0.5)
-    settings.set('COOKIES_ENABLED', False)
+    settings.setmodule('stats.settings')
     crawler = Crawler(spider, settings)
     crawler.crawl()
     print "______"
@@ -36,7 +36,9 @@ class KenpomSpider(scrapy.Spider):
 
 if __name__ == "__main__":
     spider = KenpomSpider()
-    crawler = Crawler(spider, Settings())
+    settings = Settings()
+    settings.setmodule('stats.settings')
+    crawler = Crawler(spider, settings)
     crawler.crawl()
     print "______"
     # stop reactor when spider closes
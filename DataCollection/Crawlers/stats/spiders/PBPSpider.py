@@ -6,6 +6,10 @@ import traceback
 
 from DataCollection.ScrapeUtils import PBPScraper
 import DataCollection.DBScrapeUtils as dbutil
+from DataCollection.BatchWriter import BatchWriter
+from DataCollection.DataSummary import DataSummarizer
+from DataCollection.NCAAStatsUtil import NCAAStatsUtil as ncaa_util
+from DataCollection.Storage import get_storage
 from scrapy.crawler import Crawler
 from scrapy.settings import Settings
 from scrapy import signals
@@ -23,6 +27,7 @@ class BoxSpider(scrapy.Spider):
         self.data = []
         self.failed_urls = []
         self.items = []
+        self.writer = BatchWriter()
         dispatcher.connect(self.spider_closed, signals.spider_closed)
 
     def parse(self, response):
@@ -35,15 +40,22 @@ class BoxSpider(scrapy.Spider):
             header_table, pbp_stats = PBPScraper.extract_pbp_stats(soup, response.url)
             # print(header_table.head(), pbp_stats.head(10))
             # print(pbp_stats.head())
-            dbutil.insert_raw_pbp_data(pbp_stats.values)
+            self.writer.write('raw_pbp', pbp_stats.values)
             # if BoxScraper.is_valid_stats(box_stats):
             #     dbutil.insert_box_stats(box_stats)
-        except:
+        except Exception as e:
             traceback.print_exc()
+            self.writer.fail(ncaa_util.parse_stats_link(response.url), 'raw_pbp', e)
 
     def spider_closed(spider):
         """Activates on spider closed signal"""
         spider.crawler.stats.set_value('failed_urls', ','.join(spider.failed_urls))
+        spider.writer.close()
+        # load batches spooled while the database was unavailable
+        dbutil.replay_spool()
+        # coverage is refreshed from the ChangeLog on the server
+        if get_storage().logs_changes:
+            DataSummarizer.refresh_coverage()
 
 
 
@@ -51,8 +63,7 @@ if __name__ == "__main__":
     pass
     # spider = BoxSpider()
     # settings = Settings()
-    # settings.set('DOWNLOAD_DELAY', 0.5)
-    # settings.set('COOKIES_ENABLED', False)
+    # settings.setmodule('stats.settings')
     #
     # crawler = Crawler(spider, settings)
     # crawler.crawl()
@@ -1,10 +1,16 @@
 import csv
 import os
+import traceback
 from bs4 import BeautifulSoup
 from twisted.internet import reactor
 
-from DataCollection.ScrapeUtils import ScheduleScraper
+from DataCollection.ScrapeUtils import ScheduleScraper, GameCanonicalizer, BoxScraper, PBPScraper
+from DataCollection.NCAAStatsUtil import NCAAStatsUtil as ncaa_util
 import DataCollection.DBScrapeUtils as dbutil
+from DataCollection.BatchWriter import BatchWriter
+from DataCollection.DataSummary import DataSummarizer
+from DataCollection.DataWrangling import refresh_team_games
+from DataCollection.Storage import get_storage
 
 import scrapy
 from scrapy.crawler import Crawler
@@ -12,51 +18,124 @@ from scrapy.settings import Settings
 from scrapy import signals
 from scrapy.xlib.pydispatch import dispatcher
 
+
+def flag(value):
+    """Spider argument as a bool: scrapy crawl -a passes every value as a string"""
+    return str(value).strip().lower() in ('1', 'true', 'yes')
+
+
 class ScheduleSpider(scrapy.Spider):
     name = "ScheduleSpider"
     allowed_domains = ["stats.ncaa.org"]
     # start_urls = ScheduleScraper.get_urls([2016])
     start_urls = ['http://stats.ncaa.org/team/141/12260']
+    # 304 means the page is unchanged since the validators we sent
+    handle_httpstatus_list = [304, 404]
     print(start_urls)
 
-    def __init__(self):
-        self.soups = []
+    def __init__(self, unplayed_only=False, follow_games=False):
+        if flag(unplayed_only):
+            # only crawl the few team pages needed to resolve unplayed games
+            self.start_urls = ScheduleScraper.get_unplayed_urls()
+        follow_games = flag(follow_games)
+        self.follow_games = follow_games
         self.failed_urls = []
-        self.games = []
+        fetched = dbutil.get_scraped_game_ids('box') if follow_games else None
+        self.games = GameCanonicalizer(fetched)
+        self.writer = BatchWriter() if follow_games else None
+        self.validators = {}
+        self.new_validators = {}
         dispatcher.connect(self.spider_closed, signals.spider_closed)
 
+    def start_requests(self):
+        self.validators = dbutil.get_page_validators(self.start_urls)
+        for url in self.start_urls:
+            headers = {}
+            etag, last_modified, content_hash = self.validators.get(url, (None, None, None))
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+            yield scrapy.Request(url, headers=headers, dont_filter=True)
+
     def parse(self, response):
         if response.status == 404:
             self.failed_urls.append(response.url)
             print('404 error: %s' % response.url)
+            return
+        if response.status == 304:
+            self.crawler.stats.inc_value('schedule/pages_skipped')
+            return
         try:
             soup = BeautifulSoup(response.body, 'html.parser')
+            content_hash = ScheduleScraper.schedule_hash(soup)
+            stored = self.validators.get(response.url, (None, None, None))
+            self.new_validators[response.url] = (response.headers.get('ETag'),
+                                                 response.headers.get('Last-Modified'),
+                                                 content_hash)
+            if content_hash is not None and content_hash == stored[2]:
+                self.crawler.stats.inc_value('schedule/pages_skipped')
+                return
             games = ScheduleScraper.get_team_schedule(soup, response.url)
-            # item = ScheduleItem()
-            # item['games'] = games
-            self.games.append(games)
-            self.soups.append(str(soup))
+            self.crawler.stats.inc_value('schedule/pages_changed')
         except Exception as e:
-            # self.data.append("eee")
+            # do not remember validators for a page we failed to parse
+            self.new_validators.pop(response.url, None)
             print(e)
+            return
+
+        for game in games:
+            if self.games.add(game):
+                self.crawler.stats.inc_value('schedule/games')
+            game_id = game[0]
+            played = game[ScheduleScraper.columns.index('home_score')] is not None
+            # each game is on both teams' pages but is only fetched once
+            if self.follow_games and played and self.games.claim_fetch(game_id):
+                yield scrapy.Request(ncaa_util.stats_link(game_id, 'box'), callback=self.parse_box)
+                yield scrapy.Request(ncaa_util.stats_link(game_id, 'pbp'), callback=self.parse_pbp)
+
+    def parse_box(self, response):
+        try:
+            soup = BeautifulSoup(response.body, 'html.parser')
+            header_table, box_stats = BoxScraper.extract_box_stats(soup, response.url)
+            if BoxScraper.is_valid_stats(box_stats):
+                self.writer.write('box', box_stats.values)
+        except Exception as e:
+            traceback.print_exc()
+            self.writer.fail(ncaa_util.parse_stats_link(response.url), 'box', e)
+
+    def parse_pbp(self, response):
+        try:
+            soup = BeautifulSoup(response.body, 'html.parser')
+            header_table, pbp_stats = PBPScraper.extract_pbp_stats(soup, response.url)
+            self.writer.write('raw_pbp', pbp_stats.values)
+        except Exception as e:
+            traceback.print_exc()
+            self.writer.fail(ncaa_util.parse_stats_link(response.url), 'raw_pbp', e)
 
     def spider_closed(self, spider):
         """Activates on spider closed signal"""
         # log.msg("Closing reactor", level=log.INFO)
         spider.crawler.stats.set_value('failed_urls', ','.join(spider.failed_urls))
-        print("a;sldkfja;slfdjds")
-        # print(self.soups)
-
-        text_file = open("/Users/sethhendrickson/cbbdb/soup.txt", "w")
-        text_file.write(self.soups[0])
-        text_file.close()
+        print('schedule pages skipped: %s' % spider.crawler.stats.get_value('schedule/pages_skipped', 0))
 
-        with open("output.csv", "a") as f:
-            writer = csv.writer(f)
-            for games in self.games:
-                writer.writerows(games)
-        dbutil.update_games_table()
-        os.remove("output.csv")
+        # unchanged pages skip parsing and the games table merge entirely
+        if len(self.games.rows()) > 0:
+            with open("output.csv", "a") as f:
+                writer = csv.writer(f)
+                writer.writerows(self.games.rows())
+            dbutil.update_games_table()
+            os.remove("output.csv")
+        # only remember validators once the games they describe are stored
+        dbutil.save_page_validators(self.new_validators)
+        if self.follow_games:
+            self.writer.close()
+            # load box and pbp batches spooled while the database was unavailable
+            dbutil.replay_spool()
+        # the summaries are refreshed from the ChangeLog on the server
+        if get_storage().logs_changes:
+            DataSummarizer.refresh_coverage()
+            refresh_team_games()
 
 class ScheduleItem(scrapy.Item):
     games = scrapy.Field()
@@ -66,14 +145,11 @@ class ScheduleItem(scrapy.Item):
 if __name__ == "__main__":
     spider = ScheduleSpider()
     settings = Settings()
-    settings.set('DOWNLOAD_DELAY', 0.25)
-    settings.set('COOKIES_ENABLED', False)
+    settings.setmodule('stats.settings')
     crawler = Crawler(spider, settings)
     crawler.crawl()
     crawler.signals.connect(spider_closing, signal=signals.spider_closed)
     # reactor.run()
     print(crawler.stats.get_stats())
-    dbutil.update_games_table()
-    os.remove("output.csv")
     # reactor.stop()
 
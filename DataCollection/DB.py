@@ -1,15 +1,179 @@
+import os
+import threading
+from contextlib import contextmanager
+from ConfigParser import SafeConfigParser
+
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+# connection settings are read from these defaults, then the [db] section of
+# the config file, then CBB_DB_<SETTING> environment variables
+CONFIG_FILE = os.environ.get("CBB_DB_CONFIG", os.path.expanduser("~/.cbbdb.cfg"))
+DEFAULTS = {"database": "cbb",
+            "user": "sethhendrickson",
+            "host": "localhost",
+            "port": "5432",
+            "connect_timeout": "10",
+            "minconn": "1",
+            "maxconn": "8"}
+# settings with no default, which the config file or environment must give;
+# an empty password leaves authentication to ~/.pgpass or the server
+REQUIRED = ["password"]
+
+
+def load_config(path=CONFIG_FILE):
+    """
+    INPUT: STRING
+    OUTPUT: DICT
+
+    Read the database settings from defaults, config file and environment
+    """
+    config = dict(DEFAULTS)
+    parser = SafeConfigParser()
+    if parser.read(path) and parser.has_section("db"):
+        config.update(parser.items("db"))
+    for key in list(DEFAULTS) + REQUIRED:
+        env = os.environ.get("CBB_DB_%s" % key.upper())
+        if env is not None:
+            config[key] = env
+    return config
+
+
+class BlockingPool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool whose getconn waits for a connection to be
+    returned when all maxconn are borrowed, rather than raising PoolError
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        ThreadedConnectionPool.__init__(self, minconn, maxconn, *args, **kwargs)
+        self.slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        self.slots.acquire()
+        try:
+            return ThreadedConnectionPool.getconn(self, key)
+        except:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            ThreadedConnectionPool.putconn(self, conn, key, close)
+        finally:
+            self.slots.release()
+
+
+class ConnectionManager(object):
+    """
+    Lazily created, bounded, thread-safe pool of database connections.
+    Borrowing waits while every connection is in use.
+
+    Nothing connects until a connection is first borrowed. A process forked
+    after the pool was created gets its own pool on first use, since
+    connections cannot be shared across processes.
+    """
+
+    def __init__(self, config=None):
+        self.config = config
+        self.pool = None
+        self.pid = None
+        self.lock = threading.Lock()
+        # pools inherited from a parent process, kept referenced for the life
+        # of this one: freeing one closes its connections, and closing a
+        # connection terminates the session it shares with the parent
+        self._abandoned = []
+
+    def dsn(self):
+        if self.config is None:
+            self.config = load_config()
+        missing = [key for key in REQUIRED if key not in self.config]
+        if len(missing) > 0:
+            raise ValueError("no database %s configured: set CBB_DB_%s or %s in the [db] "
+                             "section of %s" % (missing[0], missing[0].upper(), missing[0],
+                                                CONFIG_FILE))
+        return {key: self.config[key] for key in ["database", "user", "password", "host", "port",
+                                                   "connect_timeout"]}
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is not None and self.pid != os.getpid():
+                # inherited from the parent process: abandon it without closing,
+                # closing would terminate the parent's sessions
+                self._abandoned.append(self.pool)
+                self.pool = None
+            if self.pool is None:
+                dsn = self.dsn()
+                self.pool = BlockingPool(int(self.config["minconn"]),
+                                         int(self.config["maxconn"]), **dsn)
+                self.pid = os.getpid()
+            return self.pool
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a pooled connection for the duration of a with block. The
+        transaction is committed when the block exits normally and rolled
+        back if it raises.
+        """
+        pool = self.get_pool()
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn)
+
+    def connect(self):
+        """Open a dedicated connection outside the pool (caller closes it)"""
+        return psycopg2.connect(**self.dsn())
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None and self.pid == os.getpid():
+                self.pool.closeall()
+            elif self.pool is not None:
+                self._abandoned.append(self.pool)
+            self.pool = None
+
+manager = ConnectionManager()
+connection = manager.connection
 
-database = "cbb"
-user = "sethhendrickson"
-password = "abc123"
-host = "localhost"
-port = "5432"
-conn = psycopg2.connect(database=database, user=user, password=password, host=host, port=port)
 TABLES = {"games": "games_test",
           "box": "box_stats",
-          "pbp": "pbp_stats",
+          "pbp": "pbp",
+          "pbp_compact": "pbp_compact",
           "raw_pbp": "raw_pbp",
           "division_one": "division_one",
           "teams": "teams",
           "kenpom_ranks": "kenpom_ranks"}
+# insert column order for the tables loaded by the scrapers
+COLUMNS = {"games": ["game_id", "dt", "hteam_id", "ateam_id", "opp_string", "neutral",
+                     "neutral_site", "home_outcome", "numot", "home_score", "away_score"],
+           "box": ["game_id", "team", "team_id", "first_name", "last_name", "pos", "min",
+                   "fgm", "fga", "tpm", "tpa", "ftm", "fta", "pts", "oreb", "dreb", "reb",
+                   "ast", "turnover", "stl", "blk", "pf"],
+           "raw_pbp": ["game_id", "team_id", "time", "first_name", "last_name", "play",
+                       "hscore", "ascore"],
+           "pbp": ["game_id", "pbp_id", "team", "teamid", "time", "first_name", "last_name",
+                   "play", "hscore", "ascore", "possession", "poss_time_full", "poss_time",
+                   "home_fouls", "away_fouls", "second_chance", "timeout_pts", "turnover_pts",
+                   "and_one", "blocked", "stolen", "assisted", "assist_play", "recipient",
+                   "charge"]}
+# SQL types of the loaded columns, used to convert scraped values column-wise
+COLUMN_TYPES = {"games": {"game_id": "int", "dt": "text", "hteam_id": "int", "ateam_id": "int",
+                          "opp_string": "text", "neutral": "bool", "neutral_site": "text",
+                          "home_outcome": "bool", "numot": "int", "home_score": "int",
+                          "away_score": "int"},
+                "box": dict([(col, "int") for col in COLUMNS["box"]],
+                            team="text", first_name="text", last_name="text", pos="text"),
+                "raw_pbp": {"game_id": "int", "team_id": "int", "time": "real",
+                            "first_name": "text", "last_name": "text", "play": "text",
+                            "hscore": "int", "ascore": "int"},
+                "pbp": dict([(col, "int") for col in COLUMNS["pbp"]],
+                            team="text", time="real", first_name="text", last_name="text",
+                            play="text", blocked="bool", stolen="bool", assisted="bool",
+                            assist_play="text", recipient="text", charge="bool")}
@@ -1,9 +1,32 @@
+import sys
+
 import DB
+import CompactPBP
+
+# event tables that carry a stored season column and can be partitioned by it
+SEASON_TABLES = ["box", "raw_pbp", "pbp"]
+
+def create_season_function():
+    """season_of(dt): seasons run from July to June and are named by the spring year"""
+    q = """ CREATE OR REPLACE FUNCTION season_of(dt DATE) RETURNS SMALLINT
+            LANGUAGE sql IMMUTABLE AS $$
+                SELECT (CASE
+                            WHEN EXTRACT(month FROM dt) <= 6 THEN EXTRACT(year FROM dt)
+                            ELSE EXTRACT(year FROM dt) + 1
+                        END)::SMALLINT
+            $$
+        """
+    return q
+
+def partition_clause(partitioned):
+    return "PARTITION BY LIST (season)" if partitioned else ""
 
 def create_games():
+    """The season is stored, derived from dt by season_of (see create_season_function)"""
     q = """ CREATE TABLE {games}
             (
             dt DATE    NOT NULL,
+            season SMALLINT GENERATED ALWAYS AS (season_of(dt)) STORED,
             hteam_id INT,
             ateam_id INT,
             home_score INT,
@@ -20,10 +43,35 @@ def create_games():
         """.format(games=DB.TABLES.get("games"))
     return q
 
-def create_ncaa_box():
+def create_url_errors():
+    q = """ CREATE TABLE url_errors
+            (
+            id SERIAL PRIMARY KEY,
+            game_id INT REFERENCES {games}(game_id) NOT NULL
+            )
+        """.format(games=DB.TABLES.get("games"))
+    return q
+
+def create_scrape_errors():
+    """Games that failed to parse or load, with the reason (see BatchWriter)"""
+    q = """ CREATE TABLE scrape_errors
+            (
+            id SERIAL PRIMARY KEY,
+            game_id INT,
+            tbl TEXT NOT NULL,
+            error TEXT NOT NULL,
+            reason TEXT,
+            failed_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+            CREATE INDEX scrape_errors_game_id_idx ON scrape_errors (game_id)
+        """
+    return q
+
+def create_ncaa_box(partitioned=False):
     q = """ CREATE TABLE {box}
             (
-            game_id INT REFERENCES games_test(game_id) NOT NULL,
+            game_id INT REFERENCES {games}(game_id) NOT NULL,
+            season SMALLINT NOT NULL,
             team TEXT NOT NULL,
             team_id INT,
             first_name TEXT NOT NULL,
@@ -45,16 +93,18 @@ def create_ncaa_box():
             stl int,
             blk int,
             pf int
-            )
-        """.format(box=get_table_name("box"),
-                   games=DB.TABLES.get("games_test"))
+            ) {partition}
+        """.format(box=DB.TABLES.get("box"),
+                   games=DB.TABLES.get("games"),
+                   partition=partition_clause(partitioned))
     return q
 
-def create_pbp():
-    q = """ CREATE TABLE {table_name}
+def create_pbp(partitioned=False):
+    q = """ CREATE TABLE {pbp}
             (
             game_id INT REFERENCES {games}(game_id) NOT NULL,
-            pbp_id INT REFERENCES {raw_pbp}(id) NOT NULL,
+            season SMALLINT NOT NULL,
+            pbp_id INT NOT NULL,
             team TEXT NOT NULL,
             teamid INT,
             time REAL,
@@ -78,29 +128,179 @@ def create_pbp():
             assist_play TEXT,
             recipient TEXT,
             charge BOOLEAN,
-            UNIQUE(pbp_id)
-            )
+            UNIQUE(pbp_id, season),
+            FOREIGN KEY (pbp_id, season) REFERENCES {raw_pbp}(id, season)
+            ) {partition}
         """.format(pbp=DB.TABLES.get("pbp"),
                    games=DB.TABLES.get("games"),
-                   raw_pbp=DB.TABLES.get("raw_pbp"))
+                   raw_pbp=DB.TABLES.get("raw_pbp"),
+                   partition=partition_clause(partitioned))
+
+    return q
 
+def create_play_codes():
+    q = """ CREATE TABLE play_codes
+            (
+            code SMALLINT PRIMARY KEY,
+            play TEXT NOT NULL UNIQUE
+            );
+            INSERT INTO play_codes (code, play) VALUES {codes}
+            ON CONFLICT DO NOTHING
+        """.format(codes=", ".join(["(%s, '%s')" % (code, play) for code, play
+                                    in enumerate(CompactPBP.PLAY_CODES, 1)]))
     return q
 
-def create_raw_pbp():
+def create_pbp_names():
+    q = """ CREATE TABLE pbp_names
+            (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+            )
+        """
+    return q
+
+def create_pbp_players():
+    q = """ CREATE TABLE pbp_players
+            (
+            id SERIAL PRIMARY KEY,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL DEFAULT '',
+            UNIQUE(first_name, last_name)
+            )
+        """
+    return q
+
+def create_pbp_compact(partitioned=False):
+    """
+    Compact pbp layout: strings are ids into play_codes, pbp_names and
+    pbp_players, time is whole elapsed seconds, counts are smallints and
+    blocked/stolen/assisted/charge are bits of flags (see CompactPBP.FLAGS)
+    """
+    q = """ CREATE TABLE {pbp_compact}
+            (
+            game_id INT REFERENCES {games}(game_id) NOT NULL,
+            pbp_id INT NOT NULL,
+            team_id INT REFERENCES pbp_names(id),
+            player_id INT REFERENCES pbp_players(id),
+            recipient_id INT REFERENCES pbp_players(id),
+            season SMALLINT NOT NULL,
+            elapsed SMALLINT,
+            play_code SMALLINT REFERENCES play_codes(code) NOT NULL,
+            assist_code SMALLINT REFERENCES play_codes(code),
+            teamid SMALLINT,
+            possession SMALLINT,
+            hscore SMALLINT,
+            ascore SMALLINT,
+            home_fouls SMALLINT NOT NULL,
+            away_fouls SMALLINT NOT NULL,
+            poss_time_full SMALLINT NOT NULL,
+            poss_time SMALLINT,
+            second_chance SMALLINT,
+            timeout_pts SMALLINT,
+            turnover_pts SMALLINT,
+            and_one SMALLINT,
+            flags SMALLINT NOT NULL DEFAULT 0,
+            UNIQUE(pbp_id, season),
+            FOREIGN KEY (pbp_id, season) REFERENCES {raw_pbp}(id, season)
+            ) {partition}
+        """.format(pbp_compact=DB.TABLES.get("pbp_compact"),
+                   games=DB.TABLES.get("games"),
+                   raw_pbp=DB.TABLES.get("raw_pbp"),
+                   partition=partition_clause(partitioned))
+    return q
+
+def create_pbp_view():
+    """View over pbp_compact with the column layout of create_pbp"""
+    flag = "CASE WHEN p.flags & {bit} <> 0 THEN TRUE END AS {col}"
+    q = """ CREATE VIEW {pbp} AS
+            SELECT p.game_id, p.season, p.pbp_id, n.name AS team, p.teamid::INT AS teamid,
+                   (p.elapsed / 60.)::REAL AS time, pl.first_name,
+                   NULLIF(pl.last_name, '') AS last_name, pc.play,
+                   p.hscore::INT AS hscore, p.ascore::INT AS ascore,
+                   p.possession::INT AS possession, p.poss_time_full::INT AS poss_time_full,
+                   p.poss_time::INT AS poss_time, p.home_fouls::INT AS home_fouls,
+                   p.away_fouls::INT AS away_fouls, p.second_chance::INT AS second_chance,
+                   p.timeout_pts::INT AS timeout_pts, p.turnover_pts::INT AS turnover_pts,
+                   p.and_one::INT AS and_one, {blocked}, {stolen}, {assisted},
+                   ac.play AS assist_play, r.first_name || ' ' || r.last_name AS recipient,
+                   {charge}
+            FROM {pbp_compact} p
+            JOIN play_codes pc ON pc.code = p.play_code
+            LEFT JOIN play_codes ac ON ac.code = p.assist_code
+            LEFT JOIN pbp_names n ON n.id = p.team_id
+            LEFT JOIN pbp_players pl ON pl.id = p.player_id
+            LEFT JOIN pbp_players r ON r.id = p.recipient_id
+        """.format(pbp=DB.TABLES.get("pbp"),
+                   pbp_compact=DB.TABLES.get("pbp_compact"),
+                   **dict([(col, flag.format(bit=bit, col=col))
+                           for col, bit in CompactPBP.FLAGS.items()]))
+    return q
+
+def compact_pbp(partitioned=False, seasons=()):
+    """
+    INPUT: BOOL, LIST
+    OUTPUT: LIST
+
+    Queries that move an existing pbp table into pbp_compact and replace it
+    with the compatibility view. The old table is kept as pbp_wide.
+    """
+    pbp, compact = DB.TABLES.get("pbp"), DB.TABLES.get("pbp_compact")
+    flags = " + ".join(["(CASE WHEN p.{col} THEN {bit} ELSE 0 END)".format(col=col, bit=bit)
+                        for col, bit in sorted(CompactPBP.FLAGS.items(), key=lambda x: x[1])])
+    qs = [create_play_codes(), create_pbp_names(), create_pbp_players(),
+          create_pbp_compact(partitioned)]
+    if partitioned:
+        qs += [create_season_partition("pbp_compact", season) for season in seasons]
+    qs += ["""ALTER TABLE {pbp} RENAME TO pbp_wide""".format(pbp=pbp),
+           """INSERT INTO pbp_names (name)
+              SELECT DISTINCT team FROM pbp_wide WHERE team IS NOT NULL
+              ON CONFLICT DO NOTHING""",
+           """INSERT INTO pbp_players (first_name, last_name)
+              SELECT DISTINCT first_name, COALESCE(last_name, '') FROM pbp_wide
+              WHERE first_name IS NOT NULL
+              ON CONFLICT DO NOTHING""",
+           """INSERT INTO play_codes (code, play)
+              SELECT (SELECT max(code) FROM play_codes) + row_number() OVER (), play
+              FROM (SELECT play FROM pbp_wide UNION SELECT assist_play FROM pbp_wide) p
+              WHERE play IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM play_codes c WHERE c.play = p.play)""",
+           """INSERT INTO {compact} ({columns})
+              SELECT p.game_id, p.pbp_id, n.id, pl.id,
+                     (SELECT r.id FROM pbp_players r
+                      WHERE r.first_name || ' ' || r.last_name = p.recipient
+                      ORDER BY r.id LIMIT 1),
+                     p.season, round(p.time * 60), pc.code, ac.code, p.teamid,
+                     p.possession, p.hscore, p.ascore, p.home_fouls, p.away_fouls,
+                     p.poss_time_full, p.poss_time, p.second_chance, p.timeout_pts,
+                     p.turnover_pts, p.and_one, {flags}
+              FROM pbp_wide p
+              JOIN play_codes pc ON pc.play = p.play
+              LEFT JOIN play_codes ac ON ac.play = p.assist_play
+              LEFT JOIN pbp_names n ON n.name = p.team
+              LEFT JOIN pbp_players pl
+              ON pl.first_name = p.first_name AND pl.last_name = COALESCE(p.last_name, '')
+           """.format(compact=compact, columns=", ".join(CompactPBP.COLUMNS), flags=flags),
+           create_pbp_view()]
+    return qs
+
+def create_raw_pbp(partitioned=False):
     q = """ CREATE TABLE {raw_pbp}
         (
-        id SERIAL PRIMARY KEY,
+        id SERIAL,
         game_id INT REFERENCES {games}(game_id) NOT NULL,
+        season SMALLINT NOT NULL,
         team_id INT,
         time REAL,
         first_name TEXT NOT NULL,
         last_name TEXT,
         play TEXT,
         hscore INT,
-        ascore INT
-        )
+        ascore INT,
+        PRIMARY KEY (id, season)
+        ) {partition}
     """.format(raw_pbp=DB.TABLES.get("raw_pbp"),
-               games=DB.TABLES.get("games"))
+               games=DB.TABLES.get("games"),
+               partition=partition_clause(partitioned))
 
     return q
 
@@ -140,12 +340,319 @@ def create_kenpom_ranks():
         """.format(kenpom_ranks=DB.TABLES.get.get("kenpom_ranks"))
     return q
 
-def add_table(qfunc):
-    q = qfunc()
-    cur = DB.conn.cursor()
+def create_crawl_budget():
+    q = """ CREATE TABLE crawl_budget
+            (
+            host TEXT PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated DOUBLE PRECISION NOT NULL
+            )
+        """
+    return q
+
+def create_page_validators():
+    q = """ CREATE TABLE page_validators
+            (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            checked_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """
+    return q
+
+def create_game_hashes():
+    """Content hash of the rows last loaded for each game into box_stats/raw_pbp"""
+    q = """ CREATE TABLE game_hashes
+            (
+            game_id INT NOT NULL,
+            tbl TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (game_id, tbl)
+            )
+        """
+    return q
+
+def create_pbp_builds():
+    """
+    Engine version, row count and possession time error of each game's
+    derived pbp rows, by the physical table (or shadow table) holding them
+    """
+    q = """ CREATE TABLE pbp_builds
+            (
+            tbl TEXT NOT NULL,
+            game_id INT NOT NULL,
+            season SMALLINT NOT NULL,
+            engine_version INT NOT NULL,
+            n_rows INT NOT NULL,
+            poss_time_error INT,
+            built_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (tbl, game_id)
+            );
+            CREATE INDEX pbp_builds_season_idx ON pbp_builds (tbl, season)
+        """
+    return q
+
+def create_game_coverage():
+    """Which of box_stats, raw_pbp and pbp hold rows for each game (see DataSummary)"""
+    q = """ CREATE TABLE game_coverage
+            (
+            game_id INT PRIMARY KEY,
+            season SMALLINT NOT NULL,
+            box BOOLEAN NOT NULL,
+            raw_pbp BOOLEAN NOT NULL,
+            pbp BOOLEAN NOT NULL
+            );
+            CREATE INDEX game_coverage_season_idx ON game_coverage (season)
+        """
+    return q
+
+def create_season_coverage():
+    q = """ CREATE TABLE season_coverage
+            (
+            season SMALLINT PRIMARY KEY,
+            games INT NOT NULL,
+            box INT NOT NULL,
+            raw_pbp INT NOT NULL,
+            pbp INT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """
+    return q
+
+def create_team_games():
+    """One row per team per played game (see DataWrangling.unstack_games)"""
+    q = """ CREATE TABLE team_games
+            (
+            game_id INT NOT NULL,
+            dt DATE NOT NULL,
+            season SMALLINT NOT NULL,
+            team INT NOT NULL,
+            opp INT NOT NULL,
+            score SMALLINT NOT NULL,
+            opp_score SMALLINT NOT NULL,
+            margin SMALLINT NOT NULL,
+            location CHAR(1) NOT NULL,
+            outcome BOOLEAN NOT NULL,
+            PRIMARY KEY (game_id, team)
+            );
+            CREATE INDEX team_games_team_idx ON team_games (team, season);
+            CREATE INDEX team_games_season_idx ON team_games (season, dt)
+        """
+    return q
+
+def create_team_ratings():
+    """Adjusted ratings of each team as of each date of a season (see Ratings.rate_season)"""
+    q = """ CREATE TABLE team_ratings
+            (
+            season SMALLINT NOT NULL,
+            as_of DATE NOT NULL,
+            team INT NOT NULL,
+            games SMALLINT NOT NULL,
+            adj_o REAL NOT NULL,
+            adj_d REAL NOT NULL,
+            adj_t REAL NOT NULL,
+            home_adv REAL NOT NULL,
+            PRIMARY KEY (season, as_of, team)
+            );
+            CREATE INDEX team_ratings_team_idx ON team_ratings (team, season, as_of)
+        """
+    return q
+
+def create_ingest_log():
+    """
+    One row per game written to a logged table. seq orders the log; xid is
+    the writing transaction, which is what consumers' watermarks are kept in.
+    """
+    q = """ CREATE TABLE ingest_log
+            (
+            seq BIGSERIAL PRIMARY KEY,
+            xid BIGINT NOT NULL DEFAULT txid_current(),
+            tbl TEXT NOT NULL,
+            game_id INT NOT NULL,
+            op TEXT NOT NULL,
+            logged_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+            CREATE INDEX ingest_log_xid_idx ON ingest_log (xid)
+        """
+    return q
+
+def create_watermarks():
+    q = """ CREATE TABLE watermarks
+            (
+            consumer TEXT PRIMARY KEY,
+            xmin BIGINT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """
+    return q
+
+def partition_name(table, season):
+    return "%s_%s" % (DB.TABLES.get(table), int(season))
+
+def create_season_partition(table, season):
+    """Partition of a partitioned event table (see SEASON_TABLES) holding one season"""
+    q = """ CREATE TABLE IF NOT EXISTS {partition}
+            PARTITION OF {table} FOR VALUES IN ({season})
+        """.format(partition=partition_name(table, season),
+                   table=DB.TABLES.get(table),
+                   season=int(season))
+    return q
+
+def detach_season_partition(table, season, tablespace=None):
+    """
+    Detach a finished season from its parent table so it is no longer
+    scanned or vacuumed with the live seasons. The detached table can be
+    moved to a cheaper tablespace, dumped and dropped, or attached again.
+    """
+    qs = ["""ALTER TABLE {table} DETACH PARTITION {partition}"""]
+    if tablespace is not None:
+        qs.append("""ALTER TABLE {partition} SET TABLESPACE %s""" % tablespace)
+    return [q.format(table=DB.TABLES.get(table), partition=partition_name(table, season))
+            for q in qs]
+
+def attach_season_partition(table, season):
+    q = """ ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES IN ({season})
+        """.format(table=DB.TABLES.get(table),
+                   partition=partition_name(table, season),
+                   season=int(season))
+    return q
+
+def repartition(table, qfunc, seasons):
+    """
+    INPUT: STRING, FUNCTION, LIST
+    OUTPUT: LIST
+
+    Queries that move an existing heap event table into a season partitioned
+    table built by qfunc(partitioned=True): the old table is renamed to
+    <table>_heap and its rows are copied into the season partitions, with the
+    season taken from the games table.
+    """
+    name = DB.TABLES.get(table)
+    columns = DB.COLUMNS[table] + (["id"] if table == "raw_pbp" else [])
+    qs = ["""ALTER TABLE {name} RENAME TO {name}_heap""".format(name=name),
+          create_season_function(),
+          qfunc(partitioned=True)]
+    qs += [create_season_partition(table, season) for season in seasons]
+    qs.append(""" INSERT INTO {name} ({columns}, season)
+                  SELECT {h_columns}, season_of(g.dt)
+                  FROM {name}_heap h
+                  JOIN {games} g ON h.game_id = g.game_id
+              """.format(name=name, games=DB.TABLES.get("games"),
+                         columns=", ".join(columns),
+                         h_columns=", ".join(["h.%s" % col for col in columns])))
+    if table == "raw_pbp":
+        # pbp rows point at raw_pbp ids, so the copied ids are kept and the
+        # new sequence continues after them
+        qs.append(""" SELECT setval(pg_get_serial_sequence('{name}', 'id'), max(id))
+                      FROM {name}
+                  """.format(name=name))
+    return qs
+
+def create_indexes():
+    """Indexes supporting work discovery (get_games_to_scrape) and per-game reads"""
+    qs = ["""CREATE INDEX IF NOT EXISTS {games}_dt_scrape_idx
+             ON {games} (dt DESC) WHERE game_id IS NOT NULL""",
+          """CREATE INDEX IF NOT EXISTS {games}_season_scrape_idx
+             ON {games} (season, dt DESC) WHERE game_id IS NOT NULL""",
+          """CREATE INDEX IF NOT EXISTS {box}_game_id_idx ON {box} (game_id)""",
+          """CREATE INDEX IF NOT EXISTS {box}_season_idx ON {box} (season, game_id)""",
+          """CREATE INDEX IF NOT EXISTS raw_pbp_game_id_idx ON raw_pbp (game_id, id)""",
+          """CREATE INDEX IF NOT EXISTS raw_pbp_season_idx ON raw_pbp (season, game_id)""",
+          """CREATE INDEX IF NOT EXISTS pbp_game_id_idx ON pbp (game_id)""",
+          """CREATE INDEX IF NOT EXISTS pbp_season_idx ON pbp (season, game_id)""",
+          """CREATE INDEX IF NOT EXISTS url_errors_game_id_idx ON url_errors (game_id)"""]
+    return [q.format(games=DB.TABLES.get("games"), box=DB.TABLES.get("box")) for q in qs]
+
+def add_season_columns(tables=SEASON_TABLES):
+    """
+    Migration storing the season on a games table and event tables created
+    before they carried it. Run it (python DBCreate.py seasons) before
+    loading into such a database: the loaders fill and query the season
+    columns and season_of.
+
+    games gets a generated column, filled from dt by the table rewrite.
+    Event rows get their game's season in one bulk UPDATE per table; the
+    column is only made NOT NULL if every row's game was found. The season
+    indexes are built once the columns are full.
+    """
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(create_season_function())
+        cur.execute(""" ALTER TABLE {games} ADD COLUMN IF NOT EXISTS
+                        season SMALLINT GENERATED ALWAYS AS (season_of(dt)) STORED
+                    """.format(games=DB.TABLES.get("games")))
+        for table in tables:
+            name = DB.TABLES.get(table)
+            cur.execute(""" SELECT 1 FROM information_schema.columns
+                            WHERE table_name = %s AND column_name = 'season'
+                        """, (name,))
+            if cur.fetchone() is not None:
+                continue
+            cur.execute("ALTER TABLE {name} ADD COLUMN season SMALLINT".format(name=name))
+            cur.execute(""" UPDATE {name} t SET season = g.season
+                            FROM {games} g
+                            WHERE g.game_id = t.game_id
+                        """.format(name=name, games=DB.TABLES.get("games")))
+            cur.execute("SELECT count(*) FROM {name} WHERE season IS NULL".format(name=name))
+            orphans = cur.fetchone()[0]
+            if orphans > 0:
+                print("%s: %s rows have no game, season left nullable" % (name, orphans))
+            else:
+                cur.execute("ALTER TABLE {name} ALTER COLUMN season SET NOT NULL"
+                            .format(name=name))
+        for q in create_indexes():
+            cur.execute(q)
+
+def add_indexes():
+    try:
+        with DB.connection() as conn:
+            cur = conn.cursor()
+            for q in create_indexes():
+                cur.execute(q)
+    except:
+        print("failed to add indexes")
+        raise
+
+def execute_all(qs):
+    """Run a list of DDL queries in one transaction"""
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        for q in qs:
+            cur.execute(q)
+
+def create_partitioned_tables(seasons):
+    """Season partitioned box_stats, raw_pbp and pbp with a partition for each season"""
+    qs = [create_season_function(),
+          create_ncaa_box(partitioned=True),
+          create_raw_pbp(partitioned=True),
+          create_pbp(partitioned=True)]
+    qs += [create_season_partition(table, season) for table in SEASON_TABLES for season in seasons]
+    return qs
+
+def add_table(qfunc, **kwargs):
+    q = qfunc(**kwargs)
     try:
-        cur.execute(q)
-        DB.conn.commit()
+        with DB.connection() as conn:
+            conn.cursor().execute(q)
     except:
-        DB.conn.rollback()
         print("failed to add table")
+
+def create_tables():
+    """Create the tables the scrapers and loaders write, on the storage CBB_STORAGE selects"""
+    # imported here: Storage builds its PostgreSQL tables with this module
+    from DataCollection.Storage import get_storage
+    get_storage().create_tables()
+
+# migrations of a database created by an earlier version of this module,
+# and the tables of a new one
+MIGRATIONS = {"seasons": add_season_columns,
+              "indexes": add_indexes,
+              "tables": create_tables}
+
+if __name__ == "__main__":
+    # python DBCreate.py tables, python DBCreate.py seasons
+    for name in sys.argv[1:]:
+        MIGRATIONS[name]()
@@ -1,67 +1,74 @@
-import pandas as pd
-import numpy as np
+from datetime import date
+from functools import partial
+import os
 import sys
+import traceback
+
+import pandas as pd
+import psycopg2
 
 from DataCollection.NCAAStatsUtil import NCAAStatsUtil as ncaa_util
+from DataCollection.BulkLoad import convert_columns
 import DataCollection.DB as DB
+import DataCollection.Spool as Spool
+import DataCollection.Storage as Storage
+# PostgreSQL helpers that moved to the storage which uses them
+from DataCollection.Storage import compact_pbp, ensure_season_partitions, game_hash, merge_games
 
 
-CONN = DB.conn
-CUR = CONN.cursor()
 ALL_YEARS = range(2009, 2015)
 
 def insert_box_stats(box_table):
     """
-    INPUT: NCAAScraper
-    OUTPUT: None
+    INPUT: DATAFRAME
+    OUTPUT: INT
 
-    Scrape, format, and store box data
+    Store scraped box data, replacing a game's rows only if they changed
     """
+    rows = convert_columns(box_table.values, DB.COLUMNS['box'], DB.COLUMN_TYPES['box'])
+    return load_or_spool('box', rows)
 
-    q = """ INSERT INTO {box} (game_id, team, team_id, first_name, last_name,
-            pos, min, fgm, fga, tpm, tpa, ftm, fta, pts, oreb, dreb, reb,
-            ast, turnover, stl, blk, pf) VALUES (%s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """.format(box=DB.TABLES.get('box'))
-    vals = sql_convert(box_table.values)
-    try:
-        CUR.executemany(q, vals)
-        CONN.commit()
-    except Exception:
-        CONN.rollback()
+def replace_games(table, rows):
+    """
+    INPUT: STRING, DATAFRAME
+    OUTPUT: INT
+
+    Idempotently store the converted rows of one or more scraped games.
+    Each game's content hash is compared with the one in game_hashes: an
+    unchanged game is skipped, a changed or new one has its rows deleted and
+    bulk inserted again, all in one transaction. Return the number of games
+    written.
+
+    On SQLite, which keeps no hashes, every game is replaced.
+    """
+    return Storage.get_storage().load(table, rows)
+
+def season_dates(season):
+    """Date range [start, end) of a season, which runs from July to June"""
+    return date(season - 1, 7, 1), date(season, 7, 1)
 
 def get_games_to_scrape(year=None, season=None, from_table='box', link_type='box', num_games=500):
-    """Get a list of games that haven't been scraped"""
-    table = DB.TABLES.get(from_table)
-    assert table, "From table must be in %s" % DB.TABLES.keys()
+    """
+    Get a list of games that haven't been scraped
 
+    Uses NOT EXISTS anti-joins against the game_id indexes and a season or
+    date range filter on the games indexes (see DBCreate.create_indexes).
+    """
+    start, end = None, None
     if year is not None:
-        year_filter = "AND EXTRACT(YEAR FROM dt)={year}".format(year=year)
-    elif season is not None:
-        year_filter = \
-            """AND (CASE
-                        WHEN EXTRACT(MONTH FROM dt) <= 6 THEN EXTRACT(YEAR FROM dt)
-                        ELSE EXTRACT(YEAR FROM dt) + 1
-                    END) = {season}""".format(season=season)
-    else:
-        year_filter = ""
-
-    q = """ SELECT game_id
-            FROM {games}
-            WHERE game_id NOT IN
-                (SELECT DISTINCT(game_id) FROM {table})
-            AND game_id IS NOT NULL
-            AND game_id NOT IN (SELECT game_id FROM url_errors)
-            {year_filter}
-            ORDER BY DT DESC
-            LIMIT {num_games}
-        """.format(year_filter=year_filter, num_games=num_games,
-                   check_link=from_table, games=DB.TABLES.get('games'),
-                   table=DB.TABLES.get(from_table))
-    CUR.execute(q)
-    results = CUR.fetchall()
-    results = [ncaa_util.stats_link(x[0], link_type) for x in results]
-    return results
+        start, end = date(year, 1, 1), date(year + 1, 1, 1)
+
+    # the storage the loaders write to, so the games already scraped are seen
+    game_ids = Storage.get_storage().pending_games(from_table, start, end, num_games,
+                                                   season=season)
+    return [ncaa_util.stats_link(game_id, link_type) for game_id in game_ids]
+
+def get_scraped_game_ids(from_table='box'):
+    """Return the set of game ids that already have rows in the given table"""
+    table = DB.TABLES.get(from_table)
+    assert table, "From table must be in %s" % DB.TABLES.keys()
+    q = "SELECT DISTINCT(game_id) FROM {table}".format(table=table)
+    return {result[0] for result in Storage.get_storage().execute(q)}
 
 def get_team_pages(year=None):
     """Generate a list of team page urls for given year"""
@@ -71,156 +78,187 @@ def get_team_pages(year=None):
         years = ALL_YEARS
 
     q = """SELECT ncaaid FROM teams WHERE ncaaid IS NOT NULL"""
-    CUR.execute(q)
-    results = CUR.fetchall()
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(q)
+        results = cur.fetchall()
     teams = [result[0] for result in results]
     urls = []
     for year in years:
         year_code = ncaa_util.convert_ncaa_year_code(year)
         urls += ['http://stats.ncaa.org/team/index/%s?org_id=%s' % (year_code, team) for team in teams]
 
-def sql_convert(values):
-    """
-    INPUT: NCAAScraper, 2D Numpy Array
-    OUTPUT: 2D Numpy Array
+def get_unplayed():
+    """Return a list of games that don't have game ids or scores from games db"""
+    unplayed = Storage.get_storage().read_sql(
+        "SELECT * FROM %s WHERE game_id IS NULL OR home_score IS NULL" % DB.TABLES.get('games'))
+    unplayed['dt'] = unplayed['dt'].map(lambda x: str(x))
+
+    return unplayed
 
-    Convert floats to ints and nans to None
+def upsert_games(values):
     """
-    for i in range(len(values)):
-        for j in range(len(values[0])):
-            if type(values[i][j]) == float:
-                if values[i][j].is_integer():
-                    values[i][j] = int(values[i][j])
-                elif np.isnan(values[i][j]):
-                    values[i][j] = None
-            elif values[i][j] == 'nan':
-                values[i][j] = None
-            elif type(values[i][j]) == np.float64:
-                if np.isnan(values[i][j]):
-                    values[i][j] = None
-    return values
+    INPUT: 2D ARRAY
+    OUTPUT: DICT
 
-def get_existing_games():
-    """Return all existing games from the games database"""
-    existing = pd.read_sql("SELECT * FROM games_test", CONN)
-    existing['dt'] = existing['dt'].map(lambda x: str(x))
+    Merge scraped games (in DB.COLUMNS['games'] order) into the games table
+    of the configured storage. The rows are loaded into a staging table and
+    merged on the table's unique keys, so the existing games never leave the
+    database:
 
-    return existing
+    1. staged rows whose teams are stored the other way round are flipped
+       to the orientation already in the table
+    2. unplayed games (no game_id or no score) are updated by (dt, hteam_id, ateam_id)
+    3. games with a game_id are upserted ON CONFLICT (game_id)
+    4. games without a game_id are inserted unless already stored
 
-def get_unplayed():
-    """Return a list of games that don't have game ids from games db"""
-    unplayed = pd.read_sql("SELECT * FROM %s WHERE game_id IS NULL"
-                           % DB.TABLES.get('games'), CONN)
-    unplayed['dt'] = unplayed['dt'].map(lambda x: str(x))
+    Copies of an unplayed game left by earlier merges on the server are
+    deleted first.
 
-    return unplayed
+    Games against non-D1 opponents have a NULL team id, so the games are
+    matched on (dt, hteam_id, ateam_id) with IS NOT DISTINCT FROM (IS on
+    SQLite) rather than = or the unique key, which never match NULLs.
 
-def insert_missing(scraped_df):
-    """From scraped games, insert only ones that are not in the database already"""
-    existing1 = get_existing_games()
-    existing2 = existing1.rename(columns={'hteam_id': 'ateam_id', 'ateam_id': 'hteam_id'})
-    existing = pd.concat([existing1, existing2], axis=0)
-    merged = scraped_df.merge(existing, how='left', on=['dt', 'hteam_id', 'ateam_id'])
-    missing = merged[pd.isnull(merged.home_outcome_y)]
-    to_insert = scraped_df.merge(missing[['dt', 'hteam_id', 'ateam_id']], on=['dt', 'hteam_id', 'ateam_id'])
-    vals = sql_convert(to_insert.values)
-    q =  """ INSERT INTO games_test
-                (game_id, dt, hteam_id, ateam_id, opp_string, neutral, neutral_site,
-                 home_outcome, numot, home_score, away_score)
-             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-         """
-    try:
-        CUR.executemany(q, vals)
-        CONN.commit()
-    except:
-        CONN.rollback()
-        raise
-
-def update_unplayed(scraped_df):
-    """Update game entries in the database that were previously unplayed"""
-    unplayed = get_unplayed()
-    to_update = scraped_df.merge(unplayed[['dt', 'hteam_id', 'ateam_id']],
-                                 on=['dt', 'hteam_id', 'ateam_id'])
-    q = """ UPDATE games_test
-            SET home_score=%s,
-                 away_score=%s,
-                 neutral=%s,
-                 neutral_site=%s,
-                 home_outcome=%s,
-                 numot=%s,
-                 game_id=%s
-            WHERE (dt=%s AND hteam_id=%s AND ateam_id=%s)
-        """
-    vals = to_update[['home_score', 'away_score', 'neutral', 'neutral_site', 'home_outcome',
-                      'numot', 'game_id', 'dt', 'hteam_id', 'ateam_id']].values
-    vals = sql_convert(vals)
-
-    try:
-        CUR.executemany(q, vals)
-        CONN.commit()
-    except:
-        CONN.rollback()
-        raise
+    Return the number of rows touched by each step.
+    """
+    rows = convert_columns(values, DB.COLUMNS['games'], DB.COLUMN_TYPES['games'])
+    return Storage.get_storage().load('games', rows)
 
 def insert_pbp_data(values):
-    values = sql_convert(values)
-    q =  """ INSERT INTO pbp
-                (game_id, pbp_id, team, teamid, time, first_name, last_name,
-                 play, hscore, ascore, possession, poss_time_full,
-                 poss_time, home_fouls, away_fouls, second_chance,
-                 timeout_pts, turnover_pts, and_one, blocked, stolen,
-                 assisted, assist_play, recipient, charge)
-             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                     %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-         """
+    rows = convert_columns(values, DB.COLUMNS['pbp'], DB.COLUMN_TYPES['pbp'])
+    return load_or_spool('pbp', rows)
 
-    try:
-        CUR.executemany(q, values)
-        CONN.commit()
-    except:
-        CONN.rollback()
-        raise
+def load_pbp(rows):
+    Storage.get_storage().load('pbp', rows)
+
+def stream_games(q, params=(), chunk_size=10000):
+    """Stream the rows of q, ordered by game_id, one game at a time (see Storage.stream_games)"""
+    return Storage.get_storage().stream_games(q, params, chunk_size)
+
+def stream_unprocessed_pbp(season=None, chunk_size=10000):
+    """Stream the raw pbp of every game that has no processed pbp rows, one game at a time"""
+    return Storage.get_storage().stream_unprocessed_pbp(season, chunk_size)
+
+def stream_raw_pbp(game_ids, chunk_size=10000):
+    """Stream the raw pbp of the given games, one game at a time"""
+    return Storage.get_storage().stream_raw_pbp(game_ids, chunk_size)
 
 def insert_raw_pbp_data(values):
-    values = sql_convert(values)
-    q =  """ INSERT INTO raw_pbp
-                (game_id, team_id, time, first_name, last_name,
-                 play, hscore, ascore)
-             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-         """
+    rows = convert_columns(values, DB.COLUMNS['raw_pbp'], DB.COLUMN_TYPES['raw_pbp'])
+    return load_or_spool('raw_pbp', rows)
 
+def load_legacy(table, rows):
+    Storage.get_storage().load(table, rows)
+
+# loaders of converted rows, by the table name batches are spooled under
+LOADERS = {'box': partial(replace_games, 'box'),
+           'raw_pbp': partial(replace_games, 'raw_pbp'),
+           'pbp': load_pbp,
+           'ncaa_box': partial(load_legacy, 'ncaa_box'),
+           'ncaa_raw_pbp': partial(load_legacy, 'ncaa_raw_pbp')}
+# errors meaning the database is down, overloaded or timing out, rather than
+# the rows being bad; batches that hit them are spooled and retried later.
+# An exhausted pool is not one of them: borrowing waits for a free connection
+UNAVAILABLE = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+def load_or_spool(table, rows):
+    """
+    INPUT: STRING, DATAFRAME
+    OUTPUT: INT
+
+    Load converted rows, or append them to the local spool if the database
+    is unavailable so they can be replayed without re-crawling
+    """
     try:
-        CUR.executemany(q, values)
-        CONN.commit()
-    except:
-        CONN.rollback()
-        raise
+        return LOADERS[table](rows)
+    except UNAVAILABLE:
+        path = Spool.write(table, rows)
+        print("database unavailable, spooled %s rows to %s" % (rows.shape[0], path))
+        return 0
+
+def replay_spool(directory=None):
+    """
+    INPUT: STRING
+    OUTPUT: INT
+
+    Bulk load spooled batches oldest first, removing each once it is stored.
+    Stop at the first batch the database is still unavailable for. A batch
+    that fails for any other reason is set aside as <batch>.failed.
+    Return the number of batches loaded.
+    """
+    loaded = 0
+    for table, path in Spool.batches(directory):
+        try:
+            LOADERS[table](Spool.read(path))
+        except UNAVAILABLE:
+            break
+        except Exception:
+            traceback.print_exc()
+            os.rename(path, path + '.failed')
+            continue
+        Spool.remove(path)
+        loaded += 1
+    return loaded
 
 def update_games_table():
     """Routine to update the games table from a list of scraped games"""
-    column_names = ['game_id', 'dt', 'hteam_id', 'ateam_id', 'opp_string', 'home_outcome',
-                    'neutral_site', 'neutral', 'numot', 'home_score', 'away_score']
+    # rows are written by ScheduleSpider already deduplicated per game
+    column_names = DB.COLUMNS['games']
     scraped = pd.read_csv("output.csv", header=None, names=column_names)
-    scraped = scraped.drop_duplicates('game_id')
-    update_unplayed(scraped)
-    insert_missing(scraped)
+    return upsert_games(scraped.values)
+
+def get_page_validators(urls):
+    """
+    INPUT: LIST
+    OUTPUT: DICT
+
+    Return the stored (etag, last_modified, content_hash) validators for
+    each url that has been fetched before
+    """
+    if len(urls) == 0:
+        return {}
+    storage = Storage.get_storage()
+    match, params = storage.in_sql('url', urls)
+    q = """ SELECT url, etag, last_modified, content_hash
+            FROM page_validators
+            WHERE {match}
+        """.format(match=match)
+    return {url: (etag, last_modified, content_hash)
+            for url, etag, last_modified, content_hash in storage.execute(q, params)}
+
+def save_page_validators(validators):
+    """
+    INPUT: DICT
+    OUTPUT: None
+
+    Store url -> (etag, last_modified, content_hash) validators
+    """
+    storage = Storage.get_storage()
+    q = """ INSERT INTO page_validators (url, etag, last_modified, content_hash)
+            VALUES ({vals})
+            ON CONFLICT (url) DO UPDATE
+            SET etag=EXCLUDED.etag,
+                last_modified=EXCLUDED.last_modified,
+                content_hash=EXCLUDED.content_hash,
+                checked_at=CURRENT_TIMESTAMP
+        """.format(vals=storage.placeholders(4))
+    storage.executemany(q, [(url,) + tuple(v) for url, v in validators.items()])
+
+def read_season(table, season):
+    """Read one season of an event table; the stored season column prunes to its partition"""
+    storage = Storage.get_storage()
+    q = "SELECT * FROM {table} WHERE season = {p}".format(table=DB.TABLES.get(table),
+                                                            p=storage.param)
+    return storage.read_sql(q, (season,))
 
 def season_query_helper():
-    sub = """(SELECT
-                g.dt,
-                CASE
-                    WHEN EXTRACT(month from g.dt) <= 6 THEN EXTRACT(year from g.dt)
-                    ELSE EXTRACT(year from g.dt) + 1
-                END AS season,
-                b.*
-             FROM box_stats b
-             JOIN games_test g
-             ON b.game_id = g.game_id)"""
-    season = """SELECT season, count(distinct(game_id))
-                FROM %s AS sub
-                GROUP BY season""" % sub
-
-    return pd.read_sql(season, DB.conn)
+    # maintained incrementally by DataSummary.DataSummarizer.refresh_coverage
+    season = """SELECT season, box AS count
+                FROM season_coverage
+                ORDER BY season"""
+
+    with DB.connection() as conn:
+        return pd.read_sql(season, conn)
 
     # extract_season = """(CASE
     #                     WHEN EXTRACT(month from dt) <= 6 THEN EXTRACT(year from dt)
@@ -1,40 +1,136 @@
 import pandas as pd
 
 from DataCollection import DB
+import DataCollection.ChangeLog as ChangeLog
+import DataCollection.DBScrapeUtils as dbutil
+
+# ChangeLog consumer whose watermark marks the last coverage refresh
+WATERMARK = "coverage"
+# tables whose coverage of the games table is tracked, as game_coverage columns
+COVERAGE_TABLES = ["box", "raw_pbp", "pbp"]
 
 
 class DataSummarizer(object):
 
     @staticmethod
     def season(dt):
-        return dt.year if dt.month < 6 else dt.year + 1
+        """Season of a date, as season_of computes it in the database"""
+        return dt.year if dt.month <= 6 else dt.year + 1
+
+    @staticmethod
+    def update_coverage(cur, game_ids=None):
+        """
+        INPUT: CURSOR, LIST
+        OUTPUT: None
+
+        Recheck which tables hold rows for game_ids (every game if None) with
+        indexed EXISTS probes, then recount the season_coverage totals of the
+        seasons those games are in
+        """
+        pbp = 'pbp_compact' if dbutil.compact_pbp(cur) else 'pbp'
+        fmt = {'games': DB.TABLES.get('games'),
+               'box': DB.TABLES.get('box'),
+               'raw_pbp': DB.TABLES.get('raw_pbp'),
+               'pbp': DB.TABLES.get(pbp),
+               'g_filter': 'g.game_id IS NOT NULL',
+               'c_filter': 'TRUE'}
+        params = {'ids': game_ids}
+        if game_ids is not None:
+            fmt['g_filter'] = 'g.game_id = ANY(%(ids)s)'
+            fmt['c_filter'] = 'c.game_id = ANY(%(ids)s)'
+
+        # games that moved season or left the games table change their old season too
+        cur.execute("SELECT DISTINCT season FROM game_coverage c WHERE {c_filter}"
+                    .format(**fmt), params)
+        seasons = set(row[0] for row in cur.fetchall())
+        cur.execute(""" DELETE FROM game_coverage c
+                        WHERE {c_filter}
+                        AND NOT EXISTS (SELECT 1 FROM {games} g WHERE g.game_id = c.game_id)
+                    """.format(**fmt), params)
+        cur.execute(""" INSERT INTO game_coverage (game_id, season, box, raw_pbp, pbp)
+                        SELECT g.game_id, g.season,
+                               EXISTS (SELECT 1 FROM {box} t WHERE t.game_id = g.game_id),
+                               EXISTS (SELECT 1 FROM {raw_pbp} t WHERE t.game_id = g.game_id),
+                               EXISTS (SELECT 1 FROM {pbp} t WHERE t.game_id = g.game_id)
+                        FROM {games} g
+                        WHERE {g_filter}
+                        ON CONFLICT (game_id) DO UPDATE
+                        SET season=EXCLUDED.season, box=EXCLUDED.box,
+                            raw_pbp=EXCLUDED.raw_pbp, pbp=EXCLUDED.pbp
+                        RETURNING season
+                    """.format(**fmt), params)
+        seasons.update(row[0] for row in cur.fetchall())
+
+        params['seasons'] = sorted(seasons)
+        cur.execute(""" DELETE FROM season_coverage s
+                        WHERE season = ANY(%(seasons)s)
+                        AND NOT EXISTS (SELECT 1 FROM game_coverage c WHERE c.season = s.season)
+                    """, params)
+        cur.execute(""" INSERT INTO season_coverage (season, games, box, raw_pbp, pbp)
+                        SELECT season, count(*),
+                               count(*) FILTER (WHERE box),
+                               count(*) FILTER (WHERE raw_pbp),
+                               count(*) FILTER (WHERE pbp)
+                        FROM game_coverage
+                        WHERE season = ANY(%(seasons)s)
+                        GROUP BY season
+                        ON CONFLICT (season) DO UPDATE
+                        SET games=EXCLUDED.games, box=EXCLUDED.box, raw_pbp=EXCLUDED.raw_pbp,
+                            pbp=EXCLUDED.pbp, updated_at=now()
+                    """, params)
 
-    def __init__(self):
-        self.conn = DB.conn
-        self.cur = self.conn.cursor()
+    @staticmethod
+    def refresh_coverage():
+        """
+        INPUT: None
+        OUTPUT: None
+
+        Bring the coverage tables up to date with the games written since the
+        last refresh, as recorded in the ChangeLog. The first refresh checks
+        every game.
+        """
+        full = not ChangeLog.has_watermark(WATERMARK)
+        with ChangeLog.consume(WATERMARK, ChangeLog.LOGGED_TABLES) as changes:
+            game_ids = sorted(set(game_id for ids in changes.values() for game_id in ids))
+            if full or len(game_ids) > 0:
+                with DB.connection() as conn:
+                    DataSummarizer.update_coverage(conn.cursor(), None if full else game_ids)
+
+    @staticmethod
+    def coverage():
+        """
+        INPUT: None
+        OUTPUT: DATAFRAME
+
+        Games per season and how many of them each table holds, with the
+        share of the season's games, from season_coverage
+        """
+        q = """SELECT season, games, box, raw_pbp, pbp FROM season_coverage ORDER BY season"""
+        with DB.connection() as conn:
+            df = pd.read_sql(q, conn, index_col='season')
+        for table in COVERAGE_TABLES:
+            df['%s_pct' % table] = df[table] / df.games.astype(float)
+        return df
 
     def games_in_db(self, total_games_gb, table_name):
         """
-        INPUT: DataSummarizer, GROUPBY, STRING
+        INPUT: DataSummarizer, DATAFRAME, STRING
         OUTPUT: DATAFRAME, Int, Int, Float
 
-        Summarize proportion of games in the table `table_name`
+        Summarize proportion of games in the table `table_name` for the
+        seasons of total_games_gb (games per season in its first column),
+        from season_coverage
         """
-        q = """
-            SELECT b.dt
-            FROM (SELECT DISTINCT(game_id) AS gid FROM {table_name}) a
-            JOIN games_ncaa b
-            ON a.gid=b.game_id
-            """.format(table_name=table_name)
-        df = pd.read_sql(q, self.conn)
-        df['season'] = df.dt.map(DataSummarizer.season)
-        gb_pbp = df.groupby('season').count()
-        merged = pd.merge(total_games_gb, gb_pbp, left_index=True, right_index=True)
-        merged['pct'] = merged['dt_y'] / merged['dt_x'].astype(float)
-        merged.columns = ['total', 'in_db', 'pct']
+        names = dict((DB.TABLES.get(table), table) for table in COVERAGE_TABLES)
+        table = names.get(table_name, table_name)
+        in_db = self.coverage()[table]
+        merged = pd.merge(total_games_gb.iloc[:, :1], in_db.to_frame(),
+                          left_index=True, right_index=True)
+        merged.columns = ['total', 'in_db']
+        merged['pct'] = merged.in_db / merged.total.astype(float)
         games_in_db = merged.in_db.sum()
         total_games = merged.total.sum()
-        pct_total = float(games_in_db) / total_games
+        pct_total = float(games_in_db) / total_games if total_games > 0 else 0.
         return merged, games_in_db, total_games, pct_total
 
     def print_game_summary(self, table_name, merged, cnt, total, pct):
@@ -45,23 +141,17 @@ class DataSummarizer(object):
         print "-"*20
 
     def game_summary(self):
-        q = """SELECT dt FROM games_ncaa"""
-        df = pd.read_sql(q, self.conn)
-        df['season'] = df.dt.map(DataSummarizer.season)
-        gb = df.groupby('season').count()
-        print "Table: games_ncaa"
+        self.refresh_coverage()
+        df = self.coverage()
+        print "Table: %s" % DB.TABLES.get('games')
         print "-"*20
-        print gb
+        print df.games
         print "-"*20
 
-        merged, games_in_db, total_games, pct_total = self.games_in_db(gb, 'pbp')
-        print self.print_game_summary('pbp', merged, games_in_db, total_games, pct_total)
-
-        merged, games_in_db, total_games, pct_total = self.games_in_db(gb, 'raw_pbp')
-        print self.print_game_summary('raw_pbp', merged, games_in_db, total_games, pct_total)
-
-        merged, games_in_db, total_games, pct_total = self.games_in_db(gb, 'ncaa_box')
-        print self.print_game_summary('ncaa_box', merged, games_in_db, total_games, pct_total)
+        for table in COVERAGE_TABLES:
+            merged, games_in_db, total_games, pct_total = self.games_in_db(df[['games']], table)
+            self.print_game_summary(DB.TABLES.get(table), merged, games_in_db, total_games,
+                                    pct_total)
 
 if __name__ == "__main__":
     summarizer = DataSummarizer()
@@ -1,25 +1,123 @@
 import pandas as pd
 import numpy as np
-import DB
+
+import DataCollection.ChangeLog as ChangeLog
+import DataCollection.DB as DB
+import DataCollection.Snapshot as Snapshot
+
+# ChangeLog consumer whose watermark marks the last team_games refresh
+WATERMARK = "team_games"
+TEAM_GAME_COLUMNS = ['game_id', 'dt', 'season', 'team', 'opp', 'score', 'opp_score', 'margin',
+                     'location', 'outcome']
+
 
 def unstack_games(games):
-    cols_to_check = ['hteam_id', 'ateam_id', 'home_score', 'away_score']
+    """
+    INPUT: DATAFRAME
+    OUTPUT: DATAFRAME
+
+    One row per team per played game, from both teams' side: team, opp,
+    score, opp_score, margin, location ('H', 'A' or 'N' for neutral),
+    season and outcome (True for a win). Built with whole-column operations.
+    """
+    cols_to_check = ['game_id', 'dt', 'hteam_id', 'ateam_id', 'home_score', 'away_score']
     for col in cols_to_check:
         assert col in games.columns
-    games1 = games.rename(columns={'hteam_id': 'ateam_id', 'ateam_id': 'hteam_id'})
-    df = pd.concat([games, games1], axis=0)
-    df.rename(columns={'hteam_id': 'team', 'ateam_id': 'opp', 'home_score': 'score',
-                       'away_score': 'opp_score'}, inplace=True)
-    df['outcome'] = df.apply(lambda row: row.score > row.opp_score, axis=1)
-    df.drop('home_outcome', axis=1, inplace=True)
+    games = games[games[cols_to_check[2:]].notnull().all(axis=1)]
+    n = games.shape[0]
+    dt = pd.to_datetime(games.dt)
+    if 'season' in games.columns:
+        season = games.season.values
+    else:
+        season = np.where(dt.dt.month <= 6, dt.dt.year, dt.dt.year + 1)
+    neutral = games.neutral.fillna(False).values.astype(bool) if 'neutral' in games.columns \
+        else np.zeros(n, dtype=bool)
+
+    home, away = games.hteam_id.values.astype(int), games.ateam_id.values.astype(int)
+    home_score, away_score = games.home_score.values.astype(int), games.away_score.values.astype(int)
+    score = np.concatenate([home_score, away_score])
+    opp_score = np.concatenate([away_score, home_score])
+    df = pd.DataFrame({'game_id': np.tile(games.game_id.values, 2),
+                       'dt': np.tile(dt.values, 2),
+                       'season': np.tile(np.asarray(season, dtype=int), 2),
+                       'team': np.concatenate([home, away]),
+                       'opp': np.concatenate([away, home]),
+                       'score': score,
+                       'opp_score': opp_score,
+                       'margin': score - opp_score,
+                       'location': pd.Categorical(
+                           np.where(np.tile(neutral, 2), 'N',
+                                    np.repeat(np.array(['H', 'A']), n)),
+                           categories=['H', 'A', 'N']),
+                       'outcome': score > opp_score},
+                      columns=TEAM_GAME_COLUMNS)
     return df
 
-if __name__ == "__main__":
-    games = pd.read_sql("SELECT * from games_test", DB.conn)
-    def season(dt):
-        return dt.year if dt.month < 6 else dt.year + 1
-    games['season'] = games.dt.map(season)
-    games = games[games.season == 2013]
-    df = unstack_games(games)
 
+def update_team_games(cur, game_ids=None):
+    """
+    INPUT: CURSOR, LIST
+    OUTPUT: None
+
+    Rewrite the team_games rows of game_ids (every game if None) from the
+    games table, two rows per played game
+    """
+    fmt = {'games': DB.TABLES.get('games'),
+           'g_filter': 'g.game_id IS NOT NULL',
+           't_filter': 'TRUE'}
+    if game_ids is not None:
+        fmt['g_filter'] = 'g.game_id = ANY(%(ids)s)'
+        fmt['t_filter'] = 'game_id = ANY(%(ids)s)'
+    params = {'ids': game_ids}
+    cur.execute("DELETE FROM team_games WHERE {t_filter}".format(**fmt), params)
+    cur.execute(""" INSERT INTO team_games
+                    (game_id, dt, season, team, opp, score, opp_score, margin, location, outcome)
+                    SELECT g.game_id, g.dt, g.season, s.team, s.opp, s.score, s.opp_score,
+                           s.score - s.opp_score, s.location, s.score > s.opp_score
+                    FROM {games} g
+                    CROSS JOIN LATERAL (VALUES
+                        (g.hteam_id, g.ateam_id, g.home_score, g.away_score,
+                         CASE WHEN g.neutral THEN 'N' ELSE 'H' END),
+                        (g.ateam_id, g.hteam_id, g.away_score, g.home_score,
+                         CASE WHEN g.neutral THEN 'N' ELSE 'A' END)
+                    ) AS s (team, opp, score, opp_score, location)
+                    WHERE {g_filter}
+                    AND g.hteam_id IS NOT NULL AND g.ateam_id IS NOT NULL
+                    AND g.home_score IS NOT NULL AND g.away_score IS NOT NULL
+                """.format(**fmt), params)
 
+
+def refresh_team_games():
+    """
+    Bring team_games up to date with the games merged since the last
+    refresh, as recorded in the ChangeLog. The first refresh builds it from
+    every game.
+    """
+    full = not ChangeLog.has_watermark(WATERMARK)
+    with ChangeLog.consume(WATERMARK, ['games']) as changes:
+        if full or len(changes['games']) > 0:
+            with DB.connection() as conn:
+                update_team_games(conn.cursor(), None if full else changes['games'])
+
+
+def read_team_games(seasons=None, team=None):
+    """Read team_games rows, using its season and team indexes to read only what is asked for"""
+    filters, params = [], []
+    if seasons is not None:
+        filters.append("season = ANY(%s)")
+        params.append([int(season) for season in seasons])
+    if team is not None:
+        filters.append("team = %s")
+        params.append(int(team))
+    q = "SELECT {cols} FROM team_games {where} ORDER BY dt, game_id, team".format(
+        cols=", ".join(TEAM_GAME_COLUMNS),
+        where="WHERE " + " AND ".join(filters) if len(filters) > 0 else "")
+    with DB.connection() as conn:
+        return pd.read_sql(q, conn, params=params)
+
+
+if __name__ == "__main__":
+    # refresh the local Parquet snapshot, then read only the season needed
+    Snapshot.sync(['games'])
+    games = Snapshot.load('games', seasons=[2013])
+    df = unstack_games(games)
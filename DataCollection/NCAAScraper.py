@@ -2,31 +2,52 @@ import httplib
 import urllib2
 import cookielib
 import re
+import time
 from collections import defaultdict
+from urlparse import urlparse
 
 from bs4 import BeautifulSoup
 import pandas as pd
 import numpy as np
 
-from DB import DB
+import DB
+from RateControl import RateController
+from CrawlBudget import CrawlBudget
+import BulkLoad
+from BatchWriter import BatchWriter
 
 
 class Page_Opener(object):
 
-    def __init__(self):
+    def __init__(self, rate_controller=None, budget=None):
         self.cookiejar = cookielib.LWPCookieJar()
         self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookiejar))
         self.agent = 'Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.1; SV1; NeosBrowser; .NET CLR 1.1.4322; .NET CLR 2.0.50727)'
         self.headers = {'User-Agent': self.agent}
+        if rate_controller is None:
+            rate_controller = RateController()
+        self.rate_controller = rate_controller
+        if budget is None:
+            budget = CrawlBudget()
+        self.budget = budget
 
     def open_and_soup(self, url, data=None):
         req = urllib2.Request(url, data=None, headers=self.headers)
+        host = urlparse(url).netloc
+        self.rate_controller.wait(host)
+        self.budget.acquire(host)
+        start = time.time()
         try:
             response = self.opener.open(req)
-        except httplib.BadStatusLine as e:
-            print e, e.line
+        except urllib2.HTTPError as e:
+            self.rate_controller.record(host, time.time() - start, e.code)
+            raise
+        except (urllib2.URLError, httplib.BadStatusLine) as e:
+            self.rate_controller.record(host, None, None)
+            print e
+            raise
         else:
-            pass
+            self.rate_controller.record(host, time.time() - start, response.getcode())
 
         the_page = response.read()
         soup = BeautifulSoup(the_page, "lxml")
@@ -61,8 +82,6 @@ class NCAAScraper(object):
         from stats.ncaa.org, process that data, and insert it into a 
         PostgreSQL database.
         """
-        self.conn = DB.conn
-        self.cur = self.conn.cursor()
         self.page_opener = Page_Opener()
 
     def pbp_link(self, game_id):
@@ -320,16 +339,7 @@ class NCAAScraper(object):
 
         Convert floats to ints and nans to None
         """
-        for i in xrange(len(values)):
-            for j in xrange(len(values[0])):
-                if type(values[i][j]) == float:
-                    if values[i][j].is_integer():
-                        values[i][j] = int(values[i][j])
-                    elif np.isnan(values[i][j]):
-                        values[i][j] = None
-                elif values[i][j] == 'nan':
-                    values[i][j] = None
-        return values
+        return BulkLoad.sql_convert(values)
 
     def rename_box_table(self, table):
         """Map all columns to the same name"""
@@ -357,47 +367,48 @@ class NCAAScraper(object):
                 LIMIT {num_games}
             """.format(table=table, year=year, num_games=num_games,
                        check_link=from_table)
-        self.cur.execute(q)
-        results = self.cur.fetchall()
-        return results
+        with DB.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(q)
+            return cur.fetchall()
+
+    def url_error(self, writer, gameid):
+        """Store a page that doesn't load so it isn't tried again"""
+        q = """ INSERT INTO url_errors
+                (game_id)
+                VALUES (%s)
+            """
+        writer.execute(q, (gameid,))
+        print 'URL or HTTP Error'
 
     def scrape_box(self, game_list):
         """
         INPUT: NCAAScraper
         OUTPUT: None
 
-        Scrape, format, and store box data
+        Scrape, format, and store box data. Games are committed in batches,
+        each in its own savepoint, so a game that fails is recorded in
+        scrape_errors without losing the rest of the batch.
         """
         assert len(game_list[0]) == 4, "game list must be a four tuple"
 
         cols = NCAAScraper.box_columns
-        for idx, (gameid, box_link, pbp_link, dt) in enumerate(game_list):
-            try:
-                print idx, box_link
-                htable, table1, table2 = scraper.get_box_stats(box_link)
-                table = pd.concat([table1, table2])
-                table = table[cols]
-                q =  """ INSERT INTO ncaa_box (game_id, team, first_name, last_name,
-                        pos, min, fgm, fga, tpm, tpa, ftm, fta, pts, oreb, dreb, reb,
-                        ast, turnover, stl, blk, pf) VALUES (%s, %s, %s, %s, %s, %s, %s,
-                        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
-                vals = self.sql_convert(table.values)
-                self.cur.executemany(q, vals)
-            except urllib2.URLError, HTTPError:
-                # store the pages that don't load
-                q = """ INSERT INTO url_errors
-                        (game_id)
-                        VALUES (%s)
-                    """ % gameid
-                self.cur.execute(q)
-                print 'URL or HTTP Error'
-                continue
-            except Exception, e:
-                print str(e)
-                self.conn.commit()
-                raise
-
-        self.conn.commit()
+        with BatchWriter() as writer:
+            for idx, (gameid, box_link, pbp_link, dt) in enumerate(game_list):
+                try:
+                    print idx, box_link
+                    htable, table1, table2 = scraper.get_box_stats(box_link)
+                    table = pd.concat([table1, table2])
+                    table = table[cols]
+                except urllib2.URLError, HTTPError:
+                    self.url_error(writer, gameid)
+                    continue
+                except Exception, e:
+                    print str(e)
+                    writer.fail(gameid, 'ncaa_box', e)
+                    continue
+                # spooled if the database is unavailable, see DBScrapeUtils.LEGACY_INSERTS
+                writer.write_game(gameid, 'ncaa_box', table)
 
     def scrape_pbp(self, game_list):
         """
@@ -407,37 +418,24 @@ class NCAAScraper(object):
         Scrape, format, and store pbp data
         """
         assert len(game_list[0]) == 4, "game list must be a four tuple"
-        # some pages won't load so they are stored in 'url_errors' table 
-        # so we don't try them again
-        for idx, (gameid, box_link, pbp_link, dt) in enumerate(game_list):
-            if pbp_link == '':
-                continue
-            try:
-                print idx, pbp_link
-                htable, table = self.get_pbp_stats(pbp_link)
-                table = scraper.format_pbp_stats(table, htable)
-                q =  """ INSERT INTO raw_pbp 
-                            (game_id, time, teamid, team, first_name, 
-                             last_name, play, hscore, ascore) 
-                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                     """
-                vals = self.sql_convert(table.values)
-                self.cur.executemany(q, vals)
-            except urllib2.URLError, HTTPError:
-                # store the pages that don't load
-                # TODO: this needs to be handled more correctly
-                q = """ INSERT INTO url_errors
-                        (game_id)
-                        VALUES (%s)
-                    """ % gameid
-                self.cur.execute(q)
-                print 'URL or HTTP Error'
-                continue
-            except Exception, e:
-                print str(e)
-                self.conn.commit()
-
-        self.conn.commit()
+        with BatchWriter() as writer:
+            # some pages won't load so they are stored in 'url_errors' table 
+            # so we don't try them again
+            for idx, (gameid, box_link, pbp_link, dt) in enumerate(game_list):
+                if pbp_link == '':
+                    continue
+                try:
+                    print idx, pbp_link
+                    htable, table = self.get_pbp_stats(pbp_link)
+                    table = scraper.format_pbp_stats(table, htable)
+                except urllib2.URLError, HTTPError:
+                    self.url_error(writer, gameid)
+                    continue
+                except Exception, e:
+                    print str(e)
+                    writer.fail(gameid, 'ncaa_raw_pbp', e)
+                    continue
+                writer.write_game(gameid, 'ncaa_raw_pbp', table)
 
     def continuous_scrape(self, scrape_function):
         for i in xrange(500):
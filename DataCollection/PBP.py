@@ -1,8 +1,16 @@
+import sys
+
 import pandas as pd
 import numpy as np
 
 from DataCollection import DB
+import DataCollection.ChangeLog as ChangeLog
 import DataCollection.DBScrapeUtils as dbutil
+from DataCollection.Storage import get_storage
+
+# version of the processing logic; bump it whenever a change alters the
+# derived pbp rows, then rebuild the stored pbp with PBPRebuild
+ENGINE_VERSION = 1
 
 
 class PBP(object):
@@ -38,8 +46,6 @@ class PBP(object):
         first loop through to process offensive fouls, and then we loop again
         to process possession.
         """
-        self.conn = DB.conn
-        self.cur = self.conn.cursor()
         self.df = raw_df
         self.gameid = self.df.game_id.iloc[0]
         self.df = self.df[~self.df.play.isin({'ENTERS', 'LEAVES', 'DEADREB'})]
@@ -455,26 +461,25 @@ class PBP(object):
         return self.df
 
 
-if __name__ == '__main__':
-
-    q = """ SELECT *
-            FROM raw_pbp
-            WHERE game_id
-            IN
-                (SELECT DISTINCT(game_id)
-                FROM raw_pbp
-                WHERE game_id NOT IN (SELECT DISTINCT(game_id) FROM pbp)
-                LIMIT 100)
-            ORDER BY id
-        """
-    df = pd.read_sql(q, DB.conn)
-    cur = DB.conn.cursor()
-    for i, game_id in enumerate(df.game_id.unique()):
-        subdf = df[df.game_id == game_id]
-        pbp = PBP(subdf)
+def process_games(games):
+    for i, (game_id, raw_df) in enumerate(games):
+        pbp = PBP(raw_df)
         pbpdf = pbp.process()
         if pbpdf is None:
             continue
         print i, game_id, pbp.poss_time_error()
 
-        insert_data(pbpdf.values, DB.conn, cur)
\ No newline at end of file
+        dbutil.insert_pbp_data(pbpdf.values)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        # reprocess every unprocessed game of a season
+        process_games(dbutil.stream_unprocessed_pbp(int(sys.argv[1])))
+    elif not get_storage().logs_changes:
+        # without a ChangeLog, process every game that has no pbp yet
+        process_games(dbutil.stream_unprocessed_pbp())
+    else:
+        # process the games whose raw pbp was loaded or replaced since the last run
+        with ChangeLog.consume('pbp', ['raw_pbp']) as changes:
+            process_games(dbutil.stream_raw_pbp(changes['raw_pbp']))
@@ -0,0 +1,319 @@
+import sys
+from multiprocessing import Pool
+
+import pandas as pd
+
+import DataCollection.ChangeLog as ChangeLog
+import DataCollection.DB as DB
+import DataCollection.DBCreate as DBCreate
+import DataCollection.DBScrapeUtils as dbutil
+import DataCollection.CompactPBP as CompactPBP
+from DataCollection.BulkLoad import convert_columns, copy_rows
+from DataCollection.PBP import PBP, ENGINE_VERSION
+
+# games processed and written per worker transaction
+BATCH_SIZE = 50
+# largest relative change in a season's row count a rebuild may make
+MAX_ROW_CHANGE = 0.02
+# seconds the median and 90th percentile of |poss_time_error| may worsen by
+ERROR_SLACK = 15
+
+
+def layout(cur):
+    """(physical table pbp rows are stored in, whether it is season partitioned)"""
+    table = 'pbp_compact' if dbutil.compact_pbp(cur) else 'pbp'
+    cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+                (DB.TABLES.get(table),))
+    return table, cur.fetchone() is not None
+
+
+def target_name(table, season, partitioned):
+    """Table holding a season's live rows: its partition, or the whole table"""
+    return DBCreate.partition_name(table, season) if partitioned else DB.TABLES.get(table)
+
+
+def shadow_name(target, version=ENGINE_VERSION):
+    return "%s_v%d" % (target, version)
+
+
+def exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return cur.fetchone()[0]
+
+
+def create_shadow(cur, table, season, partitioned):
+    """
+    INPUT: CURSOR, STRING, INT, BOOL
+    OUTPUT: STRING
+
+    Create the table a season is rebuilt into, shaped like the table it will
+    replace, unless it exists from an interrupted rebuild. Return its name.
+    """
+    target = target_name(table, season, partitioned)
+    shadow = shadow_name(target)
+    if exists(cur, shadow):
+        return shadow
+    source = target if exists(cur, target) else DB.TABLES.get(table)
+    cur.execute("CREATE TABLE {shadow} (LIKE {source} INCLUDING ALL)"
+                .format(shadow=shadow, source=source))
+    if partitioned:
+        # lets ATTACH PARTITION skip scanning the shadow to check its bounds
+        cur.execute("ALTER TABLE {shadow} ADD CONSTRAINT {shadow}_season CHECK (season = {season})"
+                    .format(shadow=shadow, season=int(season)))
+    else:
+        # LIKE does not copy foreign keys; a partition inherits them on attach
+        cur.execute(""" SELECT pg_get_constraintdef(oid)
+                        FROM pg_constraint
+                        WHERE conrelid = to_regclass(%s) AND contype = 'f'
+                    """, (target,))
+        for definition, in cur.fetchall():
+            cur.execute("ALTER TABLE {shadow} ADD {definition}"
+                        .format(shadow=shadow, definition=definition))
+    return shadow
+
+
+def pending_games(cur, season, shadow):
+    """
+    INPUT: CURSOR, INT, STRING
+    OUTPUT: LIST
+
+    Games of a season with raw pbp that have not been built into shadow with
+    the current engine version, or whose raw pbp was replaced since
+    """
+    cur.execute(""" SELECT r.game_id
+                    FROM (SELECT DISTINCT game_id FROM {raw_pbp} WHERE season = %s) r
+                    LEFT JOIN pbp_builds b ON b.tbl = %s AND b.game_id = r.game_id
+                    LEFT JOIN game_hashes h ON h.tbl = 'raw_pbp' AND h.game_id = r.game_id
+                    WHERE b.game_id IS NULL
+                    OR b.engine_version <> %s
+                    OR h.loaded_at > b.built_at
+                    ORDER BY r.game_id
+                """.format(raw_pbp=DB.TABLES.get('raw_pbp')), (season, shadow, ENGINE_VERSION))
+    return [row[0] for row in cur.fetchall()]
+
+
+def build_batch(args):
+    """
+    INPUT: TUPLE
+    OUTPUT: INT
+
+    Worker: process a batch of games with the current engine and write their
+    rows and build records to the shadow table in one transaction, replacing
+    anything an earlier build left for them. Return the number of games.
+    """
+    table, shadow, season, game_ids = args
+    frames, builds = [], []
+    for game_id, raw_df in dbutil.stream_raw_pbp(game_ids):
+        pbp = PBP(raw_df)
+        pbpdf = pbp.process()
+        if pbpdf is None:
+            # games with missing plays are not processed (see PBP.process)
+            builds.append((shadow, game_id, season, ENGINE_VERSION, 0, None))
+            continue
+        frames.append(pbpdf)
+        builds.append((shadow, game_id, season, ENGINE_VERSION, pbpdf.shape[0],
+                       int(pbp.poss_time_error())))
+
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM {shadow} WHERE game_id = ANY(%s)".format(shadow=shadow),
+                    ([int(game_id) for game_id in game_ids],))
+        if len(frames) > 0:
+            rows = convert_columns(pd.concat(frames).values, DB.COLUMNS['pbp'],
+                                   DB.COLUMN_TYPES['pbp'])
+            rows['season'] = season
+            columns = DB.COLUMNS['pbp'] + ['season']
+            if table == 'pbp_compact':
+                rows, columns = CompactPBP.encode(cur, rows), CompactPBP.COLUMNS
+            copy_rows(cur, shadow, columns, rows)
+        cur.executemany(""" INSERT INTO pbp_builds
+                            (tbl, game_id, season, engine_version, n_rows, poss_time_error)
+                            VALUES (%s, %s, %s, %s, %s, %s)
+                            ON CONFLICT (tbl, game_id) DO UPDATE
+                            SET season=EXCLUDED.season, engine_version=EXCLUDED.engine_version,
+                                n_rows=EXCLUDED.n_rows, poss_time_error=EXCLUDED.poss_time_error,
+                                built_at=now()
+                        """, builds)
+    return len(builds)
+
+
+def build_stats(cur, tbl, season):
+    """(rows recorded, median and 90th percentile |poss_time_error|) of a season's builds in tbl"""
+    cur.execute(""" SELECT COALESCE(sum(n_rows), 0),
+                           percentile_cont(0.5) WITHIN GROUP (ORDER BY abs(poss_time_error)),
+                           percentile_cont(0.9) WITHIN GROUP (ORDER BY abs(poss_time_error))
+                    FROM pbp_builds
+                    WHERE tbl = %s AND season = %s
+                """, (tbl, season))
+    n_rows, p50, p90 = cur.fetchone()
+    return int(n_rows), (p50, p90)
+
+
+def count_rows(cur, name, season):
+    cur.execute("SELECT count(*) FROM {name} WHERE season = %s".format(name=name), (season,))
+    return cur.fetchone()[0]
+
+
+def compare_rows(live, rebuilt):
+    """Problem if the rebuilt row count of a season strays too far from the live one"""
+    if live > 0 and abs(rebuilt - live) > MAX_ROW_CHANGE * live:
+        return ["row count changes from %d to %d" % (live, rebuilt)]
+    return []
+
+
+def compare_errors(live, rebuilt):
+    """
+    INPUT: TUPLE, TUPLE
+    OUTPUT: LIST
+
+    Problems if the (median, 90th percentile) |poss_time_error| of the
+    rebuilt games is worse than the live games' by more than ERROR_SLACK.
+    Live games built before versions were recorded have no errors to compare.
+    """
+    problems = []
+    for name, old, new in zip(["median", "90th percentile"], live, rebuilt):
+        if old is not None and new is not None and new > old + ERROR_SLACK:
+            problems.append("%s |poss_time_error| rises from %.0f to %.0f seconds"
+                            % (name, old, new))
+    return problems
+
+
+def validate(cur, table, season, partitioned):
+    """
+    INPUT: CURSOR, STRING, INT, BOOL
+    OUTPUT: LIST
+
+    Check a season's shadow before it is swapped in: every game is built
+    with the current engine from its current raw pbp, the shadow holds the
+    rows the builds recorded, and the row count and poss_time_error
+    distribution are close to the live season's. Return the problems found.
+    """
+    target = target_name(table, season, partitioned)
+    shadow = shadow_name(target)
+    problems = []
+    # also catches games whose raw pbp was replaced while the season was rebuilding
+    missing = pending_games(cur, season, shadow)
+    if len(missing) > 0:
+        problems.append("%d games not built with engine version %d"
+                        % (len(missing), ENGINE_VERSION))
+    recorded, errors = build_stats(cur, shadow, season)
+    rebuilt = count_rows(cur, shadow, season)
+    if rebuilt != recorded:
+        problems.append("shadow holds %d rows, builds recorded %d" % (rebuilt, recorded))
+    problems += compare_rows(count_rows(cur, DB.TABLES.get(table), season), rebuilt)
+    problems += compare_errors(build_stats(cur, target, season)[1], errors)
+    return problems
+
+
+def take_over(cur, shadow, target, seasons):
+    """Give the swapped in shadow's indexes and build records the names of the table it replaced"""
+    cur.execute(""" SELECT c.relname
+                    FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE i.indrelid = to_regclass(%s)
+                """, (target,))
+    for index, in cur.fetchall():
+        if index.startswith(shadow):
+            cur.execute("ALTER INDEX {index} RENAME TO {name}"
+                        .format(index=index, name=target + index[len(shadow):]))
+    cur.execute("DELETE FROM pbp_builds WHERE tbl = %s AND season = ANY(%s)", (target, seasons))
+    cur.execute("UPDATE pbp_builds SET tbl = %s WHERE tbl = %s", (target, shadow))
+
+
+def log_rebuilt(cur, live, shadow, seasons):
+    """
+    Log every game whose pbp rows a swap replaces, from the live rows and
+    the shadow's, so the ChangeLog consumers see the rebuilt seasons
+    """
+    names = [name for name in [live, shadow] if exists(cur, name)]
+    cur.execute(" UNION ".join(["SELECT game_id FROM {name} WHERE season = ANY(%s)"
+                                .format(name=name) for name in names]), [seasons] * len(names))
+    ChangeLog.log_changes(cur, 'pbp', [row[0] for row in cur.fetchall()], 'rebuild')
+
+
+def swap_partition(cur, table, season):
+    """Replace a season's partition with its validated shadow in the caller's transaction"""
+    target = DBCreate.partition_name(table, season)
+    shadow = shadow_name(target)
+    cur.execute("LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE".format(table=DB.TABLES.get(table)))
+    log_rebuilt(cur, target, shadow, [season])
+    if exists(cur, target):
+        for q in DBCreate.detach_season_partition(table, season):
+            cur.execute(q)
+        cur.execute("DROP TABLE {target}".format(target=target))
+    cur.execute("ALTER TABLE {shadow} RENAME TO {target}".format(shadow=shadow, target=target))
+    cur.execute(DBCreate.attach_season_partition(table, season))
+    take_over(cur, shadow, target, [season])
+
+
+def swap_table(cur, table, seasons):
+    """
+    Replace an unpartitioned table with its validated shadow in the caller's
+    transaction, carrying over the rows of the seasons that were not rebuilt
+    """
+    live = DB.TABLES.get(table)
+    shadow = shadow_name(live)
+    cur.execute("LOCK TABLE {live} IN ACCESS EXCLUSIVE MODE".format(live=live))
+    log_rebuilt(cur, live, shadow, seasons)
+    cur.execute("INSERT INTO {shadow} SELECT * FROM {live} WHERE season <> ALL(%s)"
+                .format(shadow=shadow, live=live), (seasons,))
+    if table == 'pbp_compact':
+        cur.execute("DROP VIEW {pbp}".format(pbp=DB.TABLES.get('pbp')))
+    cur.execute("DROP TABLE {live}".format(live=live))
+    cur.execute("ALTER TABLE {shadow} RENAME TO {live}".format(shadow=shadow, live=live))
+    if table == 'pbp_compact':
+        cur.execute(DBCreate.create_pbp_view())
+    take_over(cur, shadow, live, seasons)
+
+
+def rebuild(seasons, workers=None, batch_size=BATCH_SIZE):
+    """
+    INPUT: LIST, INT, INT
+    OUTPUT: DICT
+
+    Rebuild the derived pbp rows of seasons with the current ENGINE_VERSION
+    into shadow tables using a pool of worker processes, while the live
+    table stays readable. Games already built at this version are skipped,
+    so an interrupted rebuild resumes where it stopped. Validated seasons
+    are swapped in atomically: a partition at a time if pbp is season
+    partitioned, otherwise the whole table once every season passes.
+
+    Return the validation problems of each season; a season with problems
+    is left in its shadow table and the live rows are untouched.
+    """
+    seasons = sorted(int(season) for season in seasons)
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        table, partitioned = layout(cur)
+        shadows = dict((season, create_shadow(cur, table, season, partitioned))
+                       for season in seasons)
+
+    problems = {}
+    pool = Pool(workers)
+    try:
+        for season in seasons:
+            with DB.connection() as conn:
+                game_ids = pending_games(conn.cursor(), season, shadows[season])
+            batches = [(table, shadows[season], season, game_ids[i:i + batch_size])
+                       for i in range(0, len(game_ids), batch_size)]
+            built = sum(pool.imap_unordered(build_batch, batches))
+            print("season %s: built %s games into %s" % (season, built, shadows[season]))
+            with DB.connection() as conn:
+                cur = conn.cursor()
+                problems[season] = validate(cur, table, season, partitioned)
+                if partitioned and len(problems[season]) == 0:
+                    swap_partition(cur, table, season)
+    finally:
+        pool.close()
+        pool.join()
+
+    if not partitioned and not any(problems.values()):
+        with DB.connection() as conn:
+            swap_table(conn.cursor(), table, seasons)
+    return problems
+
+
+if __name__ == "__main__":
+    # python PBPRebuild.py 2014 2015
+    for season, season_problems in sorted(rebuild([int(arg) for arg in sys.argv[1:]]).items()):
+        print("%s: %s" % (season, "; ".join(season_problems) or "ok"))
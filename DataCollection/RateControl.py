@@ -0,0 +1,127 @@
+import time
+from collections import deque
+
+
+class RateController(object):
+    """
+    Adaptive per-host request rate control.
+
+    Delay and concurrency for each host are adjusted from a moving window of
+    response latencies and errors: errors (429/5xx or failed connections)
+    halve the rate, a healthy window slowly raises it back up to the ceilings.
+    The same controller is used by the scrapy downloader middleware and by
+    the blocking `Page_Opener`.
+    """
+
+    error_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, window=50, start_delay=0.5, min_delay=0.05, max_delay=30.,
+                 min_concurrency=1, max_concurrency=8, target_latency=1.,
+                 max_error_rate=0.05):
+        """
+        INPUT: RateController, INT, FLOAT, FLOAT, FLOAT, INT, INT, FLOAT, FLOAT
+        OUTPUT: None
+
+        window is the number of most recent responses used to judge host health
+        target_latency is the mean latency (seconds) above which we back off
+        max_error_rate is the error rate in the window above which we back off
+        """
+        self.window = window
+        self.start_delay = start_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.hosts = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Build a controller from scrapy settings (RATE_CONTROL_*)"""
+        return cls(window=settings.getint('RATE_CONTROL_WINDOW', 50),
+                   start_delay=settings.getfloat('RATE_CONTROL_START_DELAY', 0.5),
+                   min_delay=settings.getfloat('RATE_CONTROL_MIN_DELAY', 0.05),
+                   max_delay=settings.getfloat('RATE_CONTROL_MAX_DELAY', 30.),
+                   min_concurrency=settings.getint('RATE_CONTROL_MIN_CONCURRENCY', 1),
+                   max_concurrency=settings.getint('RATE_CONTROL_MAX_CONCURRENCY', 8),
+                   target_latency=settings.getfloat('RATE_CONTROL_TARGET_LATENCY', 1.),
+                   max_error_rate=settings.getfloat('RATE_CONTROL_MAX_ERROR_RATE', 0.05))
+
+    def _host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {'delay': self.start_delay,
+                                'concurrency': self.min_concurrency,
+                                'latencies': deque(maxlen=self.window),
+                                'errors': deque(maxlen=self.window),
+                                'last_request': 0.}
+        return self.hosts[host]
+
+    def is_error(self, status):
+        return status is None or status in RateController.error_statuses
+
+    def record(self, host, latency, status=200):
+        """
+        INPUT: RateController, STRING, FLOAT, INT
+        OUTPUT: None
+
+        Record a response (status None for a failed connection) and adjust
+        the host's delay and concurrency.
+        """
+        state = self._host(host)
+        error = self.is_error(status)
+        if latency is not None:
+            state['latencies'].append(latency)
+        state['errors'].append(error)
+
+        if error:
+            # multiplicative decrease on any error
+            state['delay'] = min(self.max_delay, max(state['delay'] * 2, self.min_delay))
+            state['concurrency'] = max(self.min_concurrency, state['concurrency'] // 2)
+        elif self.error_rate(host) > self.max_error_rate or self.latency(host) > self.target_latency:
+            state['delay'] = min(self.max_delay, state['delay'] * 1.1)
+            state['concurrency'] = max(self.min_concurrency, state['concurrency'] - 1)
+        elif len(state['errors']) >= min(self.window, 10):
+            # healthy window: shorten the delay first, then open up concurrency
+            if state['delay'] > self.min_delay:
+                state['delay'] = max(self.min_delay, state['delay'] * 0.9)
+            else:
+                state['concurrency'] = min(self.max_concurrency, state['concurrency'] + 1)
+
+    def error_rate(self, host):
+        errors = self._host(host)['errors']
+        if len(errors) == 0:
+            return 0.
+        return sum(errors) / float(len(errors))
+
+    def latency(self, host):
+        latencies = self._host(host)['latencies']
+        if len(latencies) == 0:
+            return 0.
+        return sum(latencies) / float(len(latencies))
+
+    def delay(self, host):
+        return self._host(host)['delay']
+
+    def concurrency(self, host):
+        return self._host(host)['concurrency']
+
+    def rate(self, host):
+        """Current target request rate for a host in requests per second"""
+        state = self._host(host)
+        per_request = max(state['delay'], self.latency(host), 1e-6)
+        return state['concurrency'] / per_request
+
+    def wait(self, host):
+        """
+        INPUT: RateController, STRING
+        OUTPUT: None
+
+        Block until the host's delay since the last request has passed. Used
+        by blocking fetchers, which only ever have one request in flight.
+        """
+        state = self._host(host)
+        remaining = state['last_request'] + state['delay'] - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        state['last_request'] = time.time()
@@ -0,0 +1,248 @@
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+import DataCollection.ChangeLog as ChangeLog
+import DataCollection.DB as DB
+import DataCollection.DBScrapeUtils as dbutil
+from DataCollection.BulkLoad import copy_rows
+from DataCollection.DataWrangling import refresh_team_games
+
+try:
+    import scipy.sparse as sparse
+    from scipy.sparse.linalg import lsqr
+except ImportError:
+    sparse = None
+    lsqr = None
+
+# ChangeLog consumer whose watermark marks the last ratings refresh
+WATERMARK = "ratings"
+# logged tables the ratings are computed from
+SOURCE_TABLES = ["games", "box", "pbp"]
+RATING_COLUMNS = ['season', 'as_of', 'team', 'games', 'adj_o', 'adj_d', 'adj_t', 'home_adv']
+LOCATION = {'H': 1., 'A': -1., 'N': 0.}
+# lsqr stopping tolerances and iteration cap for each date's solve
+TOL = 1e-8
+ITER_LIM = 1000
+
+
+def _require_scipy():
+    if lsqr is None:
+        raise ImportError("the ratings engine needs scipy (pip install scipy)")
+
+
+def read_season(cur, season):
+    """
+    INPUT: CURSOR, INT
+    OUTPUT: DATAFRAME
+
+    Team-game rows of a season's played games with the game's possessions,
+    in date order. Possessions are estimated from the two teams' box score
+    totals (fga - oreb + turnover + 0.475 fta, averaged over both teams), or
+    counted from pbp possession changes for games without a box score.
+    Games with neither are left out.
+    """
+    pbp = 'pbp_compact' if dbutil.compact_pbp(cur) else 'pbp'
+    cur.execute(""" SELECT tg.game_id, tg.dt, tg.team, tg.opp, tg.location, tg.score,
+                           COALESCE(b.poss, p.poss) AS poss
+                    FROM team_games tg
+                    LEFT JOIN (
+                        SELECT game_id, avg(fga - oreb + turnover + 0.475 * fta) AS poss
+                        FROM {box}
+                        WHERE season = %(season)s AND first_name = 'Totals'
+                        GROUP BY game_id
+                        HAVING count(*) = 2
+                    ) b USING (game_id)
+                    LEFT JOIN (
+                        SELECT game_id, count(*) FILTER (WHERE possession IS DISTINCT FROM prev)
+                                        / 2.0 AS poss
+                        FROM (SELECT game_id, possession,
+                                     lag(possession) OVER (PARTITION BY game_id
+                                                           ORDER BY pbp_id) AS prev
+                              FROM {pbp}
+                              WHERE season = %(season)s AND possession IS NOT NULL) t
+                        GROUP BY game_id
+                    ) p USING (game_id)
+                    WHERE tg.season = %(season)s
+                    AND COALESCE(b.poss, p.poss) > 0
+                    ORDER BY tg.dt, tg.game_id, tg.team
+                """.format(box=DB.TABLES.get('box'), pbp=DB.TABLES.get(pbp)),
+                {'season': int(season)})
+    return pd.DataFrame(cur.fetchall(), columns=['game_id', 'dt', 'team', 'opp', 'location',
+                                                 'score', 'poss'])
+
+
+def design(games, teams):
+    """
+    INPUT: DATAFRAME, ARRAY
+    OUTPUT: SPARSE MATRIX, SPARSE MATRIX
+
+    Sparse design matrices over the team-game rows of games for the sorted
+    team ids in teams.
+
+    Efficiency: columns [offense of each team, defense of each team, home],
+    so a row reads team's offense + opponent's defense + home court.
+    Tempo: columns [tempo of each team], so a row reads team + opponent.
+    """
+    _require_scipy()
+    n_rows, n_teams = games.shape[0], len(teams)
+    rows = np.arange(n_rows)
+    team = np.searchsorted(teams, games.team.values)
+    opp = np.searchsorted(teams, games.opp.values)
+    home = games.location.map(LOCATION).values.astype(float)
+    played = home != 0
+    eff = sparse.coo_matrix((np.concatenate([np.ones(2 * n_rows), home[played]]),
+                             (np.concatenate([rows, rows, rows[played]]),
+                              np.concatenate([team, n_teams + opp,
+                                              np.repeat(2 * n_teams, played.sum())]))),
+                            shape=(n_rows, 2 * n_teams + 1)).tocsr()
+    tempo = sparse.coo_matrix((np.ones(2 * n_rows),
+                               (np.concatenate([rows, rows]), np.concatenate([team, opp]))),
+                              shape=(n_rows, n_teams)).tocsr()
+    return eff, tempo
+
+
+def solve(A, b, x0=None):
+    """Least-squares solution of A x = b by lsqr, starting from x0"""
+    return lsqr(A, b, atol=TOL, btol=TOL, iter_lim=ITER_LIM, x0=x0)[0]
+
+
+def rate_season(games, season=None):
+    """
+    INPUT: DATAFRAME, INT
+    OUTPUT: DATAFRAME
+
+    Adjusted offense, defense (points scored and allowed per 100
+    possessions against an average opponent on a neutral court), tempo
+    (possessions per game against an average opponent) and the home court
+    edge of every team that has played, as of every date in games, counting
+    the games played on that date.
+
+    The season's design matrices are built once with rows in date order, so
+    each date solves on a prefix of their rows, warm-started from the
+    previous date's solution.
+    """
+    _require_scipy()
+    games = games.sort_values(['dt', 'game_id', 'team']).reset_index(drop=True)
+    teams = np.unique(np.concatenate([games.team.values, games.opp.values]))
+    n_teams = len(teams)
+    eff, tempo = design(games, teams)
+    ppp = 100. * games.score.values.astype(float) / games.poss.values.astype(float)
+    poss = games.poss.values.astype(float)
+    dts = pd.to_datetime(games.dt).values
+    dates = np.unique(dts)
+    team_idx = np.searchsorted(teams, games.team.values)
+
+    x_eff, x_tempo = np.zeros(2 * n_teams + 1), np.zeros(n_teams)
+    frames = []
+    for as_of in dates:
+        k = np.searchsorted(dts, as_of, side='right')
+        mu_eff = 100. * games.score.values[:k].sum() / poss[:k].sum()
+        mu_tempo = poss[:k].mean()
+        x_eff = solve(eff[:k], ppp[:k] - mu_eff, x_eff)
+        x_tempo = solve(tempo[:k], poss[:k] - mu_tempo, x_tempo)
+
+        n_games = np.bincount(team_idx[:k], minlength=n_teams)
+        rated = n_games > 0
+        off, dfn = x_eff[:n_teams], x_eff[n_teams:2 * n_teams]
+        # offense and defense are only fixed up to a constant moved from one
+        # to the other; centre both on the rated teams
+        shift = (off[rated].mean() - dfn[rated].mean()) / 2.
+        x_eff[:n_teams] -= shift
+        x_eff[n_teams:2 * n_teams] += shift
+        frames.append(pd.DataFrame({'season': season,
+                                    'as_of': pd.Timestamp(as_of).strftime('%Y-%m-%d'),
+                                    'team': teams[rated],
+                                    'games': n_games[rated],
+                                    'adj_o': mu_eff + off[rated],
+                                    'adj_d': mu_eff + dfn[rated],
+                                    'adj_t': mu_tempo + x_tempo[rated],
+                                    'home_adv': x_eff[-1]},
+                                   columns=RATING_COLUMNS))
+    if len(frames) == 0:
+        return pd.DataFrame(columns=RATING_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def update_season(season):
+    """Recompute and rewrite a season's team_ratings; run in a worker process"""
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        ratings = rate_season(read_season(cur, season), season)
+        cur.execute("DELETE FROM team_ratings WHERE season = %s", (int(season),))
+        copy_rows(cur, 'team_ratings', RATING_COLUMNS, ratings)
+    return season, ratings.shape[0]
+
+
+def update_ratings(seasons, workers=None):
+    """
+    INPUT: LIST, INT
+    OUTPUT: DICT
+
+    Rewrite the team_ratings history of seasons, a season per worker
+    process. Return the number of rows written for each season.
+    """
+    _require_scipy()
+    seasons = sorted(set(int(season) for season in seasons))
+    if len(seasons) == 0:
+        return {}
+    pool = Pool(workers)
+    try:
+        return dict(pool.map(update_season, seasons))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def changed_seasons(game_ids):
+    """Seasons of game_ids, as their games rows give them"""
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT season FROM {games} WHERE game_id = ANY(%s)"
+                    .format(games=DB.TABLES.get('games')), (list(game_ids),))
+        return [row[0] for row in cur.fetchall()]
+
+
+def refresh_ratings(workers=None):
+    """
+    Recompute the ratings of the seasons whose games, box scores or pbp
+    changed since the last refresh, as recorded in the ChangeLog. The first
+    refresh rates every season in team_games.
+    """
+    refresh_team_games()
+    full = not ChangeLog.has_watermark(WATERMARK)
+    with ChangeLog.consume(WATERMARK, SOURCE_TABLES) as changes:
+        if full:
+            with DB.connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT DISTINCT season FROM team_games")
+                seasons = [row[0] for row in cur.fetchall()]
+        else:
+            game_ids = sorted(set(game_id for ids in changes.values() for game_id in ids))
+            seasons = changed_seasons(game_ids) if len(game_ids) > 0 else []
+        update_ratings(seasons, workers)
+
+
+def read_ratings(season, as_of=None):
+    """Ratings of every team in season as of a date (the latest date rated if None)"""
+    q = """ SELECT {cols} FROM team_ratings
+            WHERE season = %(season)s
+            AND as_of = (SELECT max(as_of) FROM team_ratings
+                         WHERE season = %(season)s {date_filter})
+            ORDER BY adj_o - adj_d DESC
+        """.format(cols=", ".join(RATING_COLUMNS),
+                   date_filter="AND as_of <= %(as_of)s" if as_of is not None else "")
+    with DB.connection() as conn:
+        return pd.read_sql(q, conn, params={'season': int(season), 'as_of': as_of})
+
+
+if __name__ == "__main__":
+    # python Ratings.py            ratings of seasons changed since the last refresh
+    # python Ratings.py 2014 2015  rebuild the history of the given seasons
+    if len(sys.argv) > 1:
+        for season, n_rows in sorted(update_ratings([int(arg) for arg in sys.argv[1:]]).items()):
+            print("%s: %s ratings" % (season, n_rows))
+    else:
+        refresh_ratings()
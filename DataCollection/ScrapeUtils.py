@@ -1,17 +1,23 @@
-from datetime import datetime
+from datetime import datetime, date
+import hashlib
 import pandas as pd
 import numpy as np
 import re
 from collections import defaultdict
 
 import DataCollection.DB as DB
+import DataCollection.DBScrapeUtils as dbutil
 
 import org_ncaa
 import org_ncaa.scrape as nscr
-from DataCollection.DBScrapeUtils import sql_convert
+from DataCollection.BulkLoad import sql_convert
 
 class ScheduleScraper(object):
 
+    # layout of the rows returned by get_team_schedule
+    columns = ['game_id', 'dt', 'hteam_id', 'ateam_id', 'opp_string', 'neutral',
+               'neutral_site', 'home_outcome', 'numot', 'home_score', 'away_score']
+
     @staticmethod
     def get_urls(years=None):
         base_url = 'http://stats.ncaa.org/team/'
@@ -20,11 +26,68 @@ class ScheduleScraper(object):
             years = org_ncaa.all_years()
         for year in years:
             # get division one teams for the year
-            d1 = pd.read_sql("SELECT ncaaid FROM division_one WHERE year=%s" % year, DB.conn)
+            with DB.connection() as conn:
+                d1 = pd.read_sql("SELECT ncaaid FROM division_one WHERE year=%s" % year, conn)
             year_code = org_ncaa.convert_ncaa_year_code(year)
             urls += [base_url + '%s/%s' % (team, year_code) for team in d1.ncaaid.values]
         return urls
 
+    @staticmethod
+    def plan_refresh(games, today=None, include_future=False):
+        """
+        INPUT: DATAFRAME, DATE, BOOLEAN
+        OUTPUT: LIST
+
+        Choose a small set of (team_id, season) schedule pages that covers
+        every unresolved game.
+
+        games is a dataframe with dt, hteam_id and ateam_id columns
+        today is the date after which games cannot have results yet
+
+        Each game is on both teams' schedule pages, so this is a set cover
+        problem: greedily take the team page covering the most uncovered
+        games. Games whose dates have passed are covered first; games still
+        to be played are only covered if include_future is set.
+        """
+        if today is None:
+            today = date.today()
+        coverage = defaultdict(set)
+        past, future = set(), set()
+        for idx, row in enumerate(games[['dt', 'hteam_id', 'ateam_id']].values):
+            dt = pd.Timestamp(row[0]).date()
+            season = dt.year if dt.month <= 6 else dt.year + 1
+            teams = [team for team in row[1:] if not pd.isnull(team)]
+            if len(teams) == 0:
+                continue
+            for team in teams:
+                coverage[(int(team), season)].add(idx)
+            if dt <= today:
+                past.add(idx)
+            else:
+                future.add(idx)
+
+        pages = []
+        groups = [past, future] if include_future else [past]
+        for uncovered in groups:
+            while len(uncovered) > 0:
+                # ties go to the page that also covers the most future games
+                page = max(coverage, key=lambda p: (len(coverage[p] & uncovered),
+                                                    len(coverage[p] & future)))
+                pages.append(page)
+                uncovered -= coverage[page]
+                future -= coverage[page]
+                del coverage[page]
+        return pages
+
+    @staticmethod
+    def get_unplayed_urls(today=None, include_future=False):
+        """Schedule page urls covering every game without a game_id or score"""
+        base_url = 'http://stats.ncaa.org/team/'
+        unplayed = dbutil.get_unplayed()
+        pages = ScheduleScraper.plan_refresh(unplayed, today, include_future)
+        return [base_url + '%s/%s' % (team, org_ncaa.convert_ncaa_year_code(season))
+                for team, season in pages]
+
     @staticmethod
     def get_team_schedule(soup, url):
         """
@@ -53,6 +116,27 @@ class ScheduleScraper(object):
 
         return games
 
+    @staticmethod
+    def schedule_hash(soup):
+        """
+        INPUT: BeautifulSoup
+        OUTPUT: STRING
+
+        Hash the text of the schedule table with whitespace normalized, so that
+        a page whose games did not change hashes the same even if the rest of
+        the page (ads, timestamps, markup) did.
+        """
+        tables = soup.findAll('table', {'class': 'mytable'})
+        if len(tables) == 0:
+            return None
+        rows = []
+        for row in tables[0].findAll('tr'):
+            cells = [' '.join(td.get_text().split()) for td in row.findAll('td')]
+            links = [a['href'] for a in row.findAll('a') if a.has_attr('href')]
+            rows.append('|'.join(cells + links))
+        text = '\n'.join(rows)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
     @staticmethod
     def _process_schedule_row(row, team_id):
         """Extract useful information about a game from its row representation"""
@@ -107,6 +191,95 @@ class ScheduleScraper(object):
         home_outcome = home_score > away_score
         return home_score, away_score, home_outcome
 
+class GameCanonicalizer(object):
+    """
+    Collect schedule rows from many team pages keeping one canonical row per
+    game.
+
+    Every game is listed on both teams' schedule pages, and neutral site games
+    may list either team as home. Rows are keyed by game_id when the page links
+    the game and by (date, unordered team pair) otherwise; neutral site games
+    are oriented with the lower team id as home so both pages agree.
+    """
+
+    def __init__(self, fetched=None):
+        """
+        INPUT: GameCanonicalizer, SET
+        OUTPUT: None
+
+        fetched is a set of game ids whose box/pbp pages were already fetched
+        """
+        self.games = []
+        self.by_id = {}
+        self.by_pair = {}
+        self.fetched = set(fetched) if fetched is not None else set()
+
+    @staticmethod
+    def canonical(row):
+        """
+        Orient a neutral site game with the lower team id as home team.
+
+        opp_string names the other team from the page's side, which is the
+        home team once flipped. The page gives no name for its own team, so
+        a flipped row has no opp_string and takes it from the home team's
+        page when that page is added.
+        """
+        row = list(row)
+        cols = ScheduleScraper.columns
+        h, a = cols.index('hteam_id'), cols.index('ateam_id')
+        if row[cols.index('neutral')] and row[h] is not None and row[a] is not None \
+                and row[h] > row[a]:
+            hs, aws, ho = cols.index('home_score'), cols.index('away_score'), cols.index('home_outcome')
+            row[h], row[a] = row[a], row[h]
+            row[hs], row[aws] = row[aws], row[hs]
+            if row[hs] is not None and row[aws] is not None:
+                row[ho] = row[hs] > row[aws]
+            row[cols.index('opp_string')] = None
+        return row
+
+    def add(self, row):
+        """
+        INPUT: GameCanonicalizer, LIST
+        OUTPUT: BOOLEAN
+
+        Add a schedule row, merging it into the game it duplicates if any.
+        Return True if the game had not been seen before.
+        """
+        row = GameCanonicalizer.canonical(row)
+        game_id, dt, hteam_id, ateam_id = row[:4]
+        pair = (dt, frozenset((hteam_id, ateam_id)))
+        key = self.by_id.get(game_id) if game_id is not None else None
+        if key is None:
+            key = self.by_pair.get(pair)
+
+        if key is None:
+            key = len(self.games)
+            self.games.append(row)
+            is_new = True
+        else:
+            # fill in whatever the other team's page was missing (e.g. game link)
+            existing = self.games[key]
+            for i, val in enumerate(row):
+                if existing[i] is None and val is not None:
+                    existing[i] = val
+            is_new = False
+
+        self.by_pair[pair] = key
+        if self.games[key][0] is not None:
+            self.by_id[self.games[key][0]] = key
+        return is_new
+
+    def claim_fetch(self, game_id):
+        """Return True exactly once per game id, for scheduling box/pbp fetches"""
+        if game_id is None or game_id in self.fetched:
+            return False
+        self.fetched.add(game_id)
+        return True
+
+    def rows(self):
+        return self.games
+
+
 class BoxScraper(object):
 
     @staticmethod
@@ -364,21 +537,16 @@ class DivisionOneScraper(object):
         database.
         """
         df = pd.read_csv(DivisionOneScraper.data_file)
-        existing_data = pd.read_sql("SELECT * FROM division_one", DB.conn)
-        merged = df.merge(existing_data, how='left', left_on=["teamid", "year"], right_on=["ncaaid", "year"])
-        missing = merged[pd.isnull(merged.ncaaid)]
-        vals = sql_convert(missing[['teamid', 'year']].values)
-        cur = DB.conn.cursor()
         q =  """ INSERT INTO division_one
                     (ncaaid, year)
                  VALUES (%s, %s)
              """
-        try:
-            cur.executemany(q, vals)
-            DB.conn.commit()
-        except:
-            DB.conn.rollback()
-            raise
+        with DB.connection() as conn:
+            existing_data = pd.read_sql("SELECT * FROM division_one", conn)
+            merged = df.merge(existing_data, how='left', left_on=["teamid", "year"], right_on=["ncaaid", "year"])
+            missing = merged[pd.isnull(merged.ncaaid)]
+            vals = sql_convert(missing[['teamid', 'year']].values)
+            conn.cursor().executemany(q, vals)
 
 class KenpomScraper(object):
 
@@ -437,13 +605,6 @@ class KenpomScraper(object):
 
     @classmethod
     def insert_data(cls, df):
-        cur = DB.conn.cursor()
-        years = np.unique(df.year.values)
-        # delete the data for every year we are trying to update
-        for year in years:
-            q = "DELETE FROM kenpom_ranks WHERE year=%s" % int(year)
-            cur.execute(q)
-
         cols_to_insert = ['year', 'rank', 'wins', 'losses', 'team', 'conf',
                           'pyth', 'adjo', 'adjd', 'adjt', 'luck', 'sos_pyth',
                           'sos_opp_o', 'sos_opp_d', 'ncsos']
@@ -451,12 +612,12 @@ class KenpomScraper(object):
         column_insert = '(' + ", ".join(cols_to_insert) + ')'
         vals_insert = '(' + ", ".join(["%s"] * len(cols_to_insert)) + ')'
         q = """ INSERT INTO kenpom_ranks %s VALUES %s""" % (column_insert, vals_insert)
-        try:
+        with DB.connection() as conn:
+            cur = conn.cursor()
+            # delete the data for every year we are trying to update
+            for year in np.unique(df.year.values):
+                cur.execute("DELETE FROM kenpom_ranks WHERE year=%s" % int(year))
             cur.executemany(q, vals)
-            DB.conn.commit()
-        except Exception:
-            DB.conn.rollback()
-            raise
 
 
 if __name__ == "__main__":
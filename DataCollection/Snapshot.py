@@ -0,0 +1,173 @@
+import json
+import os
+import shutil
+import sys
+
+import pandas as pd
+
+import DataCollection.ChangeLog as ChangeLog
+import DataCollection.DB as DB
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# local Parquet copies of the main tables, one file per table and season:
+#   <SNAPSHOT_DIR>/<table>/season=<season>/part.parquet
+SNAPSHOT_DIR = os.environ.get("CBB_SNAPSHOT_DIR",
+                              os.path.join(os.path.expanduser("~"), ".cbbdb", "snapshots"))
+MANIFEST = "manifest.json"
+# ChangeLog consumer whose watermark marks the last sync
+WATERMARK = "snapshot"
+# SQL for the season of each exported table's rows
+SEASON_SQL = {"games": "t.season",
+              "box": "t.season",
+              "raw_pbp": "t.season",
+              "pbp": "t.season",
+              "kenpom_ranks": "t.year"}
+# logged tables written without a change log entry: scheduled games have no
+# game_id to log, so games is fingerprinted on every sync
+UNLOGGED_WRITES = ["games"]
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("Parquet snapshots need pyarrow (pip install pyarrow)")
+
+
+def read_manifest(root=None):
+    """Fingerprint of the source rows each stored (table, season) file was written from"""
+    path = os.path.join(root or SNAPSHOT_DIR, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, root=None):
+    root = root or SNAPSHOT_DIR
+    path = os.path.join(root, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(path + ".tmp", path)
+
+
+def season_fingerprints(conn, table):
+    """
+    INPUT: CONNECTION, STRING
+    OUTPUT: DICT
+
+    Fingerprint [row count, sum of row hashes] of each season of a table,
+    computed in one pass on the server. It changes whenever a row of the
+    season is inserted, deleted or updated.
+    """
+    q = """ SELECT {season} AS season, count(*), sum(hashtext(t::text)::BIGINT)
+            FROM {name} t
+            GROUP BY 1
+        """.format(season=SEASON_SQL[table], name=DB.TABLES.get(table))
+    cur = conn.cursor()
+    cur.execute(q)
+    return dict((str(int(season)), [int(count), int(total)])
+                for season, count, total in cur.fetchall() if season is not None)
+
+
+def stale_seasons(fingerprints, stored):
+    """
+    INPUT: DICT, DICT
+    OUTPUT: LIST, LIST
+
+    Seasons whose fingerprint differs from the one stored in the manifest,
+    and stored seasons that no longer have any source rows
+    """
+    changed = sorted(season for season, fp in fingerprints.items() if stored.get(season) != fp)
+    removed = sorted(season for season in stored if season not in fingerprints)
+    return changed, removed
+
+
+def partition_path(table, season, root=None):
+    return os.path.join(root or SNAPSHOT_DIR, table, "season=%s" % season, "part.parquet")
+
+
+def export_season(conn, table, season, root=None):
+    """Write one season of a table to its Parquet file, dictionary encoding repeated values"""
+    _require_pyarrow()
+    season_sql = SEASON_SQL[table]
+    extra = "" if season_sql == "t.season" else ", %s AS season" % season_sql
+    q = "SELECT t.*{extra} FROM {name} t WHERE {season} = %s".format(
+        extra=extra, season=season_sql, name=DB.TABLES.get(table))
+    df = pd.read_sql(q, conn, params=(int(season),))
+    path = partition_path(table, season, root)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path + ".tmp",
+                   use_dictionary=True, compression="snappy")
+    os.rename(path + ".tmp", path)
+    return df.shape[0]
+
+
+def sync(tables=None, root=None):
+    """
+    INPUT: LIST, STRING
+    OUTPUT: DICT
+
+    Refresh the snapshots of tables, rewriting only the seasons whose source
+    rows changed since the last sync. Logged tables with nothing in the
+    change log since then are not scanned at all, except those in
+    UNLOGGED_WRITES. Return the seasons rewritten per table.
+    """
+    _require_pyarrow()
+    root = root or SNAPSHOT_DIR
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    manifest = read_manifest(root)
+    refreshed = {}
+    tables = tables or sorted(SEASON_SQL)
+    logged = [table for table in tables
+              if table in ChangeLog.LOGGED_TABLES and table not in UNLOGGED_WRITES]
+    tracked = ChangeLog.has_watermark(WATERMARK)
+    with ChangeLog.consume(WATERMARK, logged) as changes, DB.connection() as conn:
+        for table in tables:
+            if tracked and table in changes and len(changes[table]) == 0 and manifest.get(table):
+                # nothing was written to the table since the last sync
+                refreshed[table] = []
+                continue
+            fingerprints = season_fingerprints(conn, table)
+            stored = manifest.setdefault(table, {})
+            changed, removed = stale_seasons(fingerprints, stored)
+            for season in changed:
+                export_season(conn, table, season, root)
+                stored[season] = fingerprints[season]
+                write_manifest(manifest, root)
+            for season in removed:
+                shutil.rmtree(os.path.dirname(partition_path(table, season, root)))
+                del stored[season]
+                write_manifest(manifest, root)
+            refreshed[table] = changed
+    return refreshed
+
+
+def load(table, seasons=None, columns=None, root=None):
+    """
+    INPUT: STRING, LIST, LIST, STRING
+    OUTPUT: DATAFRAME
+
+    Read a table from its snapshot. Only the files of the requested seasons
+    are opened and only the requested columns are decoded.
+    """
+    _require_pyarrow()
+    stored = read_manifest(root).get(table, {})
+    if seasons is None:
+        seasons = sorted(stored, key=int)
+    frames = [pq.read_table(partition_path(table, season, root), columns=columns).to_pandas()
+              for season in seasons if str(season) in stored]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == "__main__":
+    for table, seasons in sorted(sync(sys.argv[1:] or None).items()):
+        print("%-14s %s" % (table, ", ".join(seasons) or "up to date"))
@@ -0,0 +1,106 @@
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# parsed batches that could not be written to the database wait here, one
+# directory per table, until they are replayed (see DBScrapeUtils.replay_spool).
+# The directories are created private to the user running the scrapers
+SPOOL_DIR = os.environ.get("CBB_SPOOL_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cbbdb", "spool"))
+
+_batch_ids = itertools.count()
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("spooling needs pyarrow (pip install pyarrow)")
+
+
+def private_dir(path):
+    """Create a directory, and any missing parents, that only its owner can read or write"""
+    try:
+        os.makedirs(path, 0o700)
+    except OSError:
+        # another process created it first
+        if not os.path.isdir(path):
+            raise
+
+
+def write(table, rows, directory=None):
+    """
+    INPUT: STRING, DATAFRAME, STRING
+    OUTPUT: STRING
+
+    Append a batch of converted rows to the spool as a compressed Parquet
+    file. The file is renamed into place once complete, so a reader never
+    sees a partial batch. Return its path.
+    """
+    _require_pyarrow()
+    table_dir = os.path.join(directory or SPOOL_DIR, table)
+    if not os.path.isdir(table_dir):
+        private_dir(table_dir)
+    # names sort in write order, and are unique across processes
+    name = "%017.6f-%d-%d" % (time.time(), os.getpid(), next(_batch_ids))
+    path = os.path.join(table_dir, name + ".parquet")
+    pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), path + ".tmp",
+                   compression="snappy")
+    os.rename(path + ".tmp", path)
+    return path
+
+
+def read(path):
+    """
+    Read a spooled batch back into a DATAFRAME of object columns with None
+    for NULL, like the converted rows it was written from
+    """
+    _require_pyarrow()
+    table = pq.read_table(path)
+    df = table.to_pandas(integer_object_nulls=True)
+    for field in table.schema:
+        values = df[field.name].values.astype(object)
+        nulls = pd.isnull(values)
+        if pa.types.is_binary(field.type):
+            # a column of both str and unicode values is written as utf-8 bytes
+            values = df[field.name].str.decode("utf-8").values.astype(object)
+        values[nulls] = None
+        df[field.name] = values
+    return df
+
+
+def batches(directory=None):
+    """
+    INPUT: STRING
+    OUTPUT: LIST
+
+    (table, path) of every complete spooled batch, oldest first
+    """
+    directory = directory or SPOOL_DIR
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for table in os.listdir(directory):
+        table_dir = os.path.join(directory, table)
+        if not os.path.isdir(table_dir):
+            continue
+        found += [(name, table, os.path.join(table_dir, name))
+                  for name in os.listdir(table_dir) if name.endswith(".parquet")]
+    return [(table, path) for name, table, path in sorted(found)]
+
+
+def remove(path):
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    import DataCollection.DBScrapeUtils as dbutil
+    print("replayed %s spooled batches" % dbutil.replay_spool())
@@ -0,0 +1,841 @@
+import abc
+from contextlib import contextmanager
+from datetime import date
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import DataCollection.ChangeLog as ChangeLog
+import DataCollection.CompactPBP as CompactPBP
+import DataCollection.DB as DB
+import DataCollection.DBCreate as DBCreate
+from DataCollection.BulkLoad import copy_rows, copy_merge, stage_rows, csv_buffer, sql_convert
+
+# row order of the event tables when reading one game
+GAME_ORDER = {"raw_pbp": "id", "pbp": "pbp_id"}
+# raw_pbp rows in the columns PBP processes: the crawlers store the id of
+# each play's team, PBP wants teamid (1 for the home team) and a team name
+RAW_PBP = """ SELECT r.game_id, r.id, r.season, COALESCE(CAST(r.team_id AS TEXT), '') AS team,
+                     CASE WHEN r.team_id = g.hteam_id THEN 1 ELSE 0 END AS teamid,
+                     r.time, r.first_name, r.last_name, r.play, r.hscore, r.ascore
+              FROM {raw_pbp} r
+              JOIN {games} g ON g.game_id = r.game_id
+          """
+
+
+class Storage(object):
+    """
+    The database operations the pipeline performs: create tables, load
+    scraped rows, find games still to scrape and read games back. Subclasses
+    supply the connection, the parameter style, the writers of each table
+    and the few statements that differ between databases.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    param = "%s"
+    # whether writes are recorded in ChangeLog for its consumers (snapshots,
+    # coverage, team games), which only run against the server
+    logs_changes = False
+    # writers of converted rows in a caller's transaction: table -> func(cursor, rows)
+    WRITERS = {}
+
+    @abc.abstractmethod
+    def create_tables(self):
+        """Create the tables the scrapers and loaders write"""
+
+    @abc.abstractmethod
+    def transaction(self):
+        """
+        Context manager yielding a cursor. The transaction is committed when
+        the block exits normally and rolled back if it raises.
+        """
+
+    @abc.abstractmethod
+    def connect(self):
+        """A connection for BatchWriter, with cursor(), commit() and rollback()"""
+
+    @abc.abstractmethod
+    def release(self, conn, close=False):
+        """Give back a connection from connect, closing it if it is broken"""
+
+    @abc.abstractmethod
+    def stream_cursor(self, chunk_size):
+        """Context manager yielding a cursor that pulls a large result chunk_size rows at a time"""
+
+    @abc.abstractmethod
+    def read_sql(self, q, params=()):
+        """Run q and return its rows as a DATAFRAME"""
+
+    @abc.abstractmethod
+    def bulk_insert(self, table, rows):
+        """Append a DATAFRAME of rows to table"""
+
+    @abc.abstractmethod
+    def upsert(self, table, rows, key):
+        """Insert a DATAFRAME of rows, updating the existing rows with the same key"""
+
+    @abc.abstractmethod
+    def season_sql(self, col):
+        """SQL expression for the season of the date column col, stored as games.season"""
+
+    def params(self, params):
+        """Query parameters as the driver takes them"""
+        return tuple(params)
+
+    def placeholders(self, n):
+        return ", ".join([self.param] * n)
+
+    def in_sql(self, col, values):
+        """SQL testing col against a list of values, and its parameters"""
+        values = list(values)
+        return "%s IN (%s)" % (col, self.placeholders(len(values))), values
+
+    def execute(self, q, params=()):
+        """Run q in its own transaction and return all of its rows"""
+        with self.transaction() as cur:
+            cur.execute(q, self.params(params))
+            return cur.fetchall() if cur.description is not None else []
+
+    def executemany(self, q, rows):
+        with self.transaction() as cur:
+            cur.executemany(q, [self.params(row) for row in rows])
+
+    def load(self, table, rows):
+        """
+        INPUT: Storage, STRING, DATAFRAME
+        OUTPUT: the writer's result
+
+        Write converted rows for table (games, box, raw_pbp or pbp) with
+        WRITERS, in one transaction
+        """
+        with self.transaction() as cur:
+            return self.WRITERS[table](cur, rows)
+
+    def game_seasons(self, game_ids):
+        """
+        INPUT: Storage, LIST
+        OUTPUT: DICT
+
+        Season of each game, from the games table
+        """
+        game_ids = [int(game_id) for game_id in game_ids]
+        if len(game_ids) == 0:
+            return {}
+        q = "SELECT game_id, season FROM {games} WHERE game_id IN ({ids})".format(
+            games=DB.TABLES.get("games"), ids=self.placeholders(len(game_ids)))
+        return dict((game_id, int(season)) for game_id, season in self.execute(q, game_ids))
+
+    def insert_events(self, table, rows):
+        """
+        INPUT: Storage, STRING, DATAFRAME
+        OUTPUT: None
+
+        Bulk insert converted event rows (box, raw_pbp or pbp), filling the
+        stored season column from each game's date
+        """
+        rows = rows.copy()
+        seasons = self.game_seasons(pd.unique(rows.game_id.dropna()))
+        rows["season"] = np.array([seasons.get(game_id) for game_id in rows.game_id.values],
+                                  dtype=object)
+        self.bulk_insert(table, rows)
+
+    def pending_games(self, table="box", start=None, end=None, limit=500, season=None):
+        """
+        INPUT: Storage, STRING, DATE, DATE, INT, INT
+        OUTPUT: LIST
+
+        Ids of played games in [start, end), and in season if given, with no
+        rows in table and no recorded url error, most recent first
+        """
+        table_name = DB.TABLES.get(table)
+        assert table_name, "table must be in %s" % DB.TABLES.keys()
+        q = """ SELECT g.game_id
+                FROM {games} g
+                WHERE g.game_id IS NOT NULL
+                AND g.dt >= {p} AND g.dt < {p}
+                {season}
+                AND NOT EXISTS (SELECT 1 FROM {table} t WHERE t.game_id = g.game_id)
+                AND NOT EXISTS (SELECT 1 FROM url_errors e WHERE e.game_id = g.game_id)
+                ORDER BY g.dt DESC
+                LIMIT {p}
+            """.format(games=DB.TABLES.get("games"), table=table_name, p=self.param,
+                       season="" if season is None else "AND g.season = %s" % self.param)
+        start = start if start is not None else date.min
+        end = end if end is not None else date.max
+        params = (start, end) + (() if season is None else (int(season),)) + (limit,)
+        return [row[0] for row in self.execute(q, params)]
+
+    def read_game(self, table, game_id):
+        """Read the rows of one game from an event table, in play order"""
+        q = "SELECT * FROM {table} WHERE game_id = {p}".format(table=DB.TABLES.get(table),
+                                                                 p=self.param)
+        if table in GAME_ORDER:
+            q += " ORDER BY %s" % GAME_ORDER[table]
+        return self.read_sql(q, (int(game_id),))
+
+    def stream_games(self, q, params=(), chunk_size=10000):
+        """
+        INPUT: Storage, STRING, TUPLE, INT
+        OUTPUT: GENERATOR
+
+        Run q, which must be ordered by game_id, and pull its rows chunk_size
+        at a time. Yield (game_id, DATAFRAME) as each game's rows are
+        complete, so memory is bounded by the chunk size and the largest game
+        rather than the size of the result.
+        """
+        with self.stream_cursor(chunk_size) as cur:
+            cur.execute(q, self.params(params))
+            columns, game_id, game_rows = None, None, []
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                if len(chunk) == 0:
+                    break
+                if columns is None:
+                    columns = [col[0] for col in cur.description]
+                    game_idx = columns.index('game_id')
+                for row in chunk:
+                    if row[game_idx] != game_id and len(game_rows) > 0:
+                        yield game_id, pd.DataFrame.from_records(game_rows, columns=columns)
+                        game_rows = []
+                    game_id = row[game_idx]
+                    game_rows.append(row)
+            if len(game_rows) > 0:
+                yield game_id, pd.DataFrame.from_records(game_rows, columns=columns)
+
+    def stream_unprocessed_pbp(self, season=None, chunk_size=10000):
+        """Stream the raw pbp (see RAW_PBP) of every game with no processed pbp rows, one game at a time"""
+        q = RAW_PBP + """ WHERE NOT EXISTS (SELECT 1 FROM {pbp} p WHERE p.game_id = r.game_id)
+                          {season}
+                          ORDER BY r.game_id, r.id
+                      """
+        q = q.format(raw_pbp=DB.TABLES.get("raw_pbp"), games=DB.TABLES.get("games"),
+                     pbp=DB.TABLES.get("pbp"),
+                     season="" if season is None else "AND r.season = %s" % self.param)
+        params = () if season is None else (int(season),)
+        return self.stream_games(q, params, chunk_size)
+
+    def stream_raw_pbp(self, game_ids, chunk_size=10000):
+        """Stream the raw pbp (see RAW_PBP) of the given games, one game at a time"""
+        match, params = self.in_sql("r.game_id", sorted(int(game_id) for game_id in game_ids))
+        q = RAW_PBP.format(raw_pbp=DB.TABLES.get("raw_pbp"), games=DB.TABLES.get("games"))
+        return self.stream_games(q + " WHERE %s ORDER BY r.game_id, r.id" % match, params,
+                                 chunk_size)
+
+
+# the PostgreSQL writers of each table, in the caller's transaction (see
+# PostgresStorage.WRITERS), and their helpers
+
+def ensure_season_partitions(cur, table, seasons):
+    """
+    Create the season partitions rows are about to be routed to, if table is
+    partitioned. The catalog is checked in the caller's transaction on every
+    call, one query for all the seasons, so a partition created by a
+    transaction that rolled back or a table repartitioned since is never
+    taken from a stale cache.
+    """
+    seasons = sorted(set(int(season) for season in seasons if season is not None))
+    if len(seasons) == 0:
+        return
+    names = [DBCreate.partition_name(table, season) for season in seasons]
+    cur.execute(""" SELECT name FROM unnest(%s::text[]) name
+                    WHERE to_regclass(name) IS NULL
+                    AND EXISTS (SELECT 1 FROM pg_partitioned_table
+                                WHERE partrelid = to_regclass(%s))
+                """, (names, DB.TABLES.get(table)))
+    missing = set(row[0] for row in cur.fetchall())
+    for season, name in zip(seasons, names):
+        if name in missing:
+            cur.execute(DBCreate.create_season_partition(table, season))
+
+
+def add_seasons(cur, table, rows):
+    """
+    INPUT: CURSOR, STRING, DATAFRAME
+    OUTPUT: LIST
+
+    Fill the stored season column of event rows from their games' dates so
+    they are routed to the right season partition. Return the columns to load.
+    """
+    game_ids = [int(game_id) for game_id in pd.unique(rows.game_id.dropna())]
+    cur.execute("SELECT game_id, season FROM {games} WHERE game_id = ANY(%s)"
+                .format(games=DB.TABLES.get('games')), (game_ids,))
+    seasons = dict(cur.fetchall())
+    rows['season'] = np.array([seasons.get(game_id) for game_id in rows.game_id.values],
+                              dtype=object)
+    ensure_season_partitions(cur, table, set(seasons.values()))
+    return DB.COLUMNS[table] + ['season']
+
+
+def game_hash(rows):
+    """sha1 of one game's converted rows, in their scraped order"""
+    return hashlib.sha1(csv_buffer(rows).getvalue()).hexdigest()
+
+
+def write_games(cur, table, rows):
+    """The body of DBScrapeUtils.replace_games on PostgreSQL, in the caller's transaction"""
+    hashes = dict([(int(game_id), game_hash(game_rows))
+                   for game_id, game_rows in rows.groupby('game_id', sort=False)])
+    game_ids = sorted(hashes)
+    # serialize loaders of the same games so the hash check and the
+    # replace see the same state
+    for game_id in game_ids:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s), %s)", (table, game_id))
+    cur.execute(""" SELECT game_id, content_hash
+                    FROM game_hashes
+                    WHERE tbl = %s AND game_id = ANY(%s)
+                """, (table, game_ids))
+    stored = dict(cur.fetchall())
+    changed = [game_id for game_id in game_ids if stored.get(game_id) != hashes[game_id]]
+    if len(changed) == 0:
+        return 0
+
+    if table == 'raw_pbp':
+        # processed pbp rows point at the raw rows being replaced
+        pbp = 'pbp_compact' if compact_pbp(cur) else 'pbp'
+        cur.execute("DELETE FROM {pbp} WHERE game_id = ANY(%s)"
+                    .format(pbp=DB.TABLES.get(pbp)), (changed,))
+    cur.execute("DELETE FROM {table} WHERE game_id = ANY(%s)"
+                .format(table=DB.TABLES.get(table)), (changed,))
+    rows = rows[rows.game_id.isin(changed)].copy()
+    columns = add_seasons(cur, table, rows)
+    copy_rows(cur, DB.TABLES.get(table), columns, rows)
+    cur.executemany(""" INSERT INTO game_hashes (game_id, tbl, content_hash)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (game_id, tbl) DO UPDATE
+                        SET content_hash=EXCLUDED.content_hash, loaded_at=now()
+                    """, [(game_id, table, hashes[game_id]) for game_id in changed])
+    ChangeLog.log_changes(cur, table, changed, 'replace')
+    return len(changed)
+
+
+def merge_games(cur, rows):
+    """The body of DBScrapeUtils.upsert_games on PostgreSQL, in the caller's transaction"""
+    games = DB.TABLES.get('games')
+    columns = DB.COLUMNS['games']
+    updates = ['home_score', 'away_score', 'neutral', 'neutral_site', 'home_outcome',
+               'numot', 'opp_string']
+    # a row flipped to the other team's side has no opp_string (see
+    # GameCanonicalizer.canonical), so it keeps the stored one
+    excluded = dict((col, 'EXCLUDED.%s' % col) for col in columns)
+    excluded['opp_string'] = 'COALESCE(EXCLUDED.opp_string, g.opp_string)'
+    fmt = {'games': games,
+           'columns': ', '.join(columns),
+           's_columns': ', '.join(['s.%s' % col for col in columns]),
+           'set_updates': ', '.join(['{col}=s.{col}'.format(col=col) for col in updates
+                                     if col != 'opp_string'] +
+                                    ['opp_string=COALESCE(s.opp_string, g.opp_string)']),
+           'set_excluded': ', '.join(['{col}={val}'.format(col=col, val=excluded[col])
+                                      for col in updates + ['dt', 'hteam_id', 'ateam_id']]),
+           'g_row': ', '.join(['g.%s' % col for col in columns]),
+           'excluded_row': ', '.join([excluded[col] for col in columns])}
+    counts = {}
+    fmt['stage'] = stage_rows(cur, games, columns, rows)
+
+    # earlier merges matched NULL teams with =, so a game against a non-D1
+    # opponent was scheduled again on every run; keep one copy of each
+    cur.execute(""" DELETE FROM {games} g
+                    USING {games} o
+                    WHERE g.game_id IS NULL AND o.game_id IS NULL
+                    AND g.dt = o.dt AND g.ctid > o.ctid
+                    AND g.hteam_id IS NOT DISTINCT FROM o.hteam_id
+                    AND g.ateam_id IS NOT DISTINCT FROM o.ateam_id
+                    AND g.dt IN (SELECT dt FROM {stage})
+                """.format(**fmt))
+    counts['duplicates'] = cur.rowcount
+
+    # NOT NULL is NULL, so a game with no outcome yet stays without one
+    cur.execute(""" UPDATE {stage} s
+                    SET hteam_id=s.ateam_id, ateam_id=s.hteam_id,
+                        home_score=s.away_score, away_score=s.home_score,
+                        home_outcome=NOT s.home_outcome, opp_string=NULL
+                    FROM {games} g
+                    WHERE g.dt = s.dt
+                    AND g.hteam_id IS NOT DISTINCT FROM s.ateam_id
+                    AND g.ateam_id IS NOT DISTINCT FROM s.hteam_id
+                    AND s.hteam_id IS DISTINCT FROM s.ateam_id
+                """.format(**fmt))
+    counts['flipped'] = cur.rowcount
+
+    cur.execute(""" UPDATE {games} g
+                    SET {set_updates}, game_id=COALESCE(s.game_id, g.game_id)
+                    FROM {stage} s
+                    WHERE g.dt = s.dt
+                    AND g.hteam_id IS NOT DISTINCT FROM s.hteam_id
+                    AND g.ateam_id IS NOT DISTINCT FROM s.ateam_id
+                    AND (g.game_id IS NULL OR g.home_score IS NULL)
+                    AND (s.game_id IS NULL
+                         OR NOT EXISTS (SELECT 1 FROM {games} o WHERE o.game_id = s.game_id))
+                    RETURNING g.game_id
+                """.format(**fmt))
+    counts['unplayed'] = cur.rowcount
+    changed = [row[0] for row in cur.fetchall()]
+
+    # a game already stored under another game_id would violate the other
+    # unique key, so those rows are left alone
+    cur.execute(""" INSERT INTO {games} AS g ({columns})
+                    SELECT DISTINCT ON (s.game_id) {s_columns}
+                    FROM {stage} s
+                    WHERE s.game_id IS NOT NULL
+                    AND NOT EXISTS (SELECT 1 FROM {games} o
+                                    WHERE o.dt = s.dt
+                                    AND o.hteam_id IS NOT DISTINCT FROM s.hteam_id
+                                    AND o.ateam_id IS NOT DISTINCT FROM s.ateam_id
+                                    AND o.game_id IS DISTINCT FROM s.game_id)
+                    ON CONFLICT (game_id) DO UPDATE
+                    SET {set_excluded}
+                    WHERE ({g_row}) IS DISTINCT FROM ({excluded_row})
+                    RETURNING g.game_id
+                """.format(**fmt))
+    counts['played'] = cur.rowcount
+    changed += [row[0] for row in cur.fetchall()]
+    # games still without a game_id have no box or pbp to refresh, and
+    # Snapshot rescans games on every sync (see Snapshot.UNLOGGED_WRITES)
+    ChangeLog.log_changes(cur, 'games', changed, 'upsert')
+
+    # ON CONFLICT only catches concurrent inserts of games with both teams
+    cur.execute(""" INSERT INTO {games} ({columns})
+                    SELECT DISTINCT ON (s.dt, s.hteam_id, s.ateam_id) {s_columns}
+                    FROM {stage} s
+                    WHERE s.game_id IS NULL
+                    AND NOT EXISTS (SELECT 1 FROM {games} o
+                                    WHERE o.dt = s.dt
+                                    AND o.hteam_id IS NOT DISTINCT FROM s.hteam_id
+                                    AND o.ateam_id IS NOT DISTINCT FROM s.ateam_id)
+                    ON CONFLICT (dt, hteam_id, ateam_id) DO NOTHING
+                """.format(**fmt))
+    counts['scheduled'] = cur.rowcount
+    return counts
+
+
+def write_pbp(cur, rows):
+    # pbp rows are keyed by the raw_pbp row they came from, so reprocessing
+    # a game only inserts the rows that are missing
+    rows = rows.copy()
+    columns = add_seasons(cur, 'pbp', rows)
+    if compact_pbp(cur):
+        ensure_season_partitions(cur, 'pbp_compact', set(rows.season.dropna()))
+        copy_merge(cur, DB.TABLES.get('pbp_compact'), CompactPBP.COLUMNS,
+                   CompactPBP.encode(cur, rows), key=['pbp_id', 'season'])
+    else:
+        copy_merge(cur, DB.TABLES.get('pbp'), columns, rows, key=['pbp_id', 'season'])
+    ChangeLog.log_changes(cur, 'pbp', pd.unique(rows.game_id.dropna()), 'merge')
+
+
+def compact_pbp(cur):
+    """True if pbp is stored in pbp_compact behind a view (see DBCreate.compact_pbp)"""
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (DB.TABLES.get('pbp_compact'),))
+    return cur.fetchone()[0]
+
+
+# inserts into the tables the standalone NCAAScraper writes, by the table
+# name its batches are spooled under; rows are in the scraper's column order
+LEGACY_INSERTS = {'ncaa_box': """ INSERT INTO ncaa_box (game_id, team, first_name, last_name,
+                                  pos, min, fgm, fga, tpm, tpa, ftm, fta, pts, oreb, dreb, reb,
+                                  ast, turnover, stl, blk, pf)
+                                  VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                                          %s, %s, %s, %s, %s, %s, %s, %s)
+                              """,
+                  'ncaa_raw_pbp': """ INSERT INTO raw_pbp (game_id, time, teamid, team,
+                                      first_name, last_name, play, hscore, ascore)
+                                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                                  """}
+
+
+def write_legacy(cur, table, rows):
+    cur.executemany(LEGACY_INSERTS[table], sql_convert(rows.values))
+
+
+class PostgresStorage(Storage):
+    """Storage on the PostgreSQL server configured in DB, loading with COPY"""
+    logs_changes = True
+    WRITERS = {'games': merge_games,
+               'box': lambda cur, rows: write_games(cur, 'box', rows),
+               'raw_pbp': lambda cur, rows: write_games(cur, 'raw_pbp', rows),
+               'pbp': write_pbp,
+               'ncaa_box': lambda cur, rows: write_legacy(cur, 'ncaa_box', rows),
+               'ncaa_raw_pbp': lambda cur, rows: write_legacy(cur, 'ncaa_raw_pbp', rows)}
+
+    def create_tables(self):
+        qs = [DBCreate.create_season_function(), DBCreate.create_games(),
+              DBCreate.create_url_errors(), DBCreate.create_scrape_errors(),
+              DBCreate.create_ncaa_box(), DBCreate.create_raw_pbp(), DBCreate.create_pbp(),
+              DBCreate.create_page_validators(), DBCreate.create_game_hashes(),
+              DBCreate.create_ingest_log(), DBCreate.create_watermarks()]
+        DBCreate.execute_all(qs + DBCreate.create_indexes())
+
+    @contextmanager
+    def transaction(self):
+        with DB.connection() as conn:
+            yield conn.cursor()
+
+    def connect(self):
+        return DB.manager.get_pool().getconn()
+
+    def release(self, conn, close=False):
+        DB.manager.get_pool().putconn(conn, close=close)
+
+    @contextmanager
+    def stream_cursor(self, chunk_size):
+        # a named cursor is held on the server, which sends the rows as they are fetched
+        with DB.connection() as conn:
+            cur = conn.cursor(name='stream_games')
+            cur.itersize = chunk_size
+            yield cur
+
+    def in_sql(self, col, values):
+        return "%s = ANY(%s)" % (col, self.param), [list(values)]
+
+    def read_sql(self, q, params=()):
+        with DB.connection() as conn:
+            return pd.read_sql(q, conn, params=self.params(params))
+
+    def bulk_insert(self, table, rows):
+        with self.transaction() as cur:
+            copy_rows(cur, DB.TABLES.get(table), list(rows.columns), rows)
+
+    def upsert(self, table, rows, key):
+        table_name, columns = DB.TABLES.get(table), list(rows.columns)
+        with self.transaction() as cur:
+            stage = stage_rows(cur, table_name, columns, rows)
+            cur.execute(""" INSERT INTO {table} ({columns})
+                            SELECT {columns} FROM {stage}
+                            ON CONFLICT ({key}) DO UPDATE
+                            SET {updates}
+                        """.format(table=table_name, stage=stage, key=", ".join(key),
+                                   columns=", ".join(columns),
+                                   updates=", ".join(["{col}=EXCLUDED.{col}".format(col=col)
+                                                      for col in columns if col not in key])))
+
+    def season_sql(self, col):
+        return "season_of({col})".format(col=col)
+
+
+SQLITE_TYPES = {"int": "INTEGER", "real": "REAL", "bool": "INTEGER", "text": "TEXT"}
+# pragmas for bulk loading an embedded database that can be rebuilt from the
+# source data: WAL with relaxed syncing, a large page cache and memory mapping
+SQLITE_PRAGMAS = ["PRAGMA journal_mode=WAL",
+                  "PRAGMA synchronous=OFF",
+                  "PRAGMA temp_store=MEMORY",
+                  "PRAGMA cache_size=-262144",
+                  "PRAGMA mmap_size=1073741824"]
+
+
+def _sqlite_value(val):
+    if isinstance(val, np.generic):
+        val = val.item()
+    if isinstance(val, float) and val != val:
+        return None
+    return val
+
+
+def sqlite_insert(cur, table, columns, rows, conflict=""):
+    """Insert the columns of a DATAFRAME of rows into table, e.g. with conflict "OR IGNORE" """
+    q = "INSERT {conflict} INTO {table} ({columns}) VALUES ({vals})".format(
+        conflict=conflict, table=table, columns=", ".join(columns),
+        vals=", ".join(["?"] * len(columns)))
+    cur.executemany(q, [[_sqlite_value(val) for val in row] for row in rows[columns].values])
+
+
+def sqlite_add_seasons(cur, table, rows):
+    """add_seasons on SQLite, which has no partitions to route rows to"""
+    game_ids = [int(game_id) for game_id in pd.unique(rows.game_id.dropna())]
+    cur.execute("SELECT game_id, season FROM {games} WHERE game_id IN ({ids})".format(
+        games=DB.TABLES.get('games'), ids=", ".join(["?"] * len(game_ids))), game_ids)
+    seasons = dict(cur.fetchall())
+    rows['season'] = np.array([seasons.get(game_id) for game_id in rows.game_id.values],
+                              dtype=object)
+    return DB.COLUMNS[table] + ['season']
+
+
+def sqlite_write_games(cur, table, rows):
+    """
+    write_games on SQLite: replace the rows of every game in rows. No
+    ChangeLog consumer runs on SQLite, so games are not hashed to skip the
+    unchanged ones; a game whose raw pbp is replaced is processed again.
+    """
+    game_ids = sorted(int(game_id) for game_id in pd.unique(rows.game_id.dropna()))
+    ids = ", ".join(["?"] * len(game_ids))
+    tables = ['pbp', table] if table == 'raw_pbp' else [table]
+    for name in tables:
+        cur.execute("DELETE FROM {table} WHERE game_id IN ({ids})"
+                    .format(table=DB.TABLES.get(name), ids=ids), game_ids)
+    rows = rows.copy()
+    columns = sqlite_add_seasons(cur, table, rows)
+    sqlite_insert(cur, DB.TABLES.get(table), columns, rows)
+    return len(game_ids)
+
+
+def sqlite_write_pbp(cur, rows):
+    """write_pbp on SQLite: only the rows whose pbp_id is missing are inserted"""
+    rows = rows.copy()
+    columns = sqlite_add_seasons(cur, 'pbp', rows)
+    sqlite_insert(cur, DB.TABLES.get('pbp'), columns, rows, conflict="OR IGNORE")
+
+
+def sqlite_merge_games(cur, rows):
+    """
+    merge_games on SQLite, with the same steps through a temporary staging
+    table. IS compares the team ids so that NULLs match.
+    """
+    games = DB.TABLES.get('games')
+    columns = DB.COLUMNS['games']
+    updates = ['home_score', 'away_score', 'neutral', 'neutral_site', 'home_outcome', 'numot']
+    fmt = {'games': games,
+           'columns': ', '.join(columns),
+           's_columns': ', '.join(['s.%s' % col for col in columns]),
+           'set_updates': ', '.join(['{col}=s.{col}'.format(col=col) for col in updates]),
+           'set_excluded': ', '.join(['{col}=excluded.{col}'.format(col=col)
+                                      for col in updates + ['dt', 'hteam_id', 'ateam_id']])}
+    counts = {}
+    cur.execute("DROP TABLE IF EXISTS temp.games_stage")
+    cur.execute("CREATE TEMP TABLE games_stage AS SELECT {columns} FROM {games} WHERE 0"
+                .format(**fmt))
+    sqlite_insert(cur, "temp.games_stage", columns, rows)
+
+    cur.execute(""" UPDATE games_stage AS s
+                    SET hteam_id=ateam_id, ateam_id=hteam_id,
+                        home_score=away_score, away_score=home_score,
+                        home_outcome=NOT home_outcome, opp_string=NULL
+                    WHERE hteam_id IS NOT ateam_id
+                    AND EXISTS (SELECT 1 FROM {games} g
+                                WHERE g.dt = s.dt
+                                AND g.hteam_id IS s.ateam_id
+                                AND g.ateam_id IS s.hteam_id)
+                """.format(**fmt))
+    counts['flipped'] = cur.rowcount
+
+    cur.execute(""" UPDATE {games} AS g
+                    SET {set_updates}, opp_string=COALESCE(s.opp_string, g.opp_string),
+                        game_id=COALESCE(s.game_id, g.game_id)
+                    FROM games_stage AS s
+                    WHERE g.dt = s.dt
+                    AND g.hteam_id IS s.hteam_id
+                    AND g.ateam_id IS s.ateam_id
+                    AND (g.game_id IS NULL OR g.home_score IS NULL)
+                    AND (s.game_id IS NULL
+                         OR NOT EXISTS (SELECT 1 FROM {games} o WHERE o.game_id = s.game_id))
+                """.format(**fmt))
+    counts['unplayed'] = cur.rowcount
+
+    cur.execute(""" INSERT INTO {games} ({columns})
+                    SELECT {s_columns}
+                    FROM games_stage s
+                    WHERE s.game_id IS NOT NULL
+                    AND NOT EXISTS (SELECT 1 FROM {games} o
+                                    WHERE o.dt = s.dt
+                                    AND o.hteam_id IS s.hteam_id
+                                    AND o.ateam_id IS s.ateam_id
+                                    AND o.game_id IS NOT s.game_id)
+                    GROUP BY s.game_id
+                    ON CONFLICT (game_id) DO UPDATE
+                    SET {set_excluded}, opp_string=COALESCE(excluded.opp_string, opp_string)
+                """.format(**fmt))
+    counts['played'] = cur.rowcount
+
+    cur.execute(""" INSERT INTO {games} ({columns})
+                    SELECT {s_columns}
+                    FROM games_stage s
+                    WHERE s.game_id IS NULL
+                    AND NOT EXISTS (SELECT 1 FROM {games} o
+                                    WHERE o.dt = s.dt
+                                    AND o.hteam_id IS s.hteam_id
+                                    AND o.ateam_id IS s.ateam_id)
+                    GROUP BY s.dt, s.hteam_id, s.ateam_id
+                    ON CONFLICT DO NOTHING
+                """.format(**fmt))
+    counts['scheduled'] = cur.rowcount
+    cur.execute("DROP TABLE temp.games_stage")
+    return counts
+
+
+class SQLiteBatch(object):
+    """
+    BatchWriter's connection to a SQLite storage: its statements run on the
+    storage's connection in one transaction, begun by the first cursor
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.begun = False
+
+    def cursor(self):
+        if not self.begun:
+            self.conn.execute("BEGIN")
+            self.begun = True
+        return self.conn.cursor()
+
+    def commit(self):
+        if self.begun:
+            self.conn.execute("COMMIT")
+            self.begun = False
+
+    def rollback(self):
+        if self.begun:
+            self.conn.execute("ROLLBACK")
+            self.begun = False
+
+
+class SQLiteStorage(Storage):
+    """
+    Embedded storage in a single SQLite file, so the pipeline can run on one
+    machine with no database server. Dates are stored as ISO text.
+
+    The connection is in autocommit mode and transactions are savepoints, so
+    that they nest inside a BatchWriter's transaction on the same connection.
+    """
+    param = "?"
+    WRITERS = {'games': sqlite_merge_games,
+               'box': lambda cur, rows: sqlite_write_games(cur, 'box', rows),
+               'raw_pbp': lambda cur, rows: sqlite_write_games(cur, 'raw_pbp', rows),
+               'pbp': sqlite_write_pbp}
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        for pragma in SQLITE_PRAGMAS:
+            self.conn.execute(pragma)
+        # files created before the tables stored a season
+        self.add_season_columns()
+
+    def create_tables(self):
+        def columns(table, extra=()):
+            types = DB.COLUMN_TYPES[table]
+            cols = ["%s %s" % (col, SQLITE_TYPES[types.get(col, "text")])
+                    for col in DB.COLUMNS[table]]
+            return ",\n".join(cols + list(extra))
+
+        season = "season INTEGER GENERATED ALWAYS AS (%s) STORED" % self.season_sql("dt")
+        qs = ["CREATE TABLE IF NOT EXISTS {games} ({cols})".format(
+                  games=DB.TABLES.get("games"),
+                  cols=columns("games", [season, "UNIQUE (game_id)",
+                                         "UNIQUE (dt, hteam_id, ateam_id)"])),
+              """CREATE TABLE IF NOT EXISTS url_errors
+                 (id INTEGER PRIMARY KEY, game_id INTEGER NOT NULL)""",
+              """CREATE TABLE IF NOT EXISTS scrape_errors
+                 (id INTEGER PRIMARY KEY, game_id INTEGER, tbl TEXT NOT NULL,
+                  error TEXT NOT NULL, reason TEXT,
+                  failed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)""",
+              """CREATE TABLE IF NOT EXISTS page_validators
+                 (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT,
+                  checked_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)""",
+              "CREATE TABLE IF NOT EXISTS {box} ({cols})".format(
+                  box=DB.TABLES.get("box"), cols=columns("box", ["season INTEGER"])),
+              "CREATE TABLE IF NOT EXISTS {raw_pbp} (id INTEGER PRIMARY KEY, {cols})".format(
+                  raw_pbp=DB.TABLES.get("raw_pbp"), cols=columns("raw_pbp", ["season INTEGER"])),
+              "CREATE TABLE IF NOT EXISTS {pbp} ({cols})".format(
+                  pbp=DB.TABLES.get("pbp"),
+                  cols=columns("pbp", ["season INTEGER", "UNIQUE (pbp_id)"]))]
+        with self.transaction() as cur:
+            for q in qs:
+                cur.execute(q)
+        self.add_season_columns()
+        with self.transaction() as cur:
+            for q in DBCreate.create_indexes():
+                cur.execute(q)
+
+    def columns(self, table):
+        # table_xinfo also lists generated columns, which table_info hides
+        return [row[1] for row in self.conn.execute("PRAGMA table_xinfo(%s)" % table)]
+
+    def add_season_columns(self):
+        """
+        Add the season columns to tables created without them, like
+        DBCreate.add_season_columns. SQLite can only add a generated column
+        as VIRTUAL, so an old games table computes its season on read.
+        """
+        games = DB.TABLES.get("games")
+        with self.transaction() as cur:
+            existing = self.columns(games)
+            if len(existing) > 0 and "season" not in existing:
+                cur.execute("ALTER TABLE {games} ADD COLUMN season INTEGER "
+                            "GENERATED ALWAYS AS ({season}) VIRTUAL"
+                            .format(games=games, season=self.season_sql("dt")))
+            for table in DBCreate.SEASON_TABLES:
+                name = DB.TABLES.get(table)
+                existing = self.columns(name)
+                if len(existing) == 0 or "season" in existing:
+                    continue
+                cur.execute("ALTER TABLE {name} ADD COLUMN season INTEGER".format(name=name))
+                cur.execute(""" UPDATE {name} SET season =
+                                (SELECT g.season FROM {games} g
+                                 WHERE g.game_id = {name}.game_id)
+                            """.format(name=name, games=games))
+
+    @contextmanager
+    def transaction(self):
+        cur = self.conn.cursor()
+        cur.execute("SAVEPOINT storage")
+        try:
+            yield cur
+        except:
+            cur.execute("ROLLBACK TO SAVEPOINT storage")
+            cur.execute("RELEASE SAVEPOINT storage")
+            raise
+        cur.execute("RELEASE SAVEPOINT storage")
+
+    def connect(self):
+        return SQLiteBatch(self.conn)
+
+    def release(self, conn, close=False):
+        # the connection is shared, so only the batch's open transaction is dropped
+        conn.rollback()
+
+    @contextmanager
+    def stream_cursor(self, chunk_size):
+        yield self.conn.cursor()
+
+    def params(self, params):
+        return [_sqlite_value(val) for val in params]
+
+    def read_sql(self, q, params=()):
+        return pd.read_sql(q, self.conn, params=self.params(params))
+
+    def bulk_insert(self, table, rows):
+        with self.transaction() as cur:
+            sqlite_insert(cur, DB.TABLES.get(table), list(rows.columns), rows)
+
+    def upsert(self, table, rows, key):
+        conflict = """ ON CONFLICT ({key}) DO UPDATE
+                       SET {updates}
+                   """.format(key=", ".join(key),
+                              updates=", ".join(["{col}=excluded.{col}".format(col=col)
+                                                 for col in rows.columns if col not in key]))
+        q = "INSERT INTO {table} ({columns}) VALUES ({vals}) {conflict}".format(
+            table=DB.TABLES.get(table), columns=", ".join(rows.columns),
+            vals=self.placeholders(rows.shape[1]), conflict=conflict)
+        with self.transaction() as cur:
+            cur.executemany(q, [self.params(row) for row in rows.values])
+
+    def season_sql(self, col):
+        return """(CASE
+                     WHEN CAST(strftime('%m', {col}) AS INTEGER) <= 6
+                     THEN CAST(strftime('%Y', {col}) AS INTEGER)
+                     ELSE CAST(strftime('%Y', {col}) AS INTEGER) + 1
+                   END)""".format(col=col)
+
+
+# open SQLite storages by path, so every caller shares one connection per file
+_SQLITE = {}
+
+
+def get_storage(spec=None):
+    """
+    INPUT: STRING
+    OUTPUT: Storage
+
+    Storage named by spec or the CBB_STORAGE environment variable:
+    'postgres' (the default) or 'sqlite:<path>'. The scrapers, loaders, work
+    discovery and PBP all read and write through it.
+    """
+    spec = spec or os.environ.get("CBB_STORAGE", "postgres")
+    if spec == "postgres":
+        return PostgresStorage()
+    if spec.startswith("sqlite:"):
+        path = spec[len("sqlite:"):]
+        if path not in _SQLITE:
+            _SQLITE[path] = SQLiteStorage(path)
+        return _SQLITE[path]
+    raise ValueError("unknown storage: %s" % spec)
@@ -0,0 +1,38 @@
+import os
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+
+import DataCollection.DB as DB
+
+# database the live tests create their tables in; everything they do is
+# rolled back, so it only needs to exist and be empty
+TEST_DATABASE = os.environ.get("CBB_TEST_DATABASE")
+
+
+@pytest.fixture
+def pg(monkeypatch):
+    """
+    A cursor on CBB_TEST_DATABASE in one transaction that is rolled back
+    after the test. DB.connection yields the same connection, so code under
+    test sees the tables the test created. Skipped if no database is set.
+    """
+    if TEST_DATABASE is None:
+        pytest.skip("set CBB_TEST_DATABASE to run the PostgreSQL tests")
+    config = DB.load_config()
+    config["database"] = TEST_DATABASE
+    try:
+        conn = psycopg2.connect(**DB.ConnectionManager(config).dsn())
+    except psycopg2.OperationalError as e:
+        pytest.skip("cannot connect to %s: %s" % (TEST_DATABASE, e))
+
+    @contextmanager
+    def connection():
+        yield conn
+    monkeypatch.setattr(DB, "connection", connection)
+    try:
+        yield conn.cursor()
+    finally:
+        conn.rollback()
+        conn.close()
@@ -0,0 +1,147 @@
+import numpy as np
+import psycopg2
+import pytest
+
+import DataCollection.DB as DB
+import DataCollection.DBScrapeUtils as dbutil
+import DataCollection.Spool as Spool
+import DataCollection.Storage as Storage
+from DataCollection.BatchWriter import BatchWriter
+
+
+class LogCursor(object):
+
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, q, params=None):
+        self.log.append(q.split()[0] if params is None else (q.split()[2], params))
+
+
+class LogConnection(object):
+
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return LogCursor(self.log)
+
+    def commit(self):
+        self.log.append('COMMIT')
+
+
+class LogPool(object):
+
+    def __init__(self):
+        self.conn = LogConnection()
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        pass
+
+
+def test_failed_game_is_isolated_and_recorded(monkeypatch):
+    pool = LogPool()
+    monkeypatch.setattr(DB.manager, 'get_pool', lambda: pool)
+
+    def bad(cur):
+        raise ValueError('no plays')
+
+    with BatchWriter(batch_size=2) as writer:
+        assert writer.run(1, 'box', lambda cur: None)
+        assert not writer.run(2, 'box', bad)
+        assert writer.run(3, 'box', lambda cur: None)
+    assert (writer.written, writer.failed) == (2, 1)
+    assert pool.conn.log == ['SAVEPOINT', 'RELEASE',
+                             'SAVEPOINT', 'ROLLBACK',
+                             'SAVEPOINT', ('scrape_errors', (2, 'box', 'ValueError', 'no plays')),
+                             'RELEASE', 'COMMIT',
+                             'SAVEPOINT', 'RELEASE', 'COMMIT']
+
+
+class FailingInsertCursor(LogCursor):
+
+    def execute(self, q, params=None):
+        LogCursor.execute(self, q, params)
+        if 'scrape_errors' in q:
+            raise psycopg2.ProgrammingError('value too long for type')
+
+
+def test_failed_record_does_not_abort_the_batch(monkeypatch):
+    pool = LogPool()
+    monkeypatch.setattr(pool.conn, 'cursor', lambda: FailingInsertCursor(pool.conn.log))
+    monkeypatch.setattr(DB.manager, 'get_pool', lambda: pool)
+
+    def bad(cur):
+        raise ValueError(u'no plays for Jos\xe9')
+
+    with BatchWriter() as writer:
+        assert not writer.run(1, 'box', bad)
+        assert writer.run(2, 'box', lambda cur: None)
+    assert (writer.written, writer.failed) == (1, 1)
+    assert pool.conn.log == ['SAVEPOINT', 'ROLLBACK',
+                             'SAVEPOINT',
+                             ('scrape_errors', (1, 'box', 'ValueError', u'no plays for Jos\xe9')),
+                             'ROLLBACK',
+                             'SAVEPOINT', 'RELEASE', 'COMMIT']
+
+
+def test_unavailable_database_is_raised(monkeypatch):
+    pool = LogPool()
+    monkeypatch.setattr(DB.manager, 'get_pool', lambda: pool)
+
+    def down(cur):
+        raise psycopg2.OperationalError('server closed the connection')
+
+    writer = BatchWriter()
+    try:
+        writer.run(1, 'box', down)
+        assert False, 'expected OperationalError'
+    except psycopg2.OperationalError:
+        pass
+    assert writer.conn is None and writer.failed == 0
+
+
+def box_values(game_ids):
+    return np.array([[game_id, 'A', 1, 'JOHN', 'DOE'] + [0] * 17 for game_id in game_ids],
+                    dtype=object)
+
+
+def test_write_commits_failed_games_alone(monkeypatch):
+    pool = LogPool()
+    monkeypatch.setattr(DB.manager, 'get_pool', lambda: pool)
+
+    def writer_fails_game_2(cur, rows):
+        if rows.game_id.iloc[0] == 2:
+            raise ValueError('bad rows')
+    monkeypatch.setitem(Storage.PostgresStorage.WRITERS, 'box', writer_fails_game_2)
+
+    with BatchWriter(batch_size=1) as writer:
+        assert writer.write('box', box_values([1, 2, 3])) == 2
+        assert writer.execute("INSERT INTO url_errors (game_id) VALUES (%s)", (4,))
+    assert (writer.written, writer.failed) == (2, 1)
+    assert pool.conn.log.count('COMMIT') == 4
+    assert writer.pending == []
+
+
+def test_write_spools_uncommitted_games(tmpdir, monkeypatch):
+    pytest.importorskip('pyarrow')
+    pool = LogPool()
+    monkeypatch.setattr(DB.manager, 'get_pool', lambda: pool)
+    monkeypatch.setattr(Spool, 'SPOOL_DIR', str(tmpdir))
+
+    def writer_loses_game_2(cur, rows):
+        if rows.game_id.iloc[0] == 2:
+            raise psycopg2.OperationalError('server closed the connection')
+    monkeypatch.setitem(Storage.PostgresStorage.WRITERS, 'box', writer_loses_game_2)
+
+    writer = BatchWriter(batch_size=10)
+    # game 1 was written before the connection dropped, then spooled with 2
+    assert writer.write('box', box_values([1, 2, 3])) == 2
+    writer.close()
+    spooled = [Spool.read(path) for table, path in Spool.batches()]
+    # game 3 is written on a new connection
+    assert [batch.game_id.tolist() for batch in spooled] == [[1, 2]]
+    assert writer.written == 2
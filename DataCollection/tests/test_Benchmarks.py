@@ -0,0 +1,24 @@
+import json
+
+from DataCollection.Benchmarks import explain_time
+
+
+class ExplainCursor(object):
+
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, q):
+        assert q.startswith("EXPLAIN (ANALYZE, FORMAT JSON) ")
+
+    def fetchone(self):
+        return (self.result,)
+
+
+def test_explain_time_reads_json_plan():
+    plan = [{"Plan": {"Node Type": "Limit"}, "Planning Time": 0.1, "Execution Time": 12.5}]
+    # psycopg2 parses json results; a driver that does not returns the text
+    for result in [plan, json.dumps(plan)]:
+        ms, text = explain_time(ExplainCursor(result), "SELECT 1")
+        assert ms == 12.5
+        assert json.loads(text) == {"Node Type": "Limit"}
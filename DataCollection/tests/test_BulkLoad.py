@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from DataCollection.BulkLoad import csv_buffer, convert_columns, sql_convert
+
+
+def test_csv_buffer_nulls_and_floats():
+    rows = [[1, None, '', 3.0, 2.5, np.nan, np.float64(4.0), True]]
+    line = csv_buffer(rows).read()
+    assert line == '1,\\N,,3,2.5,\\N,4,True\n'
+
+
+def test_csv_buffer_quotes_and_unicode():
+    rows = [['DOE, JOHN', u'Jos\xe9', 'say "hi"']]
+    line = csv_buffer(rows).read()
+    assert line == '"DOE, JOHN",Jos\xc3\xa9,"say ""hi"""\n'
+
+
+def test_convert_columns_by_schema():
+    values = np.array([[1.0, '12', 20.5, 'nan', True, 'DOE'],
+                       [np.nan, None, np.nan, None, None, np.nan]], dtype=object)
+    columns = ['game_id', 'hscore', 'time', 'play', 'blocked', 'last_name']
+    types = {'game_id': 'int', 'hscore': 'int', 'time': 'real', 'play': 'text',
+             'blocked': 'bool', 'last_name': 'text'}
+    df = convert_columns(values, columns, types)
+    assert list(df.columns) == columns
+    assert df.values[0].tolist() == [1, 12, 20.5, None, True, 'DOE']
+    assert df.values[1].tolist() == [None] * 6
+    assert type(df.game_id.values[0]) == int
+    assert csv_buffer(df).read() == '1,12,20.5,\\N,True,DOE\n\\N,\\N,\\N,\\N,\\N,\\N\n'
+
+
+def test_sql_convert_columns():
+    values = np.array([[1.0, 2.5, 'nan', 'A'],
+                       [np.nan, 3.0, 'x', None]], dtype=object)
+    out = sql_convert(values)
+    assert out.tolist() == [[1, 2.5, None, 'A'], [None, 3.0, 'x', None]]
+    assert type(out[0][0]) == int
+
+
+def test_convert_columns_parses_bools():
+    values = np.array([[v] for v in [True, False, 'True', 'False', 't', 'f', '1', '0', 1.0, 0,
+                                     np.bool_(True), '', None]], dtype=object)
+    df = convert_columns(values, ['blocked'], {'blocked': 'bool'})
+    assert df.blocked.tolist() == [True, False, True, False, True, False, True, False, True,
+                                   False, True, None, None]
+
+
+def test_convert_columns_rejects_malformed_values():
+    types = {'game_id': 'int', 'blocked': 'bool'}
+    df = convert_columns(np.array([[' 12 ', 'f'], ['', None]], dtype=object),
+                         ['game_id', 'blocked'], types)
+    assert df.values.tolist() == [[12, False], [None, None]]
+    for values, col in [([['12x', 't']], 'game_id'), ([['3.7', 't']], 'game_id'),
+                        ([['12', 'maybe']], 'blocked'), ([['12', 2]], 'blocked'),
+                        ([['12', u'Jos\xe9']], 'blocked')]:
+        with pytest.raises(ValueError) as e:
+            convert_columns(np.array(values, dtype=object), ['game_id', 'blocked'], types)
+        assert str(e.value).startswith(col)
@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+
+import DataCollection.ChangeLog as ChangeLog
+import DataCollection.DB as DB
+
+
+class LogCursor(object):
+    """Answers the queries of ChangeLog.pending and records watermark updates"""
+
+    def __init__(self, state):
+        self.state = state
+        self.result = []
+
+    def execute(self, q, params=None):
+        if 'txid_snapshot_xmin' in q:
+            self.result = [(self.state['xmin'],)]
+        elif q.strip().startswith('SELECT xmin'):
+            self.result = [(self.state['watermark'],)] if 'watermark' in self.state else []
+        elif 'ingest_log' in q:
+            tables, since, upto = params
+            self.result = [(tbl, ids) for tbl, xid, ids in self.state['log']
+                           if tbl in tables and since <= xid < upto]
+        elif 'INSERT INTO watermarks' in q:
+            self.state['watermark'] = params[1]
+
+    def fetchone(self):
+        return self.result[0] if len(self.result) > 0 else None
+
+    def fetchall(self):
+        return self.result
+
+
+def test_consume_advances_only_on_success(monkeypatch):
+    state = {'xmin': 100, 'log': [('raw_pbp', 90, [1, 2]), ('box', 95, [3])]}
+
+    @contextmanager
+    def connection():
+        yield type('Connection', (object,), {'cursor': lambda self: LogCursor(state)})()
+    monkeypatch.setattr(DB, 'connection', connection)
+
+    try:
+        with ChangeLog.consume('pbp', ['raw_pbp']) as changes:
+            assert changes == {'raw_pbp': [1, 2]}
+            raise ValueError
+    except ValueError:
+        pass
+    assert 'watermark' not in state
+
+    with ChangeLog.consume('pbp', ['raw_pbp', 'games']) as changes:
+        assert changes == {'raw_pbp': [1, 2], 'games': []}
+    assert state['watermark'] == 100
+
+    state['xmin'] = 120
+    with ChangeLog.consume('pbp', ['raw_pbp']) as changes:
+        assert changes == {'raw_pbp': []}
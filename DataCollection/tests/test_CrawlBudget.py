@@ -0,0 +1,26 @@
+from DataCollection.CrawlBudget import CrawlBudget, FileTokenBucket
+
+HOST = 'stats.ncaa.org'
+
+
+def test_bucket_limits_burst(tmpdir):
+    budget = CrawlBudget(rate=1., burst=3., directory=str(tmpdir))
+    waits = [budget.try_acquire(HOST) for i in range(4)]
+    assert waits[:3] == [0., 0., 0.]
+    assert 0 < waits[3] <= 1.
+
+
+def test_bucket_state_is_shared(tmpdir):
+    # two buckets on the same file behave like two processes sharing a host
+    bucket1 = FileTokenBucket(HOST, 1., 2., str(tmpdir))
+    bucket2 = FileTokenBucket(HOST, 1., 2., str(tmpdir))
+    assert bucket1.try_acquire() == 0.
+    assert bucket2.try_acquire() == 0.
+    assert bucket1.try_acquire() > 0
+    assert bucket2.try_acquire() > 0
+
+
+def test_hosts_have_separate_buckets(tmpdir):
+    budget = CrawlBudget(rate=1., burst=1., directory=str(tmpdir))
+    assert budget.try_acquire(HOST) == 0.
+    assert budget.try_acquire('kenpom.com') == 0.
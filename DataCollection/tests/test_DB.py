@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+
+import psycopg2
+import pytest
+
+import DataCollection.DB as DB
+
+
+def test_load_config(tmpdir, monkeypatch):
+    path = tmpdir.join("cbbdb.cfg")
+    path.write("[db]\ndatabase = cbb_test\nport = 5433\n")
+    monkeypatch.setenv("CBB_DB_USER", "scraper")
+    config = DB.load_config(str(path))
+    assert config["database"] == "cbb_test"
+    assert config["port"] == "5433"
+    assert config["user"] == "scraper"
+    assert config["host"] == DB.DEFAULTS["host"]
+
+
+def test_password_is_required(tmpdir, monkeypatch):
+    monkeypatch.delenv("CBB_DB_PASSWORD", raising=False)
+    config = DB.load_config(str(tmpdir.join("missing.cfg")))
+    assert "password" not in config
+    with pytest.raises(ValueError):
+        DB.ConnectionManager(config).dsn()
+    monkeypatch.setenv("CBB_DB_PASSWORD", "secret")
+    config = DB.load_config(str(tmpdir.join("missing.cfg")))
+    assert DB.ConnectionManager(config).dsn()["password"] == "secret"
+
+
+def test_manager_is_lazy():
+    manager = DB.ConnectionManager(config=dict(DB.DEFAULTS, password=""))
+    assert manager.pool is None
+    assert manager.dsn()["database"] == DB.DEFAULTS["database"]
+    assert "maxconn" not in manager.dsn()
+    manager.close()
+    assert manager.pool is None
+
+
+def test_inherited_pool_is_kept_referenced(monkeypatch):
+    monkeypatch.setattr(DB, "BlockingPool", lambda minconn, maxconn, **dsn: object())
+    manager = DB.ConnectionManager(config=dict(DB.DEFAULTS, password=""))
+    inherited = object()
+    # a pool created by the parent of a forked process
+    manager.pool, manager.pid = inherited, os.getpid() + 1
+    pool = manager.get_pool()
+    assert pool is not inherited and manager.pid == os.getpid()
+    assert manager._abandoned == [inherited]
+
+    manager.pid = os.getpid() + 1
+    manager.close()
+    assert manager.pool is None
+    assert manager._abandoned == [inherited, pool]
+
+
+class FakeConnection(object):
+    closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+def test_exhausted_pool_waits_for_a_connection(monkeypatch):
+    monkeypatch.setattr(psycopg2, "connect", lambda *args, **kwargs: FakeConnection())
+    pool = DB.BlockingPool(0, 1)
+    conn = pool.getconn()
+    borrowed = []
+    waiter = threading.Thread(target=lambda: borrowed.append(pool.getconn()))
+    waiter.start()
+    time.sleep(0.1)
+    # the second borrower waits rather than raising PoolError
+    assert borrowed == []
+    pool.putconn(conn)
+    waiter.join(5)
+    assert len(borrowed) == 1
@@ -0,0 +1,28 @@
+import DataCollection.DB as DB
+import DataCollection.DBCreate as DBCreate
+
+
+def test_add_season_columns_migrates_old_tables(pg):
+    # the tables as they were before they stored a season
+    fmt = dict(games=DB.TABLES.get('games'), box=DB.TABLES.get('box'))
+    for q in ["CREATE TABLE {games} (dt DATE NOT NULL, game_id INT UNIQUE)",
+              "CREATE TABLE {box} (game_id INT NOT NULL, first_name TEXT)",
+              "CREATE TABLE raw_pbp (id SERIAL PRIMARY KEY, game_id INT NOT NULL)",
+              "CREATE TABLE pbp (pbp_id INT NOT NULL, game_id INT NOT NULL)",
+              "CREATE TABLE url_errors (id SERIAL PRIMARY KEY, game_id INT NOT NULL)",
+              "INSERT INTO {games} VALUES ('2014-12-01', 1), ('2015-08-01', 2)",
+              "INSERT INTO {box} VALUES (1, 'Totals'), (2, 'Totals')",
+              "INSERT INTO raw_pbp (game_id) VALUES (1), (9)"]:
+        pg.execute(q.format(**fmt))
+
+    DBCreate.add_season_columns()
+    pg.execute("SELECT game_id, season FROM {games} ORDER BY game_id".format(**fmt))
+    assert pg.fetchall() == [(1, 2015), (2, 2016)]
+    pg.execute("SELECT game_id, season FROM {box} ORDER BY game_id".format(**fmt))
+    assert pg.fetchall() == [(1, 2015), (2, 2016)]
+    pg.execute(""" SELECT table_name, is_nullable FROM information_schema.columns
+                   WHERE column_name = 'season' AND table_name IN (%s, 'raw_pbp', 'pbp')
+                   ORDER BY table_name
+               """, (fmt['box'],))
+    # raw_pbp has a row whose game is missing
+    assert pg.fetchall() == [(fmt['box'], 'NO'), ('pbp', 'NO'), ('raw_pbp', 'YES')]
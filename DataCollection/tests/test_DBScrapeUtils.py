@@ -0,0 +1,168 @@
+from contextlib import contextmanager
+from datetime import date
+
+import numpy as np
+import psycopg2
+import pytest
+
+import DataCollection.DB as DB
+import DataCollection.DBCreate as DBCreate
+from DataCollection.BulkLoad import convert_columns
+import DataCollection.DBScrapeUtils as dbutil
+from DataCollection.DBScrapeUtils import game_hash, season_dates
+
+
+def test_season_dates():
+    assert season_dates(2015) == (date(2014, 7, 1), date(2015, 7, 1))
+
+
+def test_game_hash_tracks_content():
+    values = np.array([[10, 1, 0.5, 'JOHN', 'DOE', 'JM', 2, 0],
+                       [10, 0, 1.0, 'JANE', None, 'FOUL', 2, 0]], dtype=object)
+    columns, types = DB.COLUMNS['raw_pbp'], DB.COLUMN_TYPES['raw_pbp']
+    rows = convert_columns(values, columns, types)
+    same = convert_columns(values.copy(), columns, types)
+    assert game_hash(rows) == game_hash(same)
+
+    values[1, 5] = 'TIMEOUT'
+    assert game_hash(rows) != game_hash(convert_columns(values, columns, types))
+
+
+class ChunkCursor(object):
+    description = [('game_id',), ('id',), ('play',)]
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, q, params=None):
+        pass
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+
+class ChunkConnection(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self, name=None):
+        return ChunkCursor(self.rows)
+
+
+def test_stream_games_yields_complete_games(monkeypatch):
+    rows = [(1, 1, 'JM'), (1, 2, 'DREB'), (1, 3, 'FOUL'), (2, 4, 'TPM'), (3, 5, 'JM'), (3, 6, 'FTM')]
+
+    @contextmanager
+    def connection():
+        yield ChunkConnection(rows)
+    monkeypatch.setattr(DB, 'connection', connection)
+
+    games = list(dbutil.stream_games("SELECT", chunk_size=2))
+    assert [game_id for game_id, df in games] == [1, 2, 3]
+    assert [df.id.tolist() for game_id, df in games] == [[1, 2, 3], [4], [5, 6]]
+
+
+def test_spool_when_unavailable_and_replay(tmpdir, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(dbutil.Spool, 'SPOOL_DIR', str(tmpdir))
+    loaded = []
+
+    def unavailable(rows):
+        raise psycopg2.OperationalError("server closed the connection")
+    monkeypatch.setitem(dbutil.LOADERS, 'box', unavailable)
+    rows = convert_columns(np.array([[7, 'A']], dtype=object), ['game_id', 'team'],
+                           {'game_id': 'int', 'team': 'text'})
+    assert dbutil.load_or_spool('box', rows) == 0
+    assert dbutil.replay_spool() == 0
+
+    monkeypatch.setitem(dbutil.LOADERS, 'box', loaded.append)
+    assert dbutil.replay_spool() == 1
+    assert loaded[0].values.tolist() == [[7, 'A']]
+    assert dbutil.Spool.batches() == []
+
+
+def merge(cur, *games):
+    """Merge games given as (game_id, dt, hteam_id, ateam_id, home_score, away_score, home_outcome)"""
+    values = np.array([[game_id, dt, hteam, ateam, None, False, None, outcome, 0, hscore, ascore]
+                       for game_id, dt, hteam, ateam, hscore, ascore, outcome in games],
+                      dtype=object)
+    rows = convert_columns(values, DB.COLUMNS['games'], DB.COLUMN_TYPES['games'])
+    return dbutil.merge_games(cur, rows)
+
+
+def stored_games(cur):
+    cur.execute(""" SELECT game_id, dt::text, hteam_id, ateam_id, home_score, away_score,
+                           home_outcome
+                    FROM {games} ORDER BY dt, hteam_id
+                """.format(games=DB.TABLES.get('games')))
+    return cur.fetchall()
+
+
+def create_games_tables(cur):
+    cur.execute(DBCreate.create_season_function())
+    cur.execute(DBCreate.create_games())
+    cur.execute(DBCreate.create_ingest_log())
+
+
+def test_merge_flips_to_stored_orientation(pg):
+    create_games_tables(pg)
+    merge(pg, (None, '2015-01-10', 1, 2, None, None, None),
+          (None, '2015-01-12', 1, 3, None, None, None))
+    # scraped from the other team's schedule
+    counts = merge(pg, (100, '2015-01-10', 2, 1, 60, 70, False),
+                   (None, '2015-01-12', 3, 1, None, None, None))
+    assert counts['flipped'] == 2
+    assert counts['scheduled'] == 0
+    assert stored_games(pg) == [(100, '2015-01-10', 1, 2, 70, 60, True),
+                                (None, '2015-01-12', 1, 3, None, None, None)]
+
+
+def test_merge_matches_null_teams(pg):
+    create_games_tables(pg)
+    # a game against a non-D1 opponent, scheduled then played
+    assert merge(pg, (None, '2015-01-10', 1, None, None, None, None))['scheduled'] == 1
+    assert merge(pg, (None, '2015-01-10', 1, None, None, None, None))['scheduled'] == 0
+    counts = merge(pg, (200, '2015-01-10', 1, None, 80, 50, True))
+    assert (counts['unplayed'], counts['played']) == (1, 0)
+    assert stored_games(pg) == [(200, '2015-01-10', 1, None, 80, 50, True)]
+
+
+def test_merge_schedules_games_without_game_id_once(pg):
+    create_games_tables(pg)
+    # copies left by merges that matched NULL teams with =
+    pg.executemany("INSERT INTO {games} (dt, hteam_id) VALUES (%s, %s)"
+                   .format(games=DB.TABLES.get('games')), [('2015-01-10', 1)] * 3)
+    counts = merge(pg, (None, '2015-01-10', 1, None, None, None, None),
+                   (None, '2015-01-11', 4, 5, None, None, None))
+    assert (counts['duplicates'], counts['scheduled']) == (2, 1)
+    assert stored_games(pg) == [(None, '2015-01-10', 1, None, None, None, None),
+                                (None, '2015-01-11', 4, 5, None, None, None)]
+
+
+def partitions(cur):
+    cur.execute(""" SELECT c.relname FROM pg_inherits i
+                    JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = to_regclass(%s)
+                    ORDER BY c.relname
+                """, (DB.TABLES.get('box'),))
+    return [row[0] for row in cur.fetchall()]
+
+
+def test_partitions_rolled_back_are_created_again(pg):
+    pg.execute(DBCreate.create_ncaa_box(partitioned=True))
+    pg.execute("SAVEPOINT load")
+    dbutil.ensure_season_partitions(pg, 'box', [2015, 2016.0, None])
+    assert partitions(pg) == ['box_stats_2015', 'box_stats_2016']
+    pg.execute("ROLLBACK TO SAVEPOINT load")
+    assert partitions(pg) == []
+    dbutil.ensure_season_partitions(pg, 'box', [2015])
+    assert partitions(pg) == ['box_stats_2015']
+
+
+def test_unpartitioned_table_gets_no_partitions(pg):
+    pg.execute(DBCreate.create_ncaa_box())
+    dbutil.ensure_season_partitions(pg, 'box', [2015])
+    pg.execute("SELECT to_regclass('box_stats_2015') IS NULL")
+    assert pg.fetchone()[0]
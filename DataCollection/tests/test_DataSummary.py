@@ -0,0 +1,69 @@
+from datetime import date
+
+import pandas as pd
+
+import DataCollection.ChangeLog as ChangeLog
+import DataCollection.DB as DB
+import DataCollection.DBCreate as DBCreate
+from DataCollection.DataSummary import DataSummarizer, WATERMARK
+
+
+def test_games_in_db_reads_season_coverage(monkeypatch):
+    coverage = pd.DataFrame({'games': [10, 4], 'box': [5, 4], 'raw_pbp': [0, 1], 'pbp': [0, 0]},
+                            index=pd.Index([2015, 2016], name='season'))
+    monkeypatch.setattr(DataSummarizer, 'coverage', staticmethod(lambda: coverage))
+    merged, in_db, total, pct = DataSummarizer().games_in_db(coverage[['games']],
+                                                             DB.TABLES.get('box'))
+    assert merged.in_db.tolist() == [5, 4]
+    assert (in_db, total) == (9, 14)
+    assert abs(pct - 9 / 14.) < 1e-9
+    assert DataSummarizer.season(date(2015, 6, 30)) == 2015
+    assert DataSummarizer.season(date(2015, 7, 1)) == 2016
+
+
+def create_coverage_tables(cur):
+    for q in [DBCreate.create_season_function(), DBCreate.create_games(),
+              DBCreate.create_ncaa_box(), DBCreate.create_raw_pbp(), DBCreate.create_pbp(),
+              DBCreate.create_game_coverage(), DBCreate.create_season_coverage(),
+              DBCreate.create_ingest_log(), DBCreate.create_watermarks()]:
+        cur.execute(q)
+    fmt = dict(games=DB.TABLES.get('games'), box=DB.TABLES.get('box'))
+    cur.execute(""" INSERT INTO {games} (game_id, dt)
+                    VALUES (1, '2014-12-01'), (2, '2015-01-05'), (3, '2015-11-20')
+                """.format(**fmt))
+    cur.execute("INSERT INTO {box} (game_id, season, team, first_name) VALUES (1, 2015, 'A', 'X')"
+                .format(**fmt))
+    cur.execute("INSERT INTO raw_pbp (game_id, season, first_name) VALUES (1, 2015, 'X'), "
+                "(2, 2015, 'X')")
+
+
+def coverage_rows():
+    return DataSummarizer.coverage()[['games', 'box', 'raw_pbp', 'pbp']].reset_index() \
+        .values.tolist()
+
+
+def test_first_refresh_covers_every_game(pg):
+    create_coverage_tables(pg)
+    assert not ChangeLog.has_watermark(WATERMARK)
+    DataSummarizer.refresh_coverage()
+    assert ChangeLog.has_watermark(WATERMARK)
+    assert coverage_rows() == [[2015, 2, 1, 2, 0], [2016, 1, 0, 0, 0]]
+
+
+def test_game_moved_to_another_season(pg):
+    create_coverage_tables(pg)
+    DataSummarizer.update_coverage(pg)
+    pg.execute("UPDATE {games} SET dt = '2015-11-01' WHERE game_id = 2"
+               .format(games=DB.TABLES.get('games')))
+    DataSummarizer.update_coverage(pg, [2])
+    assert coverage_rows() == [[2015, 1, 1, 1, 0], [2016, 2, 0, 1, 0]]
+
+
+def test_deleted_game_leaves_coverage(pg):
+    create_coverage_tables(pg)
+    DataSummarizer.update_coverage(pg)
+    pg.execute("DELETE FROM {games} WHERE game_id = 3".format(games=DB.TABLES.get('games')))
+    DataSummarizer.update_coverage(pg, [3])
+    pg.execute("SELECT count(*) FROM game_coverage WHERE game_id = 3")
+    assert pg.fetchone()[0] == 0
+    assert coverage_rows() == [[2015, 2, 1, 2, 0]]
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from DataCollection.DataWrangling import unstack_games
+
+
+def test_unstack_games():
+    games = pd.DataFrame({'game_id': [1, 2, 3],
+                          'dt': ['2014-12-01', '2015-03-20', '2015-11-15'],
+                          'hteam_id': [10, 30, 10],
+                          'ateam_id': [20, 10, 40],
+                          'home_score': [70, 55, None],
+                          'away_score': [60, 65, None],
+                          'neutral': [False, True, False]})
+    df = unstack_games(games)
+    assert df.shape[0] == 4
+    team10 = df[df.team == 10].set_index('game_id')
+    assert team10.opp.tolist() == [20, 30]
+    assert team10.score.tolist() == [70, 65]
+    assert team10.margin.tolist() == [10, 10]
+    assert team10.location.tolist() == ['H', 'N']
+    assert team10.outcome.tolist() == [True, True]
+    assert df.season.tolist() == [2015, 2015, 2015, 2015]
+    assert df[df.team == 20].outcome.tolist() == [False]
+    assert df.score.dtype == np.int64
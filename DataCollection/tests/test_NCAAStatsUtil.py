@@ -1,9 +1,5 @@
-from DataCollection.DB import DB
 from DataCollection.NCAAStatsUtil import NCAAStatsUtil as ncaa_util
 
-CONN = DB.conn
-CUR = CONN.cursor()
-
 def test_convert_ncaa_year_code():
     convert2012 = ncaa_util.convert_ncaa_year_code(2012)
     assert ncaa_util.convert_ncaa_year_code(convert2012) == 2012
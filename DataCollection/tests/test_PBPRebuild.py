@@ -0,0 +1,52 @@
+import DataCollection.ChangeLog as ChangeLog
+from DataCollection.PBPRebuild import (compare_errors, compare_rows, shadow_name, swap_partition,
+                                       swap_table, target_name)
+
+
+def test_names():
+    assert target_name('pbp', 2015, True) == 'pbp_2015'
+    assert target_name('pbp', 2015, False) == 'pbp'
+    assert shadow_name('pbp_2015', version=3) == 'pbp_2015_v3'
+
+
+def test_compare_rows():
+    assert compare_rows(0, 500) == []
+    assert compare_rows(1000, 1010) == []
+    assert compare_rows(1000, 900) == ["row count changes from 1000 to 900"]
+
+
+def test_compare_errors():
+    assert compare_errors((None, None), (40., 300.)) == []
+    assert compare_errors((30., 120.), (20., 130.)) == []
+    assert len(compare_errors((30., 120.), (50., 130.))) == 1
+
+
+class SwapCursor(object):
+    """Every table exists; the rows of the rebuilt seasons are in games 7 and 9"""
+
+    def __init__(self, log):
+        self.log = log
+        self.q = None
+
+    def execute(self, q, params=None):
+        self.log.append(q.split()[0])
+        self.q = q
+
+    def fetchone(self):
+        return (True,)
+
+    def fetchall(self):
+        return [(7,), (9,)] if self.q.startswith('SELECT game_id') else []
+
+
+def test_swaps_log_the_rebuilt_games(monkeypatch):
+    log = []
+    monkeypatch.setattr(ChangeLog, 'log_changes',
+                        lambda cur, table, game_ids, op: log.append((table, game_ids, op)))
+    swap_partition(SwapCursor(log), 'pbp', 2015)
+    # logged in the swap's transaction, before the old rows are dropped
+    assert log.index(('pbp', [7, 9], 'rebuild')) < log.index('DROP')
+
+    log = []
+    swap_table(SwapCursor(log), 'pbp', [2014, 2015])
+    assert log.index(('pbp', [7, 9], 'rebuild')) < log.index('DROP')
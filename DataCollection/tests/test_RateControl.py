@@ -0,0 +1,40 @@
+from DataCollection.RateControl import RateController
+
+HOST = 'stats.ncaa.org'
+
+
+def test_backs_off_on_errors():
+    controller = RateController(start_delay=0.5, max_delay=4., max_concurrency=4)
+    controller.record(HOST, 0.2, 503)
+    assert controller.delay(HOST) == 1.
+    controller.record(HOST, 0.2, 429)
+    controller.record(HOST, None, None)
+    controller.record(HOST, 0.2, 500)
+    assert controller.delay(HOST) == 4.
+    assert controller.concurrency(HOST) == 1
+    assert controller.error_rate(HOST) == 1.
+
+
+def test_speeds_up_when_healthy():
+    controller = RateController(window=10, start_delay=0.5, min_delay=0.1,
+                                max_concurrency=3, target_latency=1.)
+    for i in range(200):
+        controller.record(HOST, 0.2, 200)
+    assert controller.delay(HOST) == 0.1
+    assert controller.concurrency(HOST) == 3
+    assert abs(controller.rate(HOST) - 3 / 0.2) < 1e-6
+
+
+def test_slows_down_on_high_latency():
+    controller = RateController(window=10, start_delay=0.5, target_latency=1.)
+    for i in range(5):
+        controller.record(HOST, 3., 200)
+    assert controller.delay(HOST) > 0.5
+    assert controller.concurrency(HOST) == 1
+
+
+def test_hosts_are_independent():
+    controller = RateController(start_delay=0.5)
+    controller.record(HOST, 0.2, 503)
+    assert controller.delay(HOST) == 1.
+    assert controller.delay('kenpom.com') == 0.5
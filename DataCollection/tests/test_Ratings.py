@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('scipy')
+
+from DataCollection.Ratings import rate_season
+
+
+def test_rate_season_recovers_ratings():
+    rng = np.random.RandomState(0)
+    n_teams = 12
+    off = rng.normal(0, 8, n_teams)
+    dfn = rng.normal(0, 8, n_teams)
+    pace = rng.normal(0, 4, n_teams)
+    off -= off.mean()
+    dfn -= dfn.mean()
+    pace -= pace.mean()
+    rows = []
+    game_id = 0
+    dates = pd.date_range('2014-11-15', periods=40)
+    for i in range(n_teams):
+        for j in range(n_teams):
+            if i == j:
+                continue
+            game_id += 1
+            dt = dates[game_id % len(dates)]
+            neutral = game_id % 5 == 0
+            home_edge = 0. if neutral else 3.
+            poss = 68. + pace[i] + pace[j]
+            home_score = poss * (100. + off[i] + dfn[j] + home_edge) / 100.
+            away_score = poss * (100. + off[j] + dfn[i] - home_edge) / 100.
+            rows.append((game_id, dt, 100 + i, 100 + j, 'N' if neutral else 'H', home_score, poss))
+            rows.append((game_id, dt, 100 + j, 100 + i, 'N' if neutral else 'A', away_score, poss))
+    games = pd.DataFrame(rows, columns=['game_id', 'dt', 'team', 'opp', 'location', 'score',
+                                        'poss'])
+
+    ratings = rate_season(games, 2015)
+    assert ratings.as_of.nunique() == len(dates)
+    final = ratings[ratings.as_of == ratings.as_of.max()].set_index('team').sort_index()
+    assert final.shape[0] == n_teams
+    assert (final.season == 2015).all()
+    assert (final.games == 2 * (n_teams - 1)).all()
+    np.testing.assert_allclose(final.home_adv, 3., atol=1e-4)
+    np.testing.assert_allclose(final.adj_o - final.adj_o.mean(), off, atol=1e-4)
+    np.testing.assert_allclose(final.adj_d - final.adj_d.mean(), dfn, atol=1e-4)
+    np.testing.assert_allclose(final.adj_t, 68. + pace, atol=1e-4)
+
+    first = ratings[ratings.as_of == ratings.as_of.min()]
+    assert first.shape[0] == games[games.dt == dates[0]].team.nunique()
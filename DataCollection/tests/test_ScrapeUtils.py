@@ -0,0 +1,66 @@
+from datetime import date
+
+import pandas as pd
+
+from DataCollection.ScrapeUtils import ScheduleScraper, GameCanonicalizer
+
+
+def test_plan_refresh_covers_past_games():
+    games = pd.DataFrame({'dt': [date(2016, 1, 1), date(2016, 1, 2), date(2016, 1, 3),
+                                 date(2016, 3, 30)],
+                          'hteam_id': [1, 1, 4, 5],
+                          'ateam_id': [2, 3, 1, None]})
+    pages = ScheduleScraper.plan_refresh(games, today=date(2016, 2, 1))
+    assert pages == [(1, 2016)]
+
+    pages = ScheduleScraper.plan_refresh(games, today=date(2016, 2, 1), include_future=True)
+    assert pages == [(1, 2016), (5, 2016)]
+
+
+def test_plan_refresh_splits_seasons():
+    games = pd.DataFrame({'dt': [date(2015, 12, 1), date(2016, 12, 1)],
+                          'hteam_id': [1, 1],
+                          'ateam_id': [2, 2]})
+    pages = ScheduleScraper.plan_refresh(games, today=date(2017, 1, 1))
+    assert sorted(season for team, season in pages) == [2016, 2017]
+
+
+def test_canonicalizer_dedupes_by_game_id():
+    games = GameCanonicalizer()
+    row1 = [100, date(2016, 1, 1), 1, 2, 'B', False, None, True, 0, 70, 60]
+    row2 = [100, date(2016, 1, 1), 1, 2, 'A', False, None, True, 0, 70, 60]
+    assert games.add(row1)
+    assert not games.add(row2)
+    assert len(games.rows()) == 1
+
+
+def test_canonicalizer_orients_neutral_games():
+    games = GameCanonicalizer()
+    # the same neutral site game as listed on each team's page
+    row1 = [None, date(2016, 1, 1), 2, 1, 'A', True, 'Vegas', True, 0, 70, 60]
+    row2 = [100, date(2016, 1, 1), 1, 2, 'B', True, 'Vegas', False, 0, 60, 70]
+    assert games.add(row1)
+    assert not games.add(row2)
+    rows = games.rows()
+    assert len(rows) == 1
+    assert rows[0][0] == 100
+    assert rows[0][2:4] == [1, 2]
+    assert rows[0][7] is False
+    assert rows[0][9:] == [60, 70]
+    # the away team's name comes from the home team's page
+    assert rows[0][4] == 'B'
+
+
+def test_canonicalizer_drops_opp_string_when_flipping():
+    row = [None, date(2016, 1, 1), 2, 1, 'A', True, 'Vegas', True, 0, 70, 60]
+    assert GameCanonicalizer.canonical(row)[2:5] == [1, 2, None]
+    row = [None, date(2016, 1, 1), 1, 2, 'B', True, 'Vegas', False, 0, 60, 70]
+    assert GameCanonicalizer.canonical(row)[2:5] == [1, 2, 'B']
+
+
+def test_canonicalizer_claims_fetch_once():
+    games = GameCanonicalizer(fetched={5})
+    assert games.claim_fetch(100)
+    assert not games.claim_fetch(100)
+    assert not games.claim_fetch(5)
+    assert not games.claim_fetch(None)
@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+
+import pytest
+
+import DataCollection.ChangeLog as ChangeLog
+import DataCollection.DB as DB
+import DataCollection.Snapshot as Snapshot
+from DataCollection.Snapshot import read_manifest, stale_seasons, write_manifest
+
+
+def test_stale_seasons():
+    stored = {'2014': [10, 5], '2015': [20, 7], '2009': [1, 1]}
+    fingerprints = {'2014': [10, 5], '2015': [21, 9], '2016': [3, 2]}
+    assert stale_seasons(fingerprints, stored) == (['2015', '2016'], ['2009'])
+    assert stale_seasons(stored, stored) == ([], [])
+
+
+def test_manifest_roundtrip(tmpdir):
+    assert read_manifest(str(tmpdir)) == {}
+    manifest = {'games': {'2015': [20, 7]}}
+    write_manifest(manifest, str(tmpdir))
+    assert read_manifest(str(tmpdir)) == manifest
+
+
+def test_sync_always_scans_games(tmpdir, monkeypatch):
+    pytest.importorskip('pyarrow')
+    root = str(tmpdir)
+    write_manifest({'games': {'2015': [20, 7]}, 'box': {'2015': [300, 4]}}, root)
+
+    @contextmanager
+    def no_changes(consumer, tables):
+        yield dict((table, []) for table in tables)
+
+    @contextmanager
+    def connection():
+        yield None
+    scanned = []
+
+    def fingerprints(conn, table):
+        scanned.append(table)
+        return read_manifest(root)[table]
+    monkeypatch.setattr(ChangeLog, 'has_watermark', lambda consumer: True)
+    monkeypatch.setattr(ChangeLog, 'consume', no_changes)
+    monkeypatch.setattr(DB, 'connection', connection)
+    monkeypatch.setattr(Snapshot, 'season_fingerprints', fingerprints)
+
+    # a schedule run that only added games without a game_id logs nothing
+    assert Snapshot.sync(['games', 'box'], root) == {'games': [], 'box': []}
+    assert scanned == ['games']
@@ -0,0 +1,48 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+
+import DataCollection.DB as DB
+import DataCollection.Spool as Spool
+from DataCollection.BulkLoad import convert_columns
+
+pytest.importorskip('pyarrow')
+
+
+def test_write_read_roundtrip(tmpdir):
+    values = np.array([[10, 1, 0.5, 'JOHN', 'DOE', 'JM', 2, 0],
+                       [10, None, 1.0, u'Jos\xe9', None, 'FOUL', 2, 0]], dtype=object)
+    rows = convert_columns(values, DB.COLUMNS['raw_pbp'], DB.COLUMN_TYPES['raw_pbp'])
+    path = Spool.write('raw_pbp', rows, str(tmpdir))
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+
+    spooled = Spool.read(path)
+    assert list(spooled.columns) == DB.COLUMNS['raw_pbp']
+    assert spooled.values.tolist() == rows.values.tolist()
+    assert spooled.values[1, 3] == u'Jos\xe9'
+
+
+def test_spool_directories_are_private(tmpdir):
+    rows = convert_columns(np.array([[1, 2]], dtype=object), ['game_id', 'pts'],
+                           {'game_id': 'int', 'pts': 'int'})
+    path = Spool.write('box', rows, str(tmpdir.join('spool')))
+    for directory in [str(tmpdir.join('spool')), os.path.dirname(path)]:
+        assert stat.S_IMODE(os.stat(directory).st_mode) & 0o077 == 0
+
+
+def test_only_parquet_batches_are_replayed(tmpdir):
+    # pickled batches left by older versions are never loaded
+    tmpdir.mkdir('box').join('0000000001.000000-1-0.npz').write('')
+    assert Spool.batches(str(tmpdir)) == []
+
+
+def test_batches_oldest_first(tmpdir):
+    rows = convert_columns(np.array([[1, 2]], dtype=object), ['game_id', 'pts'],
+                           {'game_id': 'int', 'pts': 'int'})
+    first = Spool.write('raw_pbp', rows, str(tmpdir))
+    second = Spool.write('box', rows, str(tmpdir))
+    assert Spool.batches(str(tmpdir)) == [('raw_pbp', first), ('box', second)]
+    Spool.remove(first)
+    assert Spool.batches(str(tmpdir)) == [('box', second)]
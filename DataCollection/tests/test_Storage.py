@@ -0,0 +1,125 @@
+from datetime import date
+import sqlite3
+
+import numpy as np
+
+from DataCollection.BatchWriter import BatchWriter
+import DataCollection.DB as DB
+from DataCollection.BulkLoad import convert_columns
+import DataCollection.DBScrapeUtils as dbutil
+from DataCollection.NCAAStatsUtil import NCAAStatsUtil as ncaa_util
+import DataCollection.PBP as PBP
+from DataCollection.Storage import PostgresStorage, SQLiteStorage, get_storage
+
+
+def games(values):
+    return convert_columns(np.array(values, dtype=object), DB.COLUMNS['games'],
+                           DB.COLUMN_TYPES['games'])
+
+
+def test_sqlite_pipeline(tmpdir):
+    storage = get_storage('sqlite:%s' % tmpdir.join('cbb.db'))
+    assert isinstance(storage, SQLiteStorage)
+    storage.create_tables()
+    storage.upsert('games', games([[1, '2014-12-01', 10, 20, 'x', False, None, None, 0, None, None],
+                                   [2, '2015-01-05', 30, 40, 'y', False, None, True, 0, 70, 60],
+                                   [3, '2015-08-05', 50, 60, 'z', False, None, True, 0, 80, 60]]),
+                   key=['game_id'])
+    storage.upsert('games', games([[1, '2014-12-01', 10, 20, 'x', False, None, False, 0, 55, 66]]),
+                   key=['game_id'])
+    assert storage.execute("SELECT home_score, away_score FROM games_test WHERE game_id = 1") == \
+        [(55, 66)]
+
+    assert storage.pending_games('raw_pbp', date(2014, 7, 1), date(2015, 7, 1)) == [2, 1]
+    assert storage.pending_games('raw_pbp', season=2016) == [3]
+    assert storage.game_seasons([1, 2, 3]) == {1: 2015, 2: 2015, 3: 2016}
+
+    raw = convert_columns(np.array([[2, 30, 0.5, 'JOHN', 'DOE', 'JM', 2, 0],
+                                    [2, 40, 1.0, 'JANE', None, 'FOUL', 2, 0]], dtype=object),
+                          DB.COLUMNS['raw_pbp'], DB.COLUMN_TYPES['raw_pbp'])
+    storage.insert_events('raw_pbp', raw)
+    assert storage.pending_games('raw_pbp', date(2014, 7, 1), date(2015, 7, 1)) == [1]
+
+    game = storage.read_game('raw_pbp', 2)
+    assert game.play.tolist() == ['JM', 'FOUL']
+    assert game.season.tolist() == [2015, 2015]
+
+
+def test_sqlite_storage_is_shared_per_path(tmpdir):
+    path = 'sqlite:%s' % tmpdir.join('shared.db')
+    assert get_storage(path) is get_storage(path)
+    assert get_storage(path) is not get_storage('sqlite:%s' % tmpdir.join('other.db'))
+
+
+def test_discovery_reads_where_loaders_write(tmpdir, monkeypatch):
+    monkeypatch.setenv('CBB_STORAGE', 'sqlite:%s' % tmpdir.join('cbb.db'))
+    monkeypatch.setattr(PostgresStorage, 'pending_games', lambda self, *args, **kwargs: [7])
+    get_storage().create_tables()
+    dbutil.upsert_games(np.array([[2, '2015-01-05', 30, 40, 'y', False, None, True, 0, 70, 60]],
+                                 dtype=object))
+    assert dbutil.get_games_to_scrape(season=2015) == [ncaa_util.stats_link(2, 'box')]
+
+
+def test_sqlite_crawl_load_pbp_round_trip(tmpdir, monkeypatch):
+    monkeypatch.setenv('CBB_STORAGE', 'sqlite:%s' % tmpdir.join('cbb.db'))
+    storage = get_storage()
+    storage.create_tables()
+
+    # schedule crawl: one played game, one still to play, then the same
+    # game scraped from the away team's schedule
+    dbutil.upsert_games(np.array([[2, '2015-01-05', 30, 40, 'y', False, None, True, 0, 70, 60],
+                                  [None, '2015-03-01', 30, 50, 'z', False, None, None, 0,
+                                   None, None]], dtype=object))
+    counts = dbutil.upsert_games(np.array([[2, '2015-01-05', 40, 30, None, False, None, False, 0,
+                                            60, 70]], dtype=object))
+    assert counts['flipped'] == 1
+    assert storage.execute("SELECT game_id, hteam_id, home_score, opp_string FROM games_test "
+                           "ORDER BY dt") == [(2, 30, 70, 'y'), (None, 30, None, 'z')]
+    assert dbutil.get_games_to_scrape(season=2015, from_table='raw_pbp', link_type='pbp') == \
+        [ncaa_util.stats_link(2, 'pbp')]
+
+    # game crawl
+    raw = [[2, 30, 0.5, 'JOHN', 'DOE', 'JM', 2, 0],
+           [2, 40, 1.0, 'JANE', 'ROE', 'DREB', 2, 0],
+           [2, 40, 20.0, 'JANE', 'ROE', 'TPM', 2, 3],
+           [2, 30, 40.0, 'JOHN', 'DOE', 'DREB', 2, 3]]
+    box = [[2, 'A', 30, 'JOHN', 'DOE', 'G', 40] + [1] * 15,
+           [2, 'B', 40, 'JANE', 'ROE', 'F', 40] + [1] * 15]
+    with BatchWriter() as writer:
+        assert writer.write('raw_pbp', np.array(raw, dtype=object)) == 1
+        assert writer.write('box', np.array(box, dtype=object)) == 1
+    assert dbutil.get_games_to_scrape(season=2015, from_table='raw_pbp', link_type='pbp') == []
+    assert storage.pending_games('box', season=2015) == []
+    assert storage.execute("SELECT game_id, tbl FROM scrape_errors") == []
+
+    PBP.process_games(dbutil.stream_unprocessed_pbp(2015))
+    pbp = storage.read_game('pbp', 2)
+    assert pbp.play.tolist() == ['JM', 'DREB', 'TPM', 'DREB']
+    assert pbp.teamid.tolist() == [1, 0, 0, 1]
+    assert pbp.season.tolist() == [2015] * 4
+    assert list(dbutil.stream_unprocessed_pbp(2015)) == []
+
+    # a game scraped again replaces its raw pbp and is processed again
+    with BatchWriter() as writer:
+        assert writer.write('raw_pbp', np.array(raw[:2], dtype=object)) == 1
+    assert [game_id for game_id, rows in dbutil.stream_unprocessed_pbp(2015)] == [2]
+
+
+def test_sqlite_file_without_seasons_is_migrated(tmpdir):
+    path = str(tmpdir.join('old.db'))
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE games_test (game_id INTEGER, dt TEXT, hteam_id INTEGER, "
+                     "ateam_id INTEGER)")
+        conn.execute("CREATE TABLE box_stats (game_id INTEGER, team TEXT)")
+        conn.execute("CREATE TABLE url_errors (id INTEGER PRIMARY KEY, game_id INTEGER)")
+        conn.execute("INSERT INTO games_test VALUES (1, '2015-01-05', 1, 2), "
+                     "(2, '2015-11-20', 1, 3)")
+        conn.execute("INSERT INTO box_stats VALUES (1, 'A')")
+    conn.close()
+
+    storage = SQLiteStorage(path)
+    assert storage.pending_games('box', season=2016) == [2]
+    assert storage.execute("SELECT season FROM box_stats") == [(2015,)]
+    storage.create_tables()
+    assert storage.pending_games('box', season=2015) == []
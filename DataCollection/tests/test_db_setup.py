@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from db_setup import check_header, convert_chunk, kaggle_indexes, normalize, tables_to_load
+
+SEASONS = [('season', 'integer', False), ('dayzero', 'date', False),
+           ('regionw', 'text', False), ('regionx', 'text', True)]
+
+
+def test_header_matching():
+    assert normalize('RegularSeasonCompactResults.csv') == \
+        normalize('regular_season_compact_results.csv')
+    check_header('Seasons.csv', ['Season', 'Dayzero', 'RegionW', 'RegionX'], SEASONS)
+    with pytest.raises(ValueError):
+        check_header('Seasons.csv', ['Season', 'Dayzero', 'RegionX', 'RegionW'], SEASONS)
+
+
+def test_convert_chunk():
+    chunk = pd.DataFrame([['1985', '10/29/1984', 'East', ''],
+                          ['1986', '11/04/1985', 'East', 'West']], dtype=str)
+    rows = convert_chunk('Seasons.csv', chunk, SEASONS, 2)
+    assert rows.dayzero.tolist() == ['1984-10-29', '1985-11-04']
+    assert rows.regionx.tolist() == [None, 'West']
+
+    chunk.iloc[1, 0] = '1986.5'
+    with pytest.raises(ValueError) as e:
+        convert_chunk('Seasons.csv', chunk, SEASONS, 2)
+    assert 'Seasons.csv:3' in str(e.value)
+
+
+def test_kaggle_indexes():
+    assert kaggle_indexes('seeds') == [('seeds_season_team_idx',
+                                        'CREATE INDEX seeds_season_team_idx ON seeds (season, team)')]
+
+
+class CatalogCursor(object):
+    """Answers tables_to_load's catalog queries: every table exists, seeds references teams"""
+
+    def __init__(self):
+        self.params = None
+
+    def execute(self, q, params=None):
+        self.params = params
+
+    def fetchone(self):
+        return (True,)
+
+    def fetchall(self):
+        return [('seeds',)] if 'teams' in self.params[0] else []
+
+
+def test_referencing_tables_are_reloaded():
+    assert [table for table, _, _ in tables_to_load(CatalogCursor(), ['teams'])] == \
+        ['teams', 'seeds']
+    assert [table for table, _, _ in tables_to_load(CatalogCursor(), ['seasons'])] == \
+        ['seasons']
+    with pytest.raises(ValueError):
+        tables_to_load(CatalogCursor(), ['games'])
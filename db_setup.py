@@ -1,6 +1,18 @@
+import csv
+import os
+import re
+import sys
+import time
+
+import numpy as np
 import pandas as pd
 import psycopg2
-import sys
+
+from DataCollection.BulkLoad import copy_rows
+import DataCollection.DB as DB
+
+# csv rows validated and COPYed at a time
+CHUNK_ROWS = 100000
 
 def create_compact(cur):
     q = """ CREATE TABLE reg_compact
@@ -16,12 +28,6 @@ def create_compact(cur):
             )
         """
     cur.execute(q)
-    q = """ \COPY reg_compact
-            FROM 'regular_season_compact_results.csv'
-            DELIMITER ','
-            CSV HEADER;
-        """
-    cur.execute(q)
 
 
 def create_detailed(cur):
@@ -252,6 +258,184 @@ def create_pbp_detailed(cur):
 #         ON a.ncaa_game_id=b.ncaa_game_id
 #         ORDER BY a.dt"""
 
+# Kaggle March Madness files, the tables they load and the functions that
+# create them, in load order (seeds references seasons and teams)
+KAGGLE_TABLES = [("teams", "teams.csv", create_teams),
+                 ("seasons", "seasons.csv", create_seasons),
+                 ("seeds", "tourney_seeds.csv", create_seeds),
+                 ("reg_compact", "regular_season_compact_results.csv", create_compact),
+                 ("reg_detailed", "regular_season_detailed_results.csv", create_detailed)]
+# indexes built once a table is loaded instead of maintained row by row
+KAGGLE_INDEXES = {"reg_compact": [["season", "wteam"], ["season", "lteam"]],
+                  "reg_detailed": [["season", "wteam"], ["season", "lteam"]],
+                  "seeds": [["season", "team"]]}
+INT_TYPES = {"smallint", "integer", "bigint"}
+REAL_TYPES = {"real", "double precision", "numeric"}
+
+
+def normalize(name):
+    """Compare headers, columns and file names ignoring case, underscores and spaces"""
+    return re.sub(r"[^a-z0-9.]", "", name.lower())
+
+
+def find_csv(directory, filename):
+    """Path of filename in directory, also matching e.g. RegularSeasonCompactResults.csv"""
+    for name in os.listdir(directory):
+        if normalize(name) == normalize(filename):
+            return os.path.join(directory, name)
+    raise IOError("no %s in %s" % (filename, directory))
+
+
+def table_columns(cur, table):
+    """(name, data type, nullable) of each column of table, in order"""
+    cur.execute(""" SELECT column_name, data_type, is_nullable = 'YES'
+                    FROM information_schema.columns
+                    WHERE table_name = %s AND table_schema = current_schema()
+                    ORDER BY ordinal_position
+                """, (table,))
+    return cur.fetchall()
+
+
+def check_header(path, header, columns):
+    if [normalize(col) for col in header] != [normalize(col) for col, _, _ in columns]:
+        raise ValueError("%s: header %s does not match the table columns %s"
+                         % (path, ",".join(header), ",".join(col for col, _, _ in columns)))
+
+
+def convert_chunk(path, chunk, columns, first_line):
+    """
+    INPUT: STRING, DATAFRAME, LIST, INT
+    OUTPUT: DATAFRAME
+
+    Validate a chunk of csv text against the table's column types and
+    convert it for COPY: dates become ISO strings and empty fields NULL.
+    Raise ValueError naming the file line of the first bad value.
+    """
+    rows = pd.DataFrame(index=chunk.index)
+    for j, (col, data_type, nullable) in enumerate(columns):
+        text = chunk.iloc[:, j].str.strip()
+        missing = (text == "").values
+        values = text.values.astype(object)
+        if data_type in INT_TYPES:
+            bad = ~text.str.match(r"^[+-]?\d+$").values
+        elif data_type in REAL_TYPES:
+            bad = pd.to_numeric(text, errors="coerce").isnull().values
+        elif data_type == "date":
+            dates = pd.to_datetime(text, errors="coerce")
+            bad = dates.isnull().values
+            values = np.array([None if pd.isnull(d) else d.strftime("%Y-%m-%d") for d in dates],
+                              dtype=object)
+        else:
+            bad = np.zeros(len(text), dtype=bool)
+        bad = (bad & ~missing) | (missing & (not nullable))
+        if bad.any():
+            i = np.flatnonzero(bad)[0]
+            raise ValueError("%s:%d: bad %s value %r for column %s"
+                             % (path, first_line + i, data_type, chunk.iloc[i, j], col))
+        values[missing] = None
+        rows[col] = values
+    return rows
+
+
+def load_csv(cur, table, path, columns, chunk_rows=CHUNK_ROWS):
+    """Stream a csv into table a validated chunk at a time with COPY; return the row count"""
+    names = [col for col, _, _ in columns]
+    n = 0
+    for chunk in pd.read_csv(path, dtype=str, na_filter=False, chunksize=chunk_rows):
+        # line 1 is the header
+        rows = convert_chunk(path, chunk, columns, n + 2)
+        copy_rows(cur, table, names, rows)
+        n += rows.shape[0]
+    return n
+
+
+def kaggle_indexes(table):
+    """(name, CREATE INDEX query) of the indexes built after table is loaded"""
+    return [("{table}_{name}_idx".format(table=table, name="_".join(cols)),
+             "CREATE INDEX {table}_{name}_idx ON {table} ({cols})"
+             .format(table=table, name="_".join(cols), cols=", ".join(cols)))
+            for cols in KAGGLE_INDEXES.get(table, [])]
+
+
+def referencing_tables(cur, tables):
+    """Tables with a foreign key to any of tables"""
+    cur.execute(""" SELECT DISTINCT conrelid::regclass::text
+                    FROM pg_constraint
+                    WHERE contype = 'f' AND confrelid = ANY(%s::regclass[])
+                    AND conrelid <> confrelid
+                """, (sorted(tables),))
+    return set(row[0] for row in cur.fetchall())
+
+
+def tables_to_load(cur, tables=None):
+    """
+    INPUT: CURSOR, LIST
+    OUTPUT: LIST
+
+    KAGGLE_TABLES entries of tables (all of them if None), creating those
+    that are missing, plus the Kaggle tables that reference them: the
+    TRUNCATE empties those too, so they are reloaded from their files.
+    Raise ValueError if a table outside the Kaggle set references them.
+    """
+    names = set(table for table, _, _ in KAGGLE_TABLES)
+    wanted = set(names if tables is None else tables)
+    if len(wanted - names) > 0:
+        raise ValueError("not Kaggle tables: %s" % ", ".join(sorted(wanted - names)))
+    while True:
+        for table, _, create in KAGGLE_TABLES:
+            if table in wanted:
+                cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+                if not cur.fetchone()[0]:
+                    create(cur)
+        referencing = referencing_tables(cur, wanted) - wanted
+        if len(referencing - names) > 0:
+            raise ValueError("%s reference %s and would be emptied by the load"
+                             % (", ".join(sorted(referencing - names)), ", ".join(sorted(wanted))))
+        if len(referencing) == 0:
+            return [entry for entry in KAGGLE_TABLES if entry[0] in wanted]
+        wanted |= referencing
+
+
+def ingest(directory, tables=None):
+    """
+    INPUT: STRING, LIST
+    OUTPUT: DICT
+
+    Load the Kaggle csv files in directory into their tables, replacing what
+    the tables held, in one transaction. Tables referencing a loaded table
+    are reloaded with it (see tables_to_load). Every header is checked
+    against its table before anything is written. Rows are validated and
+    COPYed a chunk at a time, and indexes are built once the rows are in.
+    Return {table: (rows, COPY seconds, index seconds)}.
+    """
+    stats = {}
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        plan = []
+        for table, filename, create in tables_to_load(cur, tables):
+            path = find_csv(directory, filename)
+            columns = table_columns(cur, table)
+            with open(path) as f:
+                check_header(path, next(csv.reader(f)), columns)
+            plan.append((table, path, columns))
+        cur.execute("TRUNCATE %s" % ", ".join(table for table, _, _ in plan))
+
+        for table, path, columns in plan:
+            indexes = kaggle_indexes(table)
+            for name, _ in indexes:
+                cur.execute("DROP INDEX IF EXISTS %s" % name)
+            start = time.time()
+            n = load_csv(cur, table, path, columns)
+            copied = time.time()
+            for _, q in indexes:
+                cur.execute(q)
+            stats[table] = (n, copied - start, time.time() - copied)
+            print("%-13s %9d rows %7.1fs COPY %9.0f rows/sec %7.1fs indexes"
+                  % (table, n, stats[table][1], n / max(stats[table][1], 1e-6),
+                     stats[table][2]))
+    return stats
+
+
 if __name__ == "__main__":
-    for arg in sys.argv:
-        print arg
\ No newline at end of file
+    # python db_setup.py <kaggle csv directory> [table ...]
+    ingest(sys.argv[1], sys.argv[2:] or None)
\ No newline at end of file